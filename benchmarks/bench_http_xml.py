@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark of XML parsing of HTTP responses.
+
+Compare BeautifulSoup with ElementTree parsing on a 5 MB XML document.
+"""
+
+import os
+import sys
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from monitoring.nagios.probes.http import HTTPResponse, etree
+
+
+def make_response(size):
+    """Make a response with a XML document of about ``size`` bytes."""
+    alert = ('<alert id="{0}"><name>alert {0}</name>'
+             '<last_update>10:00</last_update><state>OK</state></alert>')
+    alerts = []
+    length = 0
+    while length < size:
+        alerts.append(alert.format(len(alerts)))
+        length += len(alerts[-1])
+    content = '<alerts>{0}</alerts>'.format(''.join(alerts))
+
+    response = requests.Response()
+    response.status_code = 200
+    response.encoding = 'utf-8'
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+def beautifulsoup(response):
+    """Former parsing path."""
+    return HTTPResponse(response).xml().find_all('alert')[-1]
+
+
+def element_tree(response):
+    """Parse with ElementTree."""
+    return HTTPResponse(response).etree().findall('alert')[-1]
+
+
+def element_tree_iterparse(response):
+    """Parse incrementally with ElementTree."""
+    for alert in HTTPResponse(response).iterxml('alert'):
+        state = alert.findtext('state')
+    return state
+
+
+def main():
+    """Run the benchmark and print results."""
+    response = make_response(5 * 1024 * 1024)
+    print 'Document: {0:.1f} MB, parser {1}'.format(
+        len(response.content) / 1024.0 / 1024, etree.__name__)
+    for func in (beautifulsoup, element_tree, element_tree_iterparse):
+        timer = timeit.Timer(lambda: func(response))
+        best = min(timer.repeat(repeat=3, number=1))
+        print '  {0:<24} {1:10.3f} ms'.format(func.__name__, best * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark of plugin startup.
+
+Measure in fresh processes the time from the import of the library to the
+first probe call of a HTTP plugin on a local server, then the time to create
+plugin instances in the same process.
+"""
+
+import os
+import sys
+import json
+import threading
+import subprocess
+import timeit
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+RUNS = 10
+
+# Run in a fresh process, prints the duration of each phase
+CHECK = """
+import sys, time, json
+start = time.time()
+sys.path.insert(0, {root!r})
+from monitoring.nagios.plugin import NagiosPluginHTTP
+imported = time.time()
+sys.argv = ['check_bench', '-H', '127.0.0.1', '-p', '{port}']
+plugin = NagiosPluginHTTP()
+initialized = time.time()
+plugin.http.get('/')
+done = time.time()
+print json.dumps({{'import': imported - start,
+                  'init': initialized - imported,
+                  'first_call': done - initialized,
+                  'total': done - start}})
+"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answer OK to any GET request."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('OK')
+
+    def log_message(self, *args):
+        pass
+
+
+def median(values):
+    """Return the median of ``values``."""
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    """Run the benchmark and print results."""
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    code = CHECK.format(root=ROOT, port=server.server_port)
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', code]))
+            for _ in xrange(RUNS)]
+    server.shutdown()
+
+    print 'Fresh process, median of {0} runs:'.format(RUNS)
+    for phase in ('import', 'init', 'first_call', 'total'):
+        print '  {0:<24} {1:10.3f} ms'.format(
+            phase, median(run[phase] for run in runs) * 1000)
+
+    from monitoring.nagios.plugin import NagiosPluginHTTP
+    sys.argv = ['check_bench', '-H', '127.0.0.1']
+    timer = timeit.Timer(NagiosPluginHTTP)
+    best = min(timer.repeat(repeat=3, number=100)) / 100
+    print 'Same process:'
+    print '  {0:<24} {1:10.3f} ms'.format('init', best * 1000)
+
+
+if __name__ == '__main__':
+    main()
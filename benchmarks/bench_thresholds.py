@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark of threshold tests on many values.
+
+Compare testing each value against warning and critical thresholds in a
+Python loop with :func:`check_thresholds`, with and without NumPy. Then
+compare parsing thresholds of many items with the cached :func:`threshold`
+factory.
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from monitoring.nagios.plugin import argument
+from monitoring.nagios.plugin.argument import (NagiosThreshold,
+                                               check_thresholds, threshold)
+
+WARNING = NagiosThreshold('80')
+CRITICAL = NagiosThreshold('90')
+
+
+def loop(values):
+    """Test each value as plugins do."""
+    statuses = []
+    for value in values:
+        if CRITICAL.test(value):
+            statuses.append(2)
+        elif WARNING.test(value):
+            statuses.append(1)
+        else:
+            statuses.append(0)
+    return statuses
+
+
+def vectorised(values):
+    """Test all values at once."""
+    return check_thresholds(values, WARNING, CRITICAL)
+
+
+def pure_python(values):
+    """Test all values at once without NumPy."""
+    saved = argument.numpy, argument._numpy_imported
+    argument.numpy, argument._numpy_imported = None, True
+    try:
+        return check_thresholds(values, WARNING, CRITICAL)
+    finally:
+        argument.numpy, argument._numpy_imported = saved
+
+
+def parse(specs):
+    """Parse each threshold."""
+    return [NagiosThreshold(spec) for spec in specs]
+
+
+def parse_cached(specs):
+    """Get each threshold from the cache."""
+    return [threshold(spec) for spec in specs]
+
+
+def main():
+    """Run the benchmark and print results."""
+    funcs = [loop, pure_python]
+    if argument._import_numpy() is not None:
+        funcs.append(vectorised)
+    else:
+        print 'NumPy is not installed.'
+
+    for count in (500, 100000):
+        values = [random.uniform(0, 100) for _ in xrange(count)]
+        print 'Values: {0}'.format(count)
+        for func in funcs:
+            timer = timeit.Timer(lambda: func(values))
+            best = min(timer.repeat(repeat=3, number=5)) / 5
+            print '  {0:<24} {1:10.3f} ms'.format(func.__name__, best * 1000)
+
+    specs = [random.choice(['80', '90', '@0:5', '~:100', '10:'])
+             for _ in xrange(1000)]
+    print 'Thresholds: {0}'.format(len(specs))
+    for func in (parse, parse_cached):
+        timer = timeit.Timer(lambda: func(specs))
+        best = min(timer.repeat(repeat=3, number=5)) / 5
+        print '  {0:<24} {1:10.3f} ms'.format(func.__name__, best * 1000)
+
+
+if __name__ == '__main__':
+    main()
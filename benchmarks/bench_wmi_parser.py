@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark of the wmic output parser.
+
+Compare the streaming parser with the former ``csv.DictReader`` based parsing
+on a large ``Win32_PerfRawData_PerfProc_Process`` like output.
+"""
+
+import os
+import sys
+import csv
+import timeit
+from pprint import pformat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from monitoring.nagios.probes.wmi import parse_wmic_output
+
+COLUMNS = ['Name', 'IDProcess', 'PercentProcessorTime', 'Timestamp_PerfTime',
+           'Frequency_PerfTime', 'WorkingSet', 'Caption']
+SCHEMAS = {'Win32_PerfRawData_PerfProc_Process': {
+    'IDProcess': int,
+    'PercentProcessorTime': int,
+    'Timestamp_PerfTime': int,
+    'Frequency_PerfTime': int,
+    'WorkingSet': int,
+}}
+
+
+def make_output(rows):
+    """Generate a fake wmic output of ``rows`` rows."""
+    lines = ['CLASS: Win32_PerfRawData_PerfProc_Process', '|'.join(COLUMNS)]
+    for i in xrange(rows):
+        lines.append('process{0}|{0}|{1}|130412345678|2929697|{2}|(null)'
+                     .format(i, i * 156250, i * 4096))
+    return '\n'.join(lines) + '\n'
+
+
+def former_parsing(output):
+    """Parsing as done before the streaming parser."""
+    lines = output.splitlines()[1:]
+    results = list(csv.DictReader(lines, delimiter='|'))
+    pformat(results)
+    return results
+
+
+def streaming_parsing(output):
+    """Parsing with typed values."""
+    return list(parse_wmic_output(output.splitlines(True), SCHEMAS))
+
+
+def streaming_first_match(output):
+    """Stop parsing as soon as a record is found."""
+    for record in parse_wmic_output(output.splitlines(True), SCHEMAS):
+        if record['Name'] == 'process100':
+            return record
+
+
+def main():
+    """Run the benchmark and print results."""
+    for rows in (100, 10000):
+        output = make_output(rows)
+        print 'Rows: {0}'.format(rows)
+        for func in (former_parsing, streaming_parsing,
+                     streaming_first_match):
+            timer = timeit.Timer(lambda: func(output))
+            best = min(timer.repeat(repeat=3, number=5)) / 5
+            print '  {0:<24} {1:10.3f} ms'.format(func.__name__, best * 1000)
+
+
+if __name__ == '__main__':
+    main()
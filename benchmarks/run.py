@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmark suite of the plugin framework.
+
+Probes and plugins are run against local stand-ins of the monitored services
+(see :mod:`standins`) to measure the latency and throughput of the library
+itself. Results are printed and can be written as a JSON report to compare
+versions::
+
+ python benchmarks/run.py --output before.json
+ python benchmarks/run.py --iterations 500 http_get snmp_get
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import standins
+import monitoring.nagios
+from monitoring.nagios.plugin import NagiosPlugin, NagiosPluginWMI, PerfData
+from monitoring.nagios.probes import ProbeSNMP, ProbeSSH, ProbeHTTP, ProbeMSSQL
+from monitoring.nagios.probes.snmppoller import SNMPPoller
+
+SYS_DESCR = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+IF_DESCR = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+INTERFACES = 50
+FLEET = 50
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+
+WMIC_OUTPUT = 'CLASS: Win32_Service\nName|State|StartMode\n' + ''.join(
+    'service{0}|Running|Auto\n'.format(i) for i in xrange(200))
+
+
+def statistics(latencies, elapsed):
+    """Return the statistics of a benchmark from the latencies of calls."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return OrderedDict([
+        ('iterations', count),
+        ('ops_per_sec', count / elapsed if elapsed else None),
+        ('mean_ms', sum(latencies) / count * 1000),
+        ('p50_ms', latencies[count // 2] * 1000),
+        ('p95_ms', latencies[min(count - 1, int(count * 0.95))] * 1000),
+        ('max_ms', latencies[-1] * 1000),
+    ])
+
+
+def measure(func, iterations):
+    """Call ``func`` ``iterations`` times after a warm up call."""
+    func()
+    latencies = []
+    start = time.time()
+    for _ in xrange(iterations):
+        call_start = time.time()
+        func()
+        latencies.append(time.time() - call_start)
+    return statistics(latencies, time.time() - start)
+
+
+def make_plugin(cls, *args):
+    """Create a plugin instance with command line ``args``."""
+    sys.argv = ['check_benchmark', '-H', '127.0.0.1'] + list(args)
+    return cls()
+
+
+# Benchmarks: each takes the number of iterations and returns statistics
+def bench_snmp_get(iterations):
+    """SNMP v2c GET of one OID."""
+    agent = standins.SNMPResponder({SYS_DESCR: 'Linux benchmark'})
+    try:
+        probe = ProbeSNMP('127.0.0.1', agent.port, community='public',
+                          snmp_version=1)
+        oids = {'sysDescr': '.'.join(map(str, SYS_DESCR))}
+        return measure(lambda: probe.get(oids), iterations)
+    finally:
+        agent.stop()
+
+
+def bench_snmp_walk(iterations):
+    """SNMP v2c walk of a table column of 50 rows."""
+    agent = standins.SNMPResponder(dict(
+        (IF_DESCR + (index,), 'eth{0}'.format(index))
+        for index in xrange(1, INTERFACES + 1)))
+    try:
+        probe = ProbeSNMP('127.0.0.1', agent.port, community='public',
+                          snmp_version=1)
+        oids = {'ifDescr': '.'.join(map(str, IF_DESCR))}
+        return measure(lambda: probe.getnext(oids), iterations)
+    finally:
+        agent.stop()
+
+
+def bench_snmp_find(iterations):
+    """SNMP v2c walk stopping at the 3rd row of a table column of 50 rows."""
+    agent = standins.SNMPResponder(dict(
+        (IF_DESCR + (index,), 'eth{0}'.format(index))
+        for index in xrange(1, INTERFACES + 1)))
+    try:
+        probe = ProbeSNMP('127.0.0.1', agent.port, community='public',
+                          snmp_version=1)
+        column = '.'.join(map(str, IF_DESCR))
+
+        def find():
+            for value in probe.walk(column):
+                if str(value) == 'eth3':
+                    return value.index
+
+        return measure(find, iterations)
+    finally:
+        agent.stop()
+
+
+def bench_snmp_fleet_probes(iterations):
+    """SNMP v2c GET on 50 agents, one ProbeSNMP each, 10 threads."""
+    agents = [standins.SNMPResponder({SYS_UPTIME: 1000})
+              for _ in xrange(FLEET)]
+    pool = ThreadPool(10)
+    try:
+        probes = [ProbeSNMP('127.0.0.1', agent.port, community='public',
+                            snmp_version=1) for agent in agents]
+        oids = {'uptime': '.'.join(map(str, SYS_UPTIME))}
+        return measure(lambda: pool.map(lambda probe: probe.get(oids),
+                                        probes), iterations)
+    finally:
+        pool.close()
+        for agent in agents:
+            agent.stop()
+
+
+def bench_snmp_fleet_poller(iterations):
+    """SNMP v2c GET on 50 agents through the shared socket of a poller."""
+    agents = [standins.SNMPResponder({SYS_UPTIME: 1000})
+              for _ in xrange(FLEET)]
+    poller = SNMPPoller()
+    try:
+        addresses = [('127.0.0.1', agent.port) for agent in agents]
+
+        def poll():
+            requests = [poller.send(address, 'public', 1, 'get',
+                                    [SYS_UPTIME]) for address in addresses]
+            return [request.wait() for request in requests]
+
+        return measure(poll, iterations)
+    finally:
+        poller.close()
+        for agent in agents:
+            agent.stop()
+
+
+def bench_ssh_execute(iterations):
+    """SSH command execution on an established connection."""
+    server = standins.SSHServer({'uptime': (' 10:00:00 up 3 days\n', 0)})
+    try:
+        probe = ProbeSSH('127.0.0.1', server.port, 'nagios', 'secret')
+        try:
+            return measure(lambda: probe.execute('uptime'), iterations)
+        finally:
+            probe.close()
+    finally:
+        server.stop()
+
+
+def bench_http_get(iterations):
+    """HTTP GET of a small JSON document with keep-alive."""
+    server = standins.LocalHTTPServer({
+        '/status': ('application/json', '{"status": "ok", "queues": 4}')})
+    try:
+        probe = ProbeHTTP('127.0.0.1', port=server.port)
+        return measure(lambda: probe.get('/status').json(), iterations)
+    finally:
+        server.stop()
+
+
+def bench_wmi_execute(iterations):
+    """WMI query of 200 records through the plugin and wmic."""
+    wmic = standins.FakeWMIC(WMIC_OUTPUT)
+    try:
+        plugin = make_plugin(NagiosPluginWMI, '-l', 'nagios', '-p', 'secret',
+                             '-d', 'CORP')
+        query = 'SELECT Name, State, StartMode FROM Win32_Service'
+        return measure(lambda: plugin.execute(query), iterations)
+    finally:
+        wmic.stop()
+
+
+def bench_mssql_execute(iterations):
+    """SQL query of 100 rows through the MSSQL probe, server stubbed."""
+    rows = [{'name': 'db{0}'.format(i), 'size': i * 1024}
+            for i in xrange(100)]
+    with standins.mssql_stub(rows):
+        probe = ProbeMSSQL('127.0.0.1', 'nagios', 'secret')
+        query = 'SELECT name, size FROM sys.master_files'
+        return measure(lambda: probe.execute(query).fetchall(), iterations)
+
+
+def bench_retention(iterations):
+    """Retention save then load of 1000 records."""
+    directory = tempfile.mkdtemp()
+    try:
+        plugin = make_plugin(NagiosPlugin)
+        picklefile = os.path.join(directory, 'benchmark.pkl')
+        records = [{'timestamp': i, 'value': i * 1.5} for i in xrange(1000)]
+
+        def save_load():
+            plugin.save_data(records, picklefile=picklefile)
+            plugin.load_data(picklefile)
+
+        return measure(save_load, iterations)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_output(iterations):
+    """Output of 1000 long output lines and 100 perfdata."""
+    plugin = make_plugin(NagiosPlugin)
+    plugin.shortoutput = 'CRITICAL: 12 of 1000 ports are down'
+    plugin.longoutput = ['Port {0} is up'.format(i) for i in xrange(1000)]
+    plugin.perfdata = [PerfData('port {0} traffic'.format(i), i * 1.5, 'B',
+                                min=0) for i in xrange(100)]
+    return measure(lambda: plugin.output(long_output_limit=None), iterations)
+
+
+BENCHMARKS = OrderedDict(
+    (name[len('bench_'):], func) for name, func in sorted(globals().items())
+    if name.startswith('bench_'))
+
+
+def main():
+    """Run the benchmarks, print results and write the report."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='Benchmarks to run, all by default: '
+                             '{0}.'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('-n', '--iterations', type=int, default=200,
+                        help='Number of calls by benchmark (default 200).')
+    parser.add_argument('-o', '--output',
+                        help='Write the JSON report to this file.')
+    options = parser.parse_args()
+
+    names = options.benchmarks or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: {0}'.format(', '.join(unknown)))
+
+    report = OrderedDict([
+        ('library_version', monitoring.nagios.__version__),
+        ('python_version', platform.python_version()),
+        ('hostname', socket.gethostname()),
+        ('timestamp', time.time()),
+        ('results', OrderedDict()),
+    ])
+
+    print '{0:<16} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'Benchmark', 'ops/s', 'mean ms', 'p95 ms', 'max ms')
+    for name in names:
+        result = BENCHMARKS[name](options.iterations)
+        report['results'][name] = result
+        print '{0:<16} {ops_per_sec:>10.1f} {mean_ms:>10.3f} ' \
+              '{p95_ms:>10.3f} {max_ms:>10.3f}'.format(name, **result)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
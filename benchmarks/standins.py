@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Local stand-ins of the monitored services, used by the benchmark suite.
+
+Each stand-in runs in a thread of the benchmark process and listens on a
+random port of the loopback interface. Call ``stop()`` when done.
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import ssh
+import pymssql
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.type import univ
+from pysnmp.proto import api
+
+# Connections reset by clients are expected
+logging.getLogger('ssh.transport').setLevel(logging.CRITICAL)
+
+
+class SNMPResponder(object):
+    """
+    A SNMP v1/v2c agent answering GET, GETNEXT and GETBULK requests from a
+    dict of OID tuples to values.
+
+    :param oids: values by OID, like ``{(1, 3, 6, 1, 2, 1, 1, 1, 0): 'Linux'}``.
+                 Integers are sent as ``Integer``, others as ``OctetString``.
+    :type oids: dict
+    :param versions: the SNMP versions answered, ``0`` for v1 and ``1`` for
+                     v2c, requests of other versions are ignored.
+    :type versions: tuple
+    :param max_repetitions: GETBULK requests with a greater max-repetitions
+                            get a ``tooBig`` error.
+    :type max_repetitions: int
+    """
+    def __init__(self, oids, versions=(0, 1), max_repetitions=None):
+        self.oids = sorted(oids.iteritems())
+        self.versions = versions
+        self.max_repetitions = max_repetitions
+        self.requests = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self._running = True
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the responder."""
+        self._running = False
+        self.socket.close()
+
+    def _value(self, pmod, value):
+        """Convert a Python value to a SNMP value."""
+        if isinstance(value, (int, long)):
+            return pmod.Integer(value)
+        return pmod.OctetString(value)
+
+    def _lookup(self, pmod, oid, exact):
+        """Return the varbind of ``oid`` or of the next one."""
+        oid = tuple(oid)
+        for candidate, value in self.oids:
+            if (exact and candidate == oid) or \
+                    (not exact and candidate > oid):
+                return candidate, self._value(pmod, value)
+        if exact:
+            return oid, api.v2c.NoSuchObject()
+        return oid, api.v2c.EndOfMibView()
+
+    def _serve(self):
+        while self._running:
+            try:
+                message, address = self.socket.recvfrom(65535)
+            except socket.error:
+                return
+            self.requests += 1
+            version = int(api.decodeMessageVersion(message))
+            if version not in self.versions:
+                continue
+            pmod = api.protoModules[version]
+            request, _ = decoder.decode(message, asn1Spec=pmod.Message())
+            response = pmod.apiMessage.getResponse(request)
+            request_pdu = pmod.apiMessage.getPDU(request)
+            response_pdu = pmod.apiMessage.getPDU(response)
+            oids = [oid for oid, _ in
+                    pmod.apiPDU.getVarBinds(request_pdu)]
+
+            if request_pdu.isSameTypeWith(pmod.GetRequestPDU()):
+                varbinds = [self._lookup(pmod, oid, True) for oid in oids]
+            elif request_pdu.isSameTypeWith(pmod.GetNextRequestPDU()):
+                varbinds = [self._lookup(pmod, oid, False) for oid in oids]
+            elif version == api.protoVersion2c and \
+                    request_pdu.isSameTypeWith(pmod.GetBulkRequestPDU()):
+                repetitions = pmod.apiBulkPDU.getMaxRepetitions(request_pdu)
+                varbinds = []
+                if self.max_repetitions and \
+                        repetitions > self.max_repetitions:
+                    pmod.apiPDU.setErrorStatus(response_pdu, 1)
+                    oids = []
+                for oid in oids:
+                    for _ in xrange(int(repetitions)):
+                        oid, value = self._lookup(pmod, oid, False)
+                        varbinds.append((oid, value))
+            else:
+                varbinds = []
+                pmod.apiPDU.setErrorStatus(response_pdu, 5)
+
+            # SNMP v1 has no exception values but a noSuchName error
+            if version == api.protoVersion1:
+                for index, (oid, value) in enumerate(varbinds):
+                    if isinstance(value, univ.Null):
+                        varbinds = [(name, pmod.Null()) for name in oids]
+                        pmod.apiPDU.setErrorStatus(response_pdu, 2)
+                        pmod.apiPDU.setErrorIndex(response_pdu, index + 1)
+                        break
+
+            pmod.apiPDU.setVarBinds(response_pdu, varbinds)
+            try:
+                self.socket.sendto(encoder.encode(response), address)
+            except socket.error:
+                return
+
+
+class _SSHServerInterface(ssh.ServerInterface):
+    """Accept any password and exec requests."""
+    def __init__(self, server):
+        self.server = server
+
+    def check_auth_password(self, username, password):
+        return ssh.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return ssh.OPEN_SUCCEEDED
+        return ssh.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        output, status = self.server.commands.get(command, ('', 127))
+        threading.Thread(target=self._run,
+                         args=(channel, output, status)).start()
+        return True
+
+    @staticmethod
+    def _run(channel, output, status):
+        # The client closes the channel: closing it here may happen before
+        # the exec request is acknowledged
+        channel.sendall(output)
+        channel.send_exit_status(status)
+        channel.shutdown_write()
+
+
+class SSHServer(object):
+    """
+    A SSH server accepting any password and answering exec requests from a
+    dict of command to ``(output, exit status)``.
+
+    :param commands: answers by command.
+    :type commands: dict
+    """
+    host_key = None
+
+    def __init__(self, commands):
+        if SSHServer.host_key is None:
+            SSHServer.host_key = ssh.RSAKey.generate(1024)
+        self.commands = commands
+        self.transports = []
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(16)
+        self.port = self.socket.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the server and close connections."""
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except socket.error:
+                return
+            transport = ssh.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=_SSHServerInterface(self))
+            self.transports.append(transport)
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    """Serve the content of ``server.pages`` by path."""
+    protocol_version = 'HTTP/1.1'
+
+    # Send headers and body in one segment
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        content_type, body = self.server.pages.get(self.path,
+                                                   ('text/plain', None))
+        status = 200
+        if body is None:
+            status, body = 404, 'Not found'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    A HTTP/1.1 server with keep-alive serving a dict of path to
+    ``(content type, body)``.
+
+    :param pages: pages by path.
+    :type pages: dict
+    """
+    daemon_threads = True
+
+    def __init__(self, pages):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _HTTPHandler)
+        self.pages = pages
+        self.connections = []
+        self.port = self.server_port
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_error(self, request, client_address):
+        pass
+
+    def stop(self):
+        """Stop the server and close kept alive connections."""
+        self.shutdown()
+        self.server_close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+_FAKE_WMIC_SCRIPT = """#!{python}
+import sys, json, time
+with open('{output_file}') as output_file:
+    data = json.load(output_file)
+query = sys.argv[-1]
+time.sleep(data['delays'].get(query, 0))
+if query not in data['outputs']:
+    sys.stdout.write('ERROR: Retrieve result data.\\n')
+    sys.exit(1)
+sys.stdout.write(data['outputs'][query])
+"""
+
+
+class FakeWMIC(object):
+    """
+    A ``wmic`` executable printing ``output``, installed first in ``PATH``.
+
+    ``output`` is either what ``wmic`` prints for any query, or a dict of
+    outputs by query. With a dict, an unknown query makes ``wmic`` exit with
+    status 1, and ``delays`` gives the seconds to wait before answering a
+    query.
+
+    :param output: what ``wmic`` prints.
+    :type output: str, dict
+    :param delays: seconds to wait by query.
+    :type delays: dict
+    """
+    def __init__(self, output, delays=None):
+        self.directory = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.directory, 'output')
+        executable = os.path.join(self.directory, 'wmic')
+
+        if isinstance(output, dict):
+            with open(self.output_file, 'w') as output_file:
+                json.dump({'outputs': output, 'delays': delays or {}},
+                          output_file)
+            with open(executable, 'w') as script:
+                script.write(_FAKE_WMIC_SCRIPT.format(
+                    python=sys.executable, output_file=self.output_file))
+        else:
+            with open(self.output_file, 'w') as output_file:
+                output_file.write(output)
+            with open(executable, 'w') as script:
+                script.write('#!/bin/sh\nexec cat {0}\n'.format(
+                    self.output_file))
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+
+        self._path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([self.directory, self._path])
+
+    def stop(self):
+        """Restore ``PATH`` and remove the executable."""
+        os.environ['PATH'] = self._path
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+
+class _StubCursor(object):
+    """A pymssql cursor returning the rows of its connection."""
+    def __init__(self, rows):
+        self._rows = rows
+        self.query = None
+
+    def execute(self, query):
+        self.query = query
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class _StubConnection(object):
+    """A pymssql connection giving stub cursors."""
+    def __init__(self, rows):
+        self._rows = rows
+
+    def cursor(self):
+        return _StubCursor(self._rows)
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def mssql_stub(rows):
+    """
+    Replace ``pymssql.connect`` by a stub whose cursors return ``rows`` for
+    any query.
+
+    :param rows: the rows, dicts as with ``as_dict=True``.
+    :type rows: list
+    """
+    connect = pymssql.connect
+    pymssql.connect = lambda *args, **kwargs: _StubConnection(rows)
+    try:
+        yield
+    finally:
+        pymssql.connect = connect
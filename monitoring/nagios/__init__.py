@@ -1,3 +1,4 @@
 import monitoring.nagios.logger
+import monitoring.nagios.profiling
 
 __version__ = '1.3.5'
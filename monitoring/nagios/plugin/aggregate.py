@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+This module contains the plugin checking a metric on a group of hosts, like
+the nodes of a cluster, with thresholds on aggregate values.
+"""
+
+import re
+import argparse
+import logging
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from monitoring.nagios.plugin import NagiosPlugin, PerfData
+from monitoring.nagios.plugin import argument
+from monitoring.nagios.plugin.output import format_number
+from monitoring.nagios.runner import _thread_local_stream
+
+logger = logging.getLogger("monitoring.nagios.plugin.aggregate")
+
+#: Names of the aggregate functions usable in thresholds.
+AGGREGATES = ('min', 'max', 'avg', 'count_ok')
+
+# Status names, worst last
+_STATUSES = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN')
+
+# Order of host lines in long output, worst first
+_SEVERITY = {0: 0, 1: 2, 2: 3, 3: 1}
+
+# Status printed by Nagios exceptions before the message
+_STATUS_PREFIX = re.compile(r'^(OK|WARNING|CRITICAL|UNKNOWN) - ')
+
+
+def aggregate_threshold(spec):
+    """
+    Argument type for a threshold on an aggregate function, given as
+    ``function=threshold``.
+
+    **Example**::
+
+     >>> function, threshold = aggregate_threshold("count_ok=3:")
+     >>> function, str(threshold)
+     ('count_ok', '< 3')
+
+    :param spec: the function and the Nagios threshold.
+    :type spec: str, unicode
+    :returns: tuple ``(function, NagiosThreshold)``
+    :raises: argparse.ArgumentTypeError
+    """
+    function, sep, threshold = spec.partition('=')
+    if not sep or function not in AGGREGATES:
+        raise argparse.ArgumentTypeError(
+            'Aggregate threshold "{0}" must be FUNCTION=THRESHOLD, FUNCTION '
+            'in {1} !'.format(spec, ', '.join(AGGREGATES)))
+    return function, argument.threshold(threshold)
+
+
+class HostResult(object):
+    """
+    The result of the probe on one host.
+
+    :param host: the host.
+    :param value: the value returned by the probe, ``None`` on error.
+    :param status: the status of the host, ``0`` to ``3``.
+    :param error: the error message if the probe failed.
+    """
+    __slots__ = ('host', 'value', 'status', 'error')
+
+    def __init__(self, host, value=None, status=0, error=None):
+        self.host = host
+        self.value = value
+        self.status = status
+        self.error = error
+
+    def __str__(self):
+        if self.error is not None:
+            detail = self.error
+        else:
+            detail = format_number(self.value)
+        return '{0} {1}: {2}'.format(_STATUSES[self.status], self.host,
+                                     detail)
+
+    def __repr__(self):
+        return '<HostResult {0}>'.format(self)
+
+
+class NagiosPluginAggregate(NagiosPlugin):
+    """
+    Base plugin checking the same metric on several hosts at once.
+
+    Override :meth:`probe` to get the metric of one host. Hosts are probed
+    concurrently by a pool of threads and the check status is given by
+    thresholds on aggregate values of all hosts: ``min``, ``max``, ``avg``
+    and ``count_ok``, the number of hosts in OK status.
+
+    Example, at least 3 healthy web nodes::
+
+     class CheckWebNodes(NagiosPluginAggregate):
+         def probe(self, host):
+             response = ProbeHTTP(host).get('/health', timeout=5)
+             return 1 if response.status_code == 200 else 0
+
+     if __name__ == '__main__':
+         CheckWebNodes().run()
+
+    Run with ``-H web1,web2,web3,web4,web5 --host-critical 1: -c count_ok=3:``.
+
+    The following arguments are pre-defined and accessible with attribute
+    :attr:`options`:
+
+    - ``-H``: :attr:`options.hostname`, comma separated hosts, also in
+      attribute :attr:`hosts`.
+    - ``-w, --warning``: :attr:`options.warning`
+    - ``-c, --critical``: :attr:`options.critical`
+    - ``--host-warning``: :attr:`options.host_warning`
+    - ``--host-critical``: :attr:`options.host_critical`
+    - ``--workers``: :attr:`options.workers`
+    """
+    def initialize(self):
+        """Get the list of hosts from ``-H``."""
+        super(NagiosPluginAggregate, self).initialize()
+        self.hosts = [host.strip()
+                      for host in self.options.hostname.split(',')
+                      if host.strip()]
+        self.results = []
+
+    def define_plugin_arguments(self):
+        """Define arguments for the plugin"""
+        super(NagiosPluginAggregate, self).define_plugin_arguments()
+
+        self.required_args.add_argument('-w', '--warning',
+                                        dest='warning',
+                                        type=aggregate_threshold,
+                                        action='append',
+                                        default=[],
+                                        help='Warning threshold on an '
+                                             'aggregate, like avg=80 or '
+                                             'count_ok=4: (repeatable).')
+
+        self.required_args.add_argument('-c', '--critical',
+                                        dest='critical',
+                                        type=aggregate_threshold,
+                                        action='append',
+                                        default=[],
+                                        help='Critical threshold on an '
+                                             'aggregate, like max=95 or '
+                                             'count_ok=3: (repeatable).')
+
+        self.parser.add_argument('--host-warning',
+                                 dest='host_warning',
+                                 type=argument.threshold,
+                                 help='Warning threshold on the value of '
+                                      'each host.',
+                                 default=None)
+
+        self.parser.add_argument('--host-critical',
+                                 dest='host_critical',
+                                 type=argument.threshold,
+                                 help='Critical threshold on the value of '
+                                      'each host.',
+                                 default=None)
+
+        self.parser.add_argument('--workers',
+                                 dest='workers',
+                                 type=int,
+                                 help='Number of hosts probed at the same '
+                                      'time (default 20).',
+                                 default=20)
+
+    def probe(self, host):
+        """
+        Return the metric of ``host``, a number. Called concurrently from
+        several threads.
+
+        Override this method. An exception makes the host UNKNOWN, it is not
+        counted in ``count_ok`` and its value is not aggregated. This includes
+        the exit of a probe of the library with
+        :class:`monitoring.nagios.exceptions.NagiosUnknown`, its message being
+        the error of the host instead of the output of the plugin.
+
+        :param host: one of the hosts given with ``-H``.
+        :type host: str
+        :returns: int, float
+        """
+        raise NotImplementedError('Plugin {0} does not implement '
+                                  'probe() !'.format(self.__class__.__name__))
+
+    def _probe_host(self, host):
+        """Probe a host, catching errors and the exit of Nagios exceptions."""
+        stdout = _thread_local_stream('stdout')
+        output = StringIO()
+        stdout.capture(output)
+        try:
+            return HostResult(host, self.probe(host))
+        except SystemExit as e:
+            # Nagios exceptions print their message then exit
+            error = _STATUS_PREFIX.sub('', output.getvalue().strip())
+            logger.debug('Probe of %s exited with %s: %s', host, e.code,
+                         error)
+            return HostResult(host, status=3,
+                              error=error or 'exit {0}'.format(e.code))
+        except Exception as e:
+            logger.debug('Probe of %s failed: %s', host, e, exc_info=True)
+            return HostResult(host, status=3,
+                              error=str(e) or e.__class__.__name__)
+        finally:
+            stdout.capture(None)
+
+    def probe_all(self):
+        """
+        Probe all hosts concurrently and set their status with the host
+        thresholds.
+
+        :returns: the results by host, in the order of :attr:`hosts`.
+        :rtype: list of :class:`HostResult`
+        """
+        pool = ThreadPool(max(1, min(self.options.workers, len(self.hosts))))
+        try:
+            results = pool.map(self._probe_host, self.hosts)
+        finally:
+            pool.close()
+            pool.join()
+
+        probed = [result for result in results if result.error is None]
+        statuses = argument.check_thresholds(
+            [result.value for result in probed],
+            self.options.host_warning, self.options.host_critical)
+        for result, status in zip(probed, statuses):
+            result.status = int(status)
+
+        self.results = results
+        return results
+
+    def aggregate(self, results):
+        """
+        Compute the aggregate values of ``results``.
+
+        :param results: the results of :meth:`probe_all`.
+        :type results: list of :class:`HostResult`
+        :returns: the value of each function in :data:`AGGREGATES`, ``None``
+                  for ``min``, ``max`` and ``avg`` if no host answered.
+        :rtype: dict
+        """
+        values = [result.value for result in results if result.error is None]
+        aggregates = dict.fromkeys(('min', 'max', 'avg'))
+        if values:
+            aggregates['min'] = min(values)
+            aggregates['max'] = max(values)
+            aggregates['avg'] = round(float(sum(values)) / len(values), 6)
+        aggregates['count_ok'] = sum(1 for result in results
+                                     if result.status == 0)
+        return aggregates
+
+    def run(self):
+        """
+        Probe all hosts and end the check with the worst status of the
+        aggregate thresholds.
+
+        The short output tells the number of hosts in OK status and the
+        aggregates exceeding thresholds, long output lists hosts by status,
+        worst first, and perfdata gives the aggregate values.
+        """
+        results = self.probe_all()
+        aggregates = self.aggregate(results)
+
+        status = 0
+        alerts = []
+        alerted = set()
+        for level, thresholds in ((2, self.options.critical),
+                                  (1, self.options.warning)):
+            for function, threshold in thresholds:
+                value = aggregates[function]
+                if value is None:
+                    self.unknown('No host answered, cannot compute '
+                                 '{0} !'.format(function))
+                if function not in alerted and threshold.test(value):
+                    status = max(status, level)
+                    alerted.add(function)
+                    alerts.append('{0}={1} ({2})'.format(
+                        function, format_number(value), threshold))
+
+        self.shortoutput = ', '.join(
+            ['{0}/{1} hosts OK'.format(aggregates['count_ok'],
+                                       len(results))] + alerts)
+
+        self.longoutput = [str(result) for result in sorted(
+            results, key=lambda result: -_SEVERITY[result.status])]
+
+        thresholds = dict((function, [None, None])
+                          for function in AGGREGATES)
+        for index, option in enumerate((self.options.warning,
+                                        self.options.critical)):
+            for function, threshold in option:
+                thresholds[function][index] = threshold
+        for function in AGGREGATES:
+            if aggregates[function] is not None:
+                warn, crit = thresholds[function]
+                self.perfdata.append(PerfData(function, aggregates[function],
+                                              warn=warn, crit=crit))
+        self.perfdata[-1].min = 0
+        self.perfdata[-1].max = len(results)
+
+        status_method = (self.ok, self.warning, self.critical)[status]
+        status_method(self.output())
@@ -29,9 +29,19 @@ See ``type`` argument of `argparse's add_argument()
 import argparse
 import re
 from datetime import timedelta
+from itertools import izip
 
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 
+_INFINITY = float('inf')
+
+# Thresholds by spec, see threshold()
+_thresholds = {}
+
+# NumPy is optional and imported on first vectorised test, see _import_numpy()
+numpy = None
+_numpy_imported = False
+
 
 def snmpv3_auth_protocol(protocol):
     """
@@ -245,10 +255,15 @@ class NagiosThreshold(object):
     <https://nagios-plugins.org/doc/guidelines.html#THRESHOLDFORMAT>`_.
 
     The ``threshold`` format is the following to make it simple:
-    ``[@]start[:end]``. If ``start`` is ``~``, it means negative infinity.
+    ``[@]start[:end]``. If ``start`` is ``~``, it means negative infinity,
+    if ``end`` is empty, it means positive infinity. Values can be negative
+    and decimal numbers.
+
+    An alert is generated when the value is outside the range, or inside
+    the range if the threshold starts with ``@``.
 
     :param threshold: the Nagios threshold (ex. start:end, @start:end,
-                      ...). With ``start`` and ``end`` as integer.
+                      ...).
     :type threshold: str, unicode
 
     >>> t = NagiosThreshold("@25:40")
@@ -284,39 +299,53 @@ class NagiosThreshold(object):
     False
     >>> str(t)
     '< 10 or > 20'
+
+    >>> t = NagiosThreshold("-2.5:")
+    >>> t.test(-3) # KO: outside the range of {-2.5 .. ∞}
+    True
+    >>> t.test(1000) # OK: inside the range of {-2.5 .. ∞}
+    False
+    >>> str(t)
+    '< -2.5'
     """
-    pattern = r'(^(?P<inclusive>@)?(?P<start>[0-9]+)|' \
-              r'(?P<is_strict_positive>^~)):?(?P<end>[0-9]*)$'
+    number = r'[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)'
+    pattern = r'^(?P<inclusive>@)?' \
+              r'(?:(?P<start>~|{0})?(?P<colon>:))?' \
+              r'(?P<end>{0})?$'.format(number)
+
+    regex = re.compile(pattern)
+
+    __slots__ = ('threshold', 'inclusive', 'start', 'end',
+                 'is_strict_positive')
 
     def __init__(self, threshold):
         self.threshold = threshold
-        self.__match = re.match(self.pattern, self.threshold)
+        match = self.regex.match(self.threshold.strip())
         self.inclusive = False
         self.start = 0
-        self.end = 0
+        self.end = _INFINITY
         self.is_strict_positive = False
 
-        if self.__match:
+        if match and (match.group('colon') or match.group('end')):
             # Set attributes
-            attributes = self.__match.groupdict()
+            attributes = match.groupdict()
 
             if attributes["inclusive"]:
                 self.inclusive = True
 
-            if attributes["start"]:
-                self.start = int(attributes["start"])
+            if attributes["start"] == '~':
+                self.is_strict_positive = True
+                self.start = -_INFINITY
+            elif attributes["start"]:
+                self.start = _number(attributes["start"])
 
             if attributes["end"]:
-                self.end = int(attributes["end"])
-
-            if attributes["is_strict_positive"]:
-                self.is_strict_positive = True
+                self.end = _number(attributes["end"])
 
             # Sanity checks
-            if self.start and self.end:
-                if not self.start <= self.end:
-                    raise argparse.ArgumentTypeError("Error: "
-                                                     "start must be <= end !")
+            if not self.start <= self.end:
+                raise argparse.ArgumentTypeError("Error: "
+                                                 "start must be <= end !")
         else:
             raise argparse.ArgumentTypeError(
                 "Threshold \"{0.threshold}\" does not "
@@ -341,34 +370,182 @@ class NagiosThreshold(object):
             plugin.ok("Nothing is going wrong here.")
 
         :param value: the value that must be tested on the threshold.
-        :type value: int
+        :type value: int, float
         :returns: returns True if alert must be generated else False.
         """
-        if self.is_strict_positive:
-            if value > self.end:
-                return True
-        else:
+        if self.inclusive:
+            return self.start <= value <= self.end
+        return value < self.start or value > self.end
+
+    def test_many(self, values):
+        """
+        Test all ``values`` against threshold at once. Uses NumPy if
+        installed.
+
+        **Example**::
+
+         >>> list(NagiosThreshold("10:20").test_many([5, 15, 25]))
+         [True, False, True]
+
+        :param values: the values that must be tested on the threshold.
+        :type values: list, numpy.ndarray
+        :returns: for each value, True if alert must be generated else
+                  False. A ``numpy.ndarray`` of booleans if NumPy is
+                  installed else a list.
+        """
+        if _import_numpy() is not None:
+            values = numpy.asarray(values, dtype=float)
             if self.inclusive:
-                if self.start <= value <= self.end:
-                    return True
-            else:
-                if self.start and not self.end:
-                    if value > self.start or value < 0:
-                        return True
-                else:
-                    if value < self.start or value > self.end:
-                        return True
-
-        return False
+                return (values >= self.start) & (values <= self.end)
+            return (values < self.start) | (values > self.end)
+
+        start, end = self.start, self.end
+        if self.inclusive:
+            return [start <= value <= end for value in values]
+        return [value < start or value > end for value in values]
 
     def __str__(self):
-        if self.is_strict_positive:
-            return "> {0.end}".format(self)
-        else:
-            if self.inclusive:
-                return "[{0.start} .. {0.end}]".format(self)
-            else:
-                if self.start and not self.end:
-                    return "< 0 or > {0.start}".format(self)
-                else:
-                    return "< {0.start} or > {0.end}".format(self)
+        if self.inclusive:
+            return "[{0} .. {1}]".format(_number_str(self.start),
+                                         _number_str(self.end))
+
+        conditions = []
+        if self.start != -_INFINITY:
+            conditions.append("< {0}".format(_number_str(self.start)))
+        if self.end != _INFINITY:
+            conditions.append("> {0}".format(_number_str(self.end)))
+        return " or ".join(conditions)
+
+
+def _import_numpy():
+    """Import NumPy on first call, return None if not installed."""
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+    return numpy
+
+
+def _number(string):
+    """Convert a threshold bound to int, or float if decimal."""
+    try:
+        return int(string)
+    except ValueError:
+        return float(string)
+
+
+def _number_str(number):
+    """Format a threshold bound, infinities as ``~``."""
+    if number in (_INFINITY, -_INFINITY):
+        return '~'
+    return str(number)
+
+
+def check_thresholds(values, warning=None, critical=None):
+    """
+    Give the Nagios status of each value: ``0`` for OK, ``1`` for WARNING
+    and ``2`` for CRITICAL. The critical threshold wins over the warning one.
+    Uses NumPy if installed.
+
+    **Example**::
+
+     >>> list(check_thresholds([10, 85, 95],
+     ...                       NagiosThreshold("80"), NagiosThreshold("90")))
+     [0, 1, 2]
+
+    :param values: the values to check.
+    :type values: list, numpy.ndarray
+    :param warning: the warning threshold, if any.
+    :type warning: NagiosThreshold
+    :param critical: the critical threshold, if any.
+    :type critical: NagiosThreshold
+    :returns: the statuses as a ``numpy.ndarray`` of integers if NumPy is
+              installed else a list.
+    """
+    if _import_numpy() is not None:
+        values = numpy.asarray(values, dtype=float)
+        statuses = numpy.zeros(len(values), dtype=numpy.int8)
+        if warning is not None:
+            statuses[warning.test_many(values)] = 1
+        if critical is not None:
+            statuses[critical.test_many(values)] = 2
+        return statuses
+
+    warnings = warning.test_many(values) if warning is not None \
+        else [False] * len(values)
+    criticals = critical.test_many(values) if critical is not None \
+        else [False] * len(values)
+    return [2 if is_critical else 1 if is_warning else 0
+            for is_warning, is_critical in izip(warnings, criticals)]
+
+
+def threshold(spec):
+    """
+    Return the :class:`NagiosThreshold` of ``spec``, parsing it only once.
+
+    Identical specs give the same threshold object, so do not modify it. Use
+    it as argument type or to build many thresholds from a configuration.
+
+    **Example**::
+
+     >>> threshold("10:20") is threshold("10:20")
+     True
+
+    :param spec: the Nagios threshold.
+    :type spec: str, unicode
+    :returns: NagiosThreshold
+    :raises: argparse.ArgumentTypeError
+    """
+    try:
+        return _thresholds[spec]
+    except KeyError:
+        return _thresholds.setdefault(spec, NagiosThreshold(spec))
+
+
+def load_thresholds(filename):
+    """
+    Load per item thresholds from a file in one pass.
+
+    Each line is ``name warning [critical]`` separated by spaces, empty lines
+    and lines starting with ``#`` are ignored::
+
+     # Filesystem    Warning  Critical
+     /               80       90
+     /var            @0:5
+
+    :param filename: the path of the file.
+    :type filename: str, unicode
+    :returns: a dict of name to a tuple ``(warning, critical)`` of
+              :class:`NagiosThreshold`, ``critical`` being None if not given.
+    :rtype: dict
+    :raises: argparse.ArgumentTypeError
+    """
+    thresholds = {}
+    try:
+        with open(filename) as config:
+            for lineno, line in enumerate(config, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                if not 2 <= len(fields) <= 3:
+                    raise argparse.ArgumentTypeError(
+                        "Line {0} of {1} is not \"name warning [critical]\" "
+                        "!".format(lineno, filename))
+                fields.append(None)
+                try:
+                    thresholds[fields[0]] = (
+                        threshold(fields[1]),
+                        threshold(fields[2]) if fields[2] else None)
+                except argparse.ArgumentTypeError as e:
+                    raise argparse.ArgumentTypeError(
+                        "Line {0} of {1}: {2}".format(lineno, filename, e))
+    except IOError as e:
+        raise argparse.ArgumentTypeError(
+            "Unable to read thresholds file {0}: {1} !".format(filename,
+                                                                e.strerror))
+
+    return thresholds
@@ -25,6 +25,7 @@
 
 import sys
 import os
+import time
 import argparse
 import traceback
 import pickle
@@ -32,6 +33,9 @@ from pprint import pformat
 import logging as log
 
 import monitoring.nagios
+from monitoring.nagios import profiling
+from monitoring.nagios.plugin.output import (build_output, PerfData,
+                                             MAX_OUTPUT_LENGTH)
 from monitoring.nagios.exceptions import (
     NagiosUnknown,
     NagiosCritical,
@@ -56,9 +60,19 @@ class NagiosPlugin(object):
     :type version: str, unicode
     :param description: a description of what is doing the plugin.
     :type description: str, unicode
+    :param argv: the command line arguments, default to ``sys.argv[1:]``.
+    :type argv: list
     """
+    # Argument parsers by plugin class, see __init_plugin_arguments()
+    _parsers = {}
+
+    # Import duration is only profiled for the first plugin of the process
+    _profiled = False
+
     def __init__(self, name=None, version='',
-                 description=''):
+                 description='', argv=None):
+        init_start = time.time()
+
         # Plugin infos
         self.name = os.path.basename(sys.argv[0]) if not name else name
         self.version = version
@@ -74,11 +88,12 @@ class NagiosPlugin(object):
         self.parser = None
         self.required_args = None
         self.options = None
+        self._argv = argv
 
         # Initialize arguments stuff
         self.__init_plugin_arguments()
-        self.define_plugin_arguments()
         self.__parse_plugin_arguments()
+        arguments_parsed = time.time()
 
         # Check if debug mode is active
         if self.options.debug:
@@ -87,14 +102,15 @@ class NagiosPlugin(object):
             log.getLogger('monitoring').setLevel(log.DEBUG)
 
         # Debug init
-        logger.debug('=== BEGIN PLUGIN INIT ===')
-        logger.debug('Debug mode is ON.')
-        logger.debug('Library version: %s.', monitoring.nagios.__version__)
-        logger.debug('Plugin class: %s.', self.__class__.__name__)
-        logger.debug('\tName: %s, v%s', self.name, self.version)
-        logger.debug('\tDesc: %s', self.description)
-        logger.debug('Processed command line arguments:')
-        logger.debug(pformat(vars(self.options), indent=4))
+        if logger.isEnabledFor(log.DEBUG):
+            logger.debug('=== BEGIN PLUGIN INIT ===')
+            logger.debug('Debug mode is ON.')
+            logger.debug('Library version: %s.', monitoring.nagios.__version__)
+            logger.debug('Plugin class: %s.', self.__class__.__name__)
+            logger.debug('\tName: %s, v%s', self.name, self.version)
+            logger.debug('\tDesc: %s', self.description)
+            logger.debug('Processed command line arguments:')
+            logger.debug(pformat(vars(self.options), indent=4))
 
         # Pickle file and location
         if os.environ.get("NAGIOSENV"):
@@ -103,26 +119,33 @@ class NagiosPlugin(object):
         else:
             self._picklefile_path = '/var/tmp/plugin'
 
-        try:
-            if not os.path.isdir(self._picklefile_path):
-                os.makedirs(self._picklefile_path)
-        except OSError:
-            self.unknown("Unable to create the retention folder "
-                         "{0._picklefile_path}".format(self))
-
+        # The retention folder is created by save_data() when needed
         self._picklefile_name = '{plugin.name}_{opt.hostname}'.format(
             plugin=self, opt=self.options)
         self.picklefile_pattern = 'p'
 
-        self.picklefile = '{0}/{1}_{2}.pkl'.format(self._picklefile_path,
-                                                   self._picklefile_name,
-                                                   self.picklefile_pattern)
-
-        logger.debug("Pickled data will be saved "
-                     "in {0.picklefile}.".format(self))
+        self.picklefile = self.retention_file(self.picklefile_pattern)
+
+        logger.debug("Pickled data will be saved in %s.", self.picklefile)
+
+        # Profiling of the check
+        self.profiler = None
+        mode = profiling.profile_mode(self.options.profile)
+        if mode:
+            self.profiler = profiling.Profiler()
+            self.profiler.start(mode,
+                                os.path.join(self._picklefile_path, 'profile',
+                                             self._picklefile_name),
+                                init_start)
+            if not NagiosPlugin._profiled:
+                self.profiler.record('import',
+                                     init_start - profiling.IMPORT_TIME)
+            self.profiler.record('arguments', arguments_parsed - init_start)
+        NagiosPlugin._profiled = True
 
         # Second level plugin initialization
-        self.initialize()
+        with profiling.phase('initialize'):
+            self.initialize()
 
         # Sanity checks for plugin arguments
         self.verify_plugin_arguments()
@@ -143,13 +166,32 @@ class NagiosPlugin(object):
 
     # Arguments processing
     def __init_plugin_arguments(self):
-        """Initialize the argument parser."""
+        """
+        Initialize the argument parser.
+
+        The parser is built once by plugin class, version and description, then
+        reused by next instances.
+        """
+        key = (self.__class__, self.version, self.description)
+        try:
+            self.parser, self.required_args = NagiosPlugin._parsers[key]
+            return
+        except KeyError:
+            pass
+
         self.parser = argparse.ArgumentParser(description=self.description)
         self.parser.add_argument('--debug',
                                  action='store_true',
                                  dest='debug',
                                  help='Show debug information, Nagios may '
                                       'truncate output')
+        self.parser.add_argument('--profile',
+                                 dest='profile',
+                                 choices=profiling.MODES,
+                                 help='Record durations of the check phases '
+                                      'as perfdata or in a file of the '
+                                      'retention folder (default no).',
+                                 default=None)
         self.parser.add_argument('--version',
                                  action='version',
                                  version='%s %s' % (self.parser.prog,
@@ -157,6 +199,9 @@ class NagiosPlugin(object):
 
         self.required_args = self.parser.add_argument_group(
             'Plugin arguments', 'This arguments are required by the plugin.')
+        self.define_plugin_arguments()
+
+        NagiosPlugin._parsers[key] = (self.parser, self.required_args)
 
     def define_plugin_arguments(self):
         """
@@ -182,24 +227,42 @@ class NagiosPlugin(object):
     def __parse_plugin_arguments(self):
         """Parse arguments and values."""
         try:
-            self.options = self.parser.parse_args()
+            self.options = self.parser.parse_args(self._argv)
         except Exception as e:
             self.unknown('Error argument parser: %s' % e)
 
-    def load_data(self):
+    def retention_file(self, pattern):
+        """
+        Return the path of a retention file for this plugin and host.
+
+        :param pattern: a suffix to distinguish retention files.
+        :type pattern: str
+        :return: str
+        """
+        return '{0}/{1}_{2}.pkl'.format(self._picklefile_path,
+                                        self._picklefile_name,
+                                        pattern)
+
+    def load_data(self, picklefile=None):
         """
         Load pickled data.
 
+        :param picklefile: path of the pickle file, default to
+                           :attr:`picklefile`.
+        :type picklefile: str
         :return: list
         :raise IOError: raise IOError if pickle file is not found / readable.
         """
-        logger.debug('-- Try to find pickle file \'%s\'...', self.picklefile)
+        if not picklefile:
+            picklefile = self.picklefile
+
+        logger.debug('-- Try to find pickle file \'%s\'...', picklefile)
 
         data = None
-        if os.path.isfile(self.picklefile):
+        if os.path.isfile(picklefile):
             logger.debug('\t - Pickle file is found, processing.')
             try:
-                with open(self.picklefile, 'rb') as pkl:
+                with open(picklefile, 'rb') as pkl:
                     data = pickle.load(pkl)
             except (IOError, IndexError):
                 message = """Unable to read retention file !
@@ -212,7 +275,7 @@ plugin has changed and the retention file is outdated, so delete it if this is
 the case.
 
 %s
-""" % (self.picklefile, traceback.format_exc(limit=1))
+""" % (picklefile, traceback.format_exc(limit=1))
                 self.unknown(message)
 
             logger.debug('\t - Pickle data found, loading %d records.',
@@ -223,14 +286,29 @@ the case.
             raise IOError('Pickle file not found. '
                           'You may save something first.')
 
-    def save_data(self, data, limit=0):
+    def save_data(self, data, limit=0, picklefile=None):
         """
         Save data into a pickle file.
 
         :param data: A list of objects to save in the pickle file.
         :type data: list
+        :param picklefile: path of the pickle file, default to
+                           :attr:`picklefile`.
+        :type picklefile: str
         """
-        logger.debug('-- Saving data to file \'%s\'...', self.picklefile)
+        if not picklefile:
+            picklefile = self.picklefile
+
+        logger.debug('-- Saving data to file \'%s\'...', picklefile)
+
+        directory = os.path.dirname(picklefile)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError:
+            self.unknown("Unable to create the retention folder "
+                         "{0}".format(directory))
+
         try:
             # Avoid having a large pickle file if above limit of recorded
             # values (plugin executions)
@@ -241,7 +319,7 @@ the case.
                     del data[0]
 
             # Save data with pickle module
-            with open(self.picklefile, 'wb') as pkl:
+            with open(picklefile, 'wb') as pkl:
                 pickle.dump(data, pkl)
         except IOError:
             message = """Unable to save retention file !
@@ -249,13 +327,15 @@ If you see this message that would mean that the retention file located in
 \'%s\' is not writable or directory is missing.
 
 %s
-""" % (self.picklefile, traceback.format_exc(limit=1))
+""" % (picklefile, traceback.format_exc(limit=1))
             self.unknown(message)
 
-    def output(self, substitute=None, long_output_limit=20):
+    def output(self, substitute=None, long_output_limit=20,
+               max_length=MAX_OUTPUT_LENGTH):
         """
         Construct and format the full string that should be returned to Nagios.
-        Includes short output, long output and perf data (if any).
+        Includes short output, long output and perf data (if any). See
+        :func:`monitoring.nagios.plugin.output.build_output`.
 
         :param substitute: dict wih key/value pair that should be replaced in
                            string (see :py:func:`str.format`).
@@ -264,26 +344,44 @@ If you see this message that would mean that the retention file located in
                                   default to ``20``. Set it to ``None`` for no
                                   limit.
         :type long_output_limit: int, None
+        :param max_length: limit the length of the output, default to the
+                           Nagios buffer size. Set it to ``None`` for no limit.
+        :type max_length: int, None
 
         :return: str, unicode
         """
-        if not substitute:
-            substitute = {}
-
-        self._output += "{0}".format(self.shortoutput)
-        if self.longoutput:
-            self._output = self._output.rstrip("\n")
-            self._output += "\n{0}".format(
-                "\n".join(self.longoutput[:long_output_limit]))
-            if long_output_limit:
-                self._output += "\n(...showing only first {0} lines, " \
-                                "{1} elements remaining...)".format(
-                                    long_output_limit,
-                                    len(self.longoutput[long_output_limit:]))
-        if self.perfdata:
-            self._output = self._output.rstrip("\n")
-            self._output += " | {0}".format(" ".join(self.perfdata))
-        return self._output.format(**substitute)
+        profiler = self.profiler
+        if profiler is not None and profiler.enabled and \
+                profiler.mode == 'perfdata':
+            self.perfdata.extend(
+                PerfData('profile_{0}'.format(phase), round(duration, 6), 's',
+                         min=0)
+                for phase, duration in profiler.durations())
+            profiler.stop()
+
+        self._output = build_output(self.shortoutput, self.longoutput,
+                                    self.perfdata, substitute,
+                                    long_output_limit, max_length)
+        return self._output
+
+    def run(self):
+        """
+        Do the check and end it with one of the status methods like
+        :meth:`ok`.
+
+        Override this method to be able to run the plugin with
+        :mod:`monitoring.nagios.runner`, for example by the scheduler::
+
+         class CheckUptime(NagiosPluginSSH):
+             def run(self):
+                 ...
+                 self.ok(self.output())
+
+         if __name__ == '__main__':
+             CheckUptime().run()
+        """
+        raise NotImplementedError('Plugin {0} does not implement '
+                                  'run() !'.format(self.__class__.__name__))
 
     # Nagios status methods
     def ok(self, msg):
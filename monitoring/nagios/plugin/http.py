@@ -20,8 +20,9 @@
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
+import os
 
-from monitoring.nagios.plugin import NagiosPlugin
+from monitoring.nagios.plugin import NagiosPlugin, PerfData
 from monitoring.nagios.probes import ProbeHTTP
 from monitoring.nagios.plugin import argument
 
@@ -48,14 +49,24 @@ class NagiosPluginHTTP(NagiosPlugin):
     - ``-p, --port``: :attr:`options.port`
     - ``-S, --ssl``: :attr:`options.ssl`
     - ``-a, --auth``: :attr:`options.auth`
+    - ``--cache``: :attr:`options.cache`
+    - ``--timings``: :attr:`options.timings`
     """
+    #: Phases of the HTTP request added to perfdata with ``--timings``.
+    timing_phases = ('connect', 'ttfb', 'transfer', 'total')
+
     def __init__(self, *args, **kwargs):
         super(NagiosPluginHTTP, self).__init__(*args, **kwargs)
 
+        cache_dir = None
+        if self.options.cache:
+            cache_dir = os.path.join(self._picklefile_path, 'http_cache')
+
         self.http = ProbeHTTP(hostaddress=self.options.hostname,
                               port=self.options.port,
                               ssl=self.options.ssl,
-                              auth=self.options.auth)
+                              auth=self.options.auth,
+                              cache_dir=cache_dir)
 
         if 'NagiosPluginHTTP' == self.__class__.__name__:
             logger.debug('=== END PLUGIN INIT ===')
@@ -86,4 +97,34 @@ class NagiosPluginHTTP(NagiosPlugin):
                                         type=argument.http_basic_auth,
                                         help='Login and password for Basic'
                                              'Authentication.',
-                                        default=None)
\ No newline at end of file
+                                        default=None)
+
+        self.parser.add_argument('--cache',
+                                 dest='cache',
+                                 action="store_true",
+                                 help='Cache responses in the retention '
+                                      'directory and use conditional '
+                                      'requests (default no).',
+                                 default=False)
+
+        self.parser.add_argument('--timings',
+                                 dest='timings',
+                                 action="store_true",
+                                 help='Add durations of the last HTTP request '
+                                      'phases to perfdata (default no).',
+                                 default=False)
+
+    def output(self, *args, **kwargs):
+        """
+        Same as :meth:`NagiosPlugin.output` but adds the durations of the
+        last HTTP request phases to perfdata when ``--timings`` is used.
+        """
+        if self.options.timings and self.http.timings:
+            for phase in self.timing_phases:
+                if phase in self.http.timings:
+                    self.perfdata.append(PerfData(
+                        'time_{0}'.format(phase),
+                        round(self.http.timings[phase], 6), 's', min=0))
+            self.http.timings = None
+
+        return super(NagiosPluginHTTP, self).output(*args, **kwargs)
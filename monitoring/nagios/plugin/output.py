@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+This module contains helpers to build the output sent to Nagios.
+
+See the `Guidelines for Developers
+<https://nagios-plugins.org/doc/guidelines.html#AEN200>`_ for the format of
+performance data.
+"""
+
+import logging
+from itertools import islice
+
+logger = logging.getLogger('monitoring.nagios.plugin.output')
+
+#: Size in bytes of the plugin output buffer of Nagios 3 and later.
+MAX_OUTPUT_LENGTH = 8192
+
+#: Size in bytes of the plugin output buffer of Nagios 2 and NRPE. Give it as
+#: ``max_length`` to :func:`build_output` for checks run by NRPE.
+MAX_OUTPUT_LENGTH_NRPE = 4096
+
+# Characters that require quoting the label of a perfdata
+_LABEL_SPECIAL_CHARS = frozenset(" '=;|")
+
+# Last line of long output when lines are hidden
+_FOOTER = '(...showing only first {0} lines, {1} elements remaining...)'
+_FOOTER_LENGTH = len(_FOOTER) + 20
+
+
+def output_length(part):
+    """
+    Return the length in bytes of ``part`` once sent to Nagios, unicode being
+    encoded in UTF-8.
+
+    **Example**::
+
+     >>> output_length(u'D\\xe9faut')
+     7
+    """
+    if isinstance(part, unicode):
+        return len(part.encode('utf-8'))
+    return len(part)
+
+
+def _output_lengths(parts):
+    """Return the lengths in bytes of ``parts``, fast when none is unicode."""
+    if isinstance(''.join(parts), unicode):
+        return [output_length(part) for part in parts]
+    return map(len, parts)
+
+
+def truncate_output(part, length):
+    """
+    Truncate ``part`` to ``length`` bytes once encoded in UTF-8, without
+    splitting a multibyte character.
+
+    **Example**::
+
+     >>> truncate_output(u'D\\xe9faut', 2)
+     u'D'
+    """
+    if isinstance(part, unicode):
+        encoded = part.encode('utf-8')
+        if len(encoded) <= length:
+            return part
+        return encoded[:length].decode('utf-8', 'ignore')
+
+    if len(part) <= length:
+        return part
+    part = part[:length]
+
+    # Drop the last UTF-8 sequence if it is incomplete
+    for start in xrange(len(part) - 1, max(len(part) - 4, -1), -1):
+        byte = ord(part[start])
+        if byte < 0x80:
+            break
+        if byte >= 0xc0:
+            size = 2 if byte < 0xe0 else 3 if byte < 0xf0 else 4
+            if start + size > len(part):
+                part = part[:start]
+            break
+    return part
+
+
+def format_number(value):
+    """
+    Format a perfdata value or threshold without exponent.
+
+    ``None`` gives an empty string, strings are returned as is and objects
+    having a ``threshold`` attribute, like
+    :class:`monitoring.nagios.plugin.argument.NagiosThreshold`, give their
+    threshold.
+
+    **Example**::
+
+     >>> format_number(10)
+     '10'
+     >>> format_number(2.50)
+     '2.5'
+     >>> format_number(0.000125)
+     '0.000125'
+     >>> format_number(None)
+     ''
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return '{0:f}'.format(value).rstrip('0').rstrip('.')
+    if isinstance(value, basestring):
+        return value
+    return str(getattr(value, 'threshold', value))
+
+
+class PerfData(object):
+    """
+    A performance data item, formatted as
+    ``'label'=value[UOM];[warn];[crit];[min];[max]``.
+
+    The label is quoted if needed and trailing empty fields are left out.
+
+    :param label: the name of the datasource.
+    :type label: str, unicode
+    :param value: the measured value.
+    :type value: int, float
+    :param uom: the unit of measurement (``s``, ``%``, ``B``, ``c``, ...).
+    :type uom: str
+    :param warn: the warning threshold.
+    :param crit: the critical threshold.
+    :param min: the minimum possible value.
+    :param max: the maximum possible value.
+
+    **Example**::
+
+     >>> str(PerfData('time', 0.25, 's', warn=1, crit=2, min=0))
+     'time=0.25s;1;2;0'
+     >>> str(PerfData("C:\\\\ used", 42, '%'))
+     "'C:\\\\ used'=42%"
+     >>> str(PerfData("it's", 1))
+     "'it''s'=1"
+    """
+    __slots__ = ('label', 'value', 'uom', 'warn', 'crit', 'min', 'max')
+
+    def __init__(self, label, value, uom='', warn=None, crit=None, min=None,
+                 max=None):
+        self.label = label
+        self.value = value
+        self.uom = uom
+        self.warn = warn
+        self.crit = crit
+        self.min = min
+        self.max = max
+
+    @property
+    def quoted_label(self):
+        """The label, quoted if it contains special characters."""
+        if _LABEL_SPECIAL_CHARS.isdisjoint(self.label):
+            return self.label
+        return "'{0}'".format(self.label.replace("'", "''"))
+
+    def __str__(self):
+        fields = [format_number(self.value) + self.uom]
+        fields.extend(format_number(field) for field in (
+            self.warn, self.crit, self.min, self.max))
+        return '{0}={1}'.format(self.quoted_label,
+                                ';'.join(fields).rstrip(';'))
+
+    def __repr__(self):
+        return '<PerfData {0}>'.format(self)
+
+
+def build_output(shortoutput, longoutput=(), perfdata=(), substitute=None,
+                 long_output_limit=20, max_length=MAX_OUTPUT_LENGTH):
+    """
+    Build the string sent to Nagios with short output, long output and perf
+    data, in linear time.
+
+    Long output is limited to ``long_output_limit`` lines then to the lines
+    fitting in ``max_length`` bytes (the limits of Nagios and NRPE are in
+    bytes, unicode being encoded in UTF-8) after the short output and perf
+    data are kept. A footer telling the number of hidden lines is added only
+    when lines were left out. If the perf data does not fit either, last items
+    are dropped.
+
+    :param shortoutput: the first line of output.
+    :type shortoutput: str, unicode
+    :param longoutput: the lines of long output.
+    :type longoutput: list
+    :param perfdata: the :class:`PerfData` items or strings.
+    :type perfdata: list
+    :param substitute: keys replaced by values in each part (see
+                       :py:func:`str.format`). Parts are not formatted if not
+                       given.
+    :type substitute: dict
+    :param long_output_limit: maximum number of lines of long output,
+                              ``None`` for no limit.
+    :type long_output_limit: int, None
+    :param max_length: maximum length in bytes of the output, ``None`` for no
+                       limit. See :data:`MAX_OUTPUT_LENGTH` and
+                       :data:`MAX_OUTPUT_LENGTH_NRPE`.
+    :type max_length: int, None
+    :returns: str, unicode
+
+    **Example**::
+
+     >>> print build_output('OK', ['line 1', 'line 2', 'line 3'],
+     ...                    [PerfData('lines', 3)], long_output_limit=2)
+     OK
+     line 1
+     line 2
+     (...showing only first 2 lines, 1 elements remaining...) | lines=3
+    """
+    if substitute:
+        format_part = lambda part: part.format(**substitute)
+    else:
+        format_part = lambda part: part
+
+    shortoutput = format_part(shortoutput).rstrip('\n')
+    perfdata = [format_part(item if isinstance(item, basestring)
+                            else str(item)) for item in perfdata]
+
+    lines = [format_part(line)
+             for line in islice(longoutput, long_output_limit)]
+    hidden = len(longoutput) - len(lines)
+
+    if max_length is not None:
+        shortoutput = truncate_output(shortoutput, max_length)
+        shortoutput_length = output_length(shortoutput)
+
+        # Keep as many perfdata items as possible after the short output
+        budget = max_length - shortoutput_length - len(' | ')
+        for kept, length in enumerate(_output_lengths(perfdata)):
+            budget -= length + 1
+            if budget < 0:
+                logger.debug('Output too long, dropping %d perfdata items.',
+                             len(perfdata) - kept)
+                del perfdata[kept:]
+                break
+        perfdata_length = len(' | ') + output_length(' '.join(perfdata)) \
+            if perfdata else 0
+
+        # Then as many long output lines, keeping room for the footer
+        budget = max_length - shortoutput_length - perfdata_length
+        lengths = _output_lengths(lines)
+        if sum(lengths) + len(lengths) > budget:
+            budget -= _FOOTER_LENGTH
+            for kept, length in enumerate(lengths):
+                budget -= length + 1
+                if budget < 0:
+                    hidden += len(lines) - kept
+                    del lines[kept:]
+                    break
+
+    if hidden > 0:
+        lines.append(_FOOTER.format(len(lines), hidden))
+
+    output = '\n'.join([shortoutput] + lines)
+    if perfdata:
+        output = output + ' | ' + ' '.join(perfdata)
+
+    return output
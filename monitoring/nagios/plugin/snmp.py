@@ -21,17 +21,30 @@
 
 """SNMP module for plugins."""
 
+import os
+import functools
 import logging as log
 
 from monitoring.nagios.plugin import argument
 from monitoring.nagios.probes import ProbeSNMP
+from monitoring.nagios.probes.snmp import SNMP_VERSIONS
+from monitoring.nagios.probes.snmppoller import PolledProbeSNMP
 from monitoring.nagios.plugin import NagiosPlugin
 
 logger = log.getLogger('monitoring.nagios.plugin.snmp')
 
 
 class NagiosPluginSNMP(NagiosPlugin):
-    """A standard SNMP Nagios plugin."""
+    """
+    A standard SNMP Nagios plugin.
+
+    SNMP v1 and v2c requests are sent through :attr:`poller` when it is set,
+    like by the scheduler with ``--snmp-poller``.
+    """
+    #: A :class:`monitoring.nagios.probes.snmppoller.SNMPPoller` shared by
+    #: the plugins of the process, or None.
+    poller = None
+
     def __init__(self, *args, **kwargs):
         super(NagiosPluginSNMP, self).__init__(*args, **kwargs)
 
@@ -43,14 +56,26 @@ class NagiosPluginSNMP(NagiosPlugin):
             self.snmp_version = 2
 
         # Init a new probe of type SNMP
-        self.snmp = ProbeSNMP(
+        if self.poller is not None and self.snmp_version < 2:
+            probe_class = functools.partial(PolledProbeSNMP, self.poller)
+        else:
+            probe_class = ProbeSNMP
+        self.snmp = probe_class(
             hostaddress=self.options.hostname,
+            port=self.options.port,
             community=self.options.snmpcommunity,
             snmp_version=self.snmp_version,
             login=self.options.snmpv3_login,
             password=self.options.snmpv3_password,
             auth_protocol=self.options.auth_protocol,
             priv_protocol=self.options.priv_protocol,
+            timeout=self.options.snmp_timeout,
+            retries=self.options.snmp_retries,
+            backoff=self.options.snmp_backoff,
+            capabilities_file=os.path.join(
+                self._picklefile_path, 'snmp',
+                '{0.hostname}_{0.port}_{1}.pkl'.format(
+                    self.options, SNMP_VERSIONS[self.snmp_version])),
         )
 
         if 'NagiosPluginSNMP' == self.__class__.__name__:
@@ -76,6 +101,29 @@ class NagiosPluginSNMP(NagiosPlugin):
                                  default=161,
                                  help='Port to connect to (default to 161).')
 
+        self.parser.add_argument('--snmp-timeout',
+                                 type=float,
+                                 dest='snmp_timeout',
+                                 default=None,
+                                 help='Timeout in seconds of the first '
+                                      'attempt of a SNMP request (default '
+                                      'adapts to the response time of the '
+                                      'host).')
+
+        self.parser.add_argument('--snmp-retries',
+                                 type=int,
+                                 dest='snmp_retries',
+                                 default=1,
+                                 help='Number of retries of a SNMP request '
+                                      '(default 1).')
+
+        self.parser.add_argument('--snmp-backoff',
+                                 type=float,
+                                 dest='snmp_backoff',
+                                 default=2.0,
+                                 help='Factor applied to the timeout at each '
+                                      'retry (default 2).')
+
         # Specific to SNMPv3
         self.parser.add_argument('-3',
                                  action='store_true',
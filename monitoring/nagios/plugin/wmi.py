@@ -21,15 +21,148 @@
 
 """WMI module for plugins."""
 
+from __future__ import division
 import logging
-import csv
+import hashlib
+import subprocess as sp
+from itertools import izip
 from pprint import pformat
 
+from monitoring.nagios import profiling
 from monitoring.nagios.plugin import NagiosPlugin
 from monitoring.nagios.probes import ProbeWMI
+from monitoring.nagios.probes.wmi import parse_wmic_output
 
 logger = logging.getLogger('monitoring.nagios.plugin.wmi')
 
+# Raw performance counter types (CounterType qualifier of the properties in
+# Win32_PerfRawData_* classes).
+PERF_COUNTER_RAWCOUNT = 65536
+PERF_COUNTER_LARGE_RAWCOUNT = 65792
+PERF_COUNTER_COUNTER = 272696320
+PERF_COUNTER_BULK_COUNT = 272696576
+PERF_100NSEC_TIMER = 542180608
+PERF_100NSEC_TIMER_INV = 558957824
+PERF_COUNTER_100NS_QUEUELEN_TYPE = 5571840
+PERF_RAW_FRACTION = 537003008
+PERF_AVERAGE_TIMER = 805438464
+PERF_AVERAGE_BULK = 1073874176
+PERF_ELAPSED_TIME = 807666944
+
+
+def _delta(name, previous, current):
+    """Difference of a counter between two samples."""
+    delta = current[name] - previous[name]
+    if delta < 0:
+        raise ValueError('Counter {0} has been reset.'.format(name))
+    return delta
+
+
+def _per_second(name, previous, current):
+    """Rate per second (PERF_COUNTER_COUNTER, PERF_COUNTER_BULK_COUNT)."""
+    return _delta(name, previous, current) / (
+        _delta('Timestamp_PerfTime', previous, current) /
+        current['Frequency_PerfTime'])
+
+
+def _percent_100ns(name, previous, current):
+    """Percent of time active (PERF_100NSEC_TIMER)."""
+    return 100 * _delta(name, previous, current) / \
+        _delta('Timestamp_Sys100NS', previous, current)
+
+
+def _percent_100ns_inv(name, previous, current):
+    """Percent of time active (PERF_100NSEC_TIMER_INV)."""
+    return 100 * (1 - _delta(name, previous, current) /
+                  _delta('Timestamp_Sys100NS', previous, current))
+
+
+def _queue_length_100ns(name, previous, current):
+    """Average queue length (PERF_COUNTER_100NS_QUEUELEN_TYPE)."""
+    return _delta(name, previous, current) / \
+        _delta('Timestamp_Sys100NS', previous, current)
+
+
+def _raw_fraction(name, _, current):
+    """Percent of the base value (PERF_RAW_FRACTION)."""
+    return 100 * current[name] / current[name + '_Base']
+
+
+def _average_timer(name, previous, current):
+    """Average time per operation (PERF_AVERAGE_TIMER)."""
+    return _delta(name, previous, current) / \
+        current['Frequency_PerfTime'] / \
+        _delta(name + '_Base', previous, current)
+
+
+def _average_bulk(name, previous, current):
+    """Average count per operation (PERF_AVERAGE_BULK)."""
+    return _delta(name, previous, current) / \
+        _delta(name + '_Base', previous, current)
+
+
+def _elapsed_time(name, _, current):
+    """Elapsed time in seconds (PERF_ELAPSED_TIME)."""
+    return (current['Timestamp_Object'] - current[name]) / \
+        current['Frequency_Object']
+
+
+#: Formulas by counter type: ``(columns, needs_previous, formula)``. Columns
+#: are the extra properties the formula needs, ``{0}`` is the counter name.
+COUNTER_TYPES = {
+    PERF_COUNTER_RAWCOUNT: ((), False, lambda name, _, current: current[name]),
+    PERF_COUNTER_LARGE_RAWCOUNT: (
+        (), False, lambda name, _, current: current[name]),
+    PERF_COUNTER_COUNTER: (
+        ('Timestamp_PerfTime', 'Frequency_PerfTime'), True, _per_second),
+    PERF_COUNTER_BULK_COUNT: (
+        ('Timestamp_PerfTime', 'Frequency_PerfTime'), True, _per_second),
+    PERF_100NSEC_TIMER: (('Timestamp_Sys100NS',), True, _percent_100ns),
+    PERF_100NSEC_TIMER_INV: (
+        ('Timestamp_Sys100NS',), True, _percent_100ns_inv),
+    PERF_COUNTER_100NS_QUEUELEN_TYPE: (
+        ('Timestamp_Sys100NS',), True, _queue_length_100ns),
+    PERF_RAW_FRACTION: (('{0}_Base',), False, _raw_fraction),
+    PERF_AVERAGE_TIMER: (
+        ('{0}_Base', 'Frequency_PerfTime'), True, _average_timer),
+    PERF_AVERAGE_BULK: (('{0}_Base',), True, _average_bulk),
+    PERF_ELAPSED_TIME: (
+        ('Timestamp_Object', 'Frequency_Object'), False, _elapsed_time),
+}
+
+
+def counter_value(counter_type, name, previous, current):
+    """
+    Compute the value of a raw performance counter.
+
+    **Example**::
+
+     >>> previous = {'PercentProcessorTime': 0, 'Timestamp_Sys100NS': 0}
+     >>> current = {'PercentProcessorTime': 25, 'Timestamp_Sys100NS': 100}
+     >>> counter_value(PERF_100NSEC_TIMER_INV, 'PercentProcessorTime',
+     ...               previous, current)
+     75.0
+
+    :param counter_type: one of the ``PERF_*`` counter types.
+    :type counter_type: int
+    :param name: name of the counter property.
+    :type name: str
+    :param previous: previous sample ``{property: value}``, may be ``None``.
+    :type previous: dict
+    :param current: current sample ``{property: value}``.
+    :type current: dict
+    :return: the counter value or ``None`` if it cannot be computed (no
+             previous sample, counter reset, ...).
+    """
+    _, needs_previous, formula = COUNTER_TYPES[counter_type]
+    if needs_previous and previous is None:
+        return None
+
+    try:
+        return formula(name, previous, current)
+    except (ValueError, TypeError, KeyError, ZeroDivisionError):
+        return None
+
 
 class NagiosPluginWMI(NagiosPlugin):
     """Base for a standard WMI Nagios plugin"""
@@ -78,31 +211,163 @@ class NagiosPluginWMI(NagiosPlugin):
         """Check syntax of all arguments"""
         super(NagiosPluginWMI, self).verify_plugin_arguments()
 
-    def execute(self, query):
+    def execute(self, query, schemas=None):
         """
         Wrapper arround :meth:`monitoring.nagios.probes.ProbeWMI.execute`
         method. Handles exceptions and parse CSV results.
 
-        :return: A dict with keys as WMI columns and their values.
+        :param query: The WMI query.
+        :type query: str, unicode
+        :param schemas: converters to apply on values by WMI class. See
+                        :func:`monitoring.nagios.probes.wmi.parse_wmic_output`.
+        :type schemas: dict
+        :return: A list of dict with keys as WMI columns and their values.
+        :rtype: list
+        """
+        query_results = list(self.iter_execute(query, schemas))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('WMI results:\n%s', pformat(query_results))
+
+        return query_results
+
+    def execute_many(self, queries, schemas=None):
+        """
+        Run several WMI queries concurrently, one ``wmic`` process per query.
+        See :meth:`monitoring.nagios.probes.ProbeWMI.execute_many`. The plugin
+        exits UNKNOWN if any of the queries fails.
+
+        Useful for plugins needing data from several WMI classes::
+
+         results = plugin.execute_many({
+             'cpu': 'SELECT LoadPercentage FROM Win32_Processor',
+             'memory': 'SELECT FreePhysicalMemory FROM Win32_OperatingSystem',
+             'disks': 'SELECT Name, FreeSpace FROM Win32_LogicalDisk',
+         })
+         print results['disks'][0]['FreeSpace']
+
+        :param queries: dict of ``{name: query}``.
+        :type queries: dict
+        :param schemas: converters to apply on values by WMI class.
+        :type schemas: dict
+        :return: dict of ``{name: results}`` with results the same as
+                 :meth:`execute`.
         :rtype: dict
         """
-        wmic_output = None
+        query_results = {}
 
         try:
-            wmic_output = self.probe.execute(query)
+            wmic_outputs = self.probe.execute_many(queries)
         except OSError:
             self.unknown('Unable to find \'wmic\' binary !')
-        except Exception as e:
+        except sp.CalledProcessError as e:
             self.unknown('Error during the WMI query !\n'
                          'Command: {0.cmd}\nOutput: {0.output}'.format(e))
 
-        # Split lines in list, remove headers
-        wmic_output = wmic_output.splitlines()[1:]
-
-        # Parse CSV result
-        csv_reader = csv.DictReader(wmic_output, delimiter='|')
-        query_results = list(csv_reader)
+        for name, wmic_output in wmic_outputs.iteritems():
+            query_results[name] = list(
+                parse_wmic_output(wmic_output.splitlines(), schemas))
 
-        logger.debug('WMI results:\n%s', pformat(query_results))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('WMI results:\n%s', pformat(query_results))
 
         return query_results
+
+    def iter_execute(self, query, schemas=None):
+        """
+        Same as :meth:`execute` but yields WMI records as ``wmic`` outputs
+        them. Stop iterating to terminate the query early::
+
+         for process in plugin.iter_execute('SELECT * FROM Win32_Process'):
+             if process['Name'] == 'sqlservr.exe':
+                 break
+
+        :return: generator of
+                 :class:`monitoring.nagios.probes.wmi.WMIRecord`.
+        """
+        try:
+            with profiling.phase('wmi_execute'):
+                for record in parse_wmic_output(self.probe.stream(query),
+                                                schemas):
+                    yield record
+        except OSError:
+            self.unknown('Unable to find \'wmic\' binary !')
+        except sp.CalledProcessError as e:
+            self.unknown('Error during the WMI query !\n'
+                         'Command: {0.cmd}\nOutput: {0.output}'.format(e))
+
+    def perf_counters(self, wmi_class, counters, key='Name', where=None):
+        """
+        Query a ``Win32_PerfRawData_*`` class and compute the value of raw
+        counters for all instances.
+
+        Raw samples are saved in a retention file by query (class, counters
+        and condition) to be used as previous samples on next execution.
+        Values that need a previous sample are ``None`` on first execution.
+
+        ::
+
+         cpu = plugin.perf_counters(
+             'Win32_PerfRawData_PerfOS_Processor',
+             {'PercentProcessorTime': PERF_100NSEC_TIMER_INV,
+              'InterruptsPersec': PERF_COUNTER_COUNTER})
+         print cpu['_Total']['PercentProcessorTime']
+
+        :param wmi_class: the WMI raw performance class.
+        :type wmi_class: str
+        :param counters: dict of ``{counter name: counter type}``.
+        :type counters: dict
+        :param key: the column identifying instances (default ``Name``).
+        :type key: str
+        :param where: optional WQL condition.
+        :type where: str
+        :return: dict of ``{instance: {counter name: value}}``.
+        :rtype: dict
+        """
+        columns = set()
+        for name, counter_type in counters.iteritems():
+            columns.add(name)
+            columns.update(column.format(name)
+                           for column in COUNTER_TYPES[counter_type][0])
+        columns = tuple(sorted(columns))
+
+        query = 'SELECT {0},{1} FROM {2}'.format(key, ','.join(columns),
+                                                 wmi_class)
+        if where:
+            query = '{0} WHERE {1}'.format(query, where)
+
+        schema = dict.fromkeys(columns, int)
+        schema[key] = str
+
+        # One retention file by query, calls on the same class with other
+        # counters or conditions must not overwrite each other samples
+        query_hash = hashlib.md5(query).hexdigest()[:12]
+        picklefile = self.retention_file('wmi_{0}_{1}'.format(wmi_class,
+                                                              query_hash))
+        try:
+            previous_columns, previous_samples = self.load_data(picklefile)
+            if previous_columns != columns:
+                previous_samples = {}
+        except IOError:
+            previous_samples = {}
+
+        samples = {}
+        values = {}
+        for record in self.iter_execute(query, {wmi_class: schema}):
+            instance = record[key]
+            current = tuple(record[column] for column in columns)
+            samples[instance] = current
+
+            previous = previous_samples.get(instance)
+            if previous is not None:
+                previous = dict(izip(columns, previous))
+
+            values[instance] = dict(
+                (name, counter_value(counter_type, name, previous, record))
+                for name, counter_type in counters.iteritems())
+
+        self.save_data((columns, samples), picklefile=picklefile)
+
+        logger.debug('Performance counters of %s: %s', wmi_class, values)
+
+        return values
@@ -3,4 +3,4 @@ from monitoring.nagios.probes.snmp import ProbeSNMP
 from monitoring.nagios.probes.secureshell import ProbeSSH
 from monitoring.nagios.probes.mssql import ProbeMSSQL
 from monitoring.nagios.probes.wmi import ProbeWMI
-from monitoring.nagios.probes.http import ProbeHTTP
+from monitoring.nagios.probes.http import ProbeHTTP, AsyncProbeHTTP
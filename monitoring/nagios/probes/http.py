@@ -22,16 +22,176 @@
 """HTTP probe module."""
 
 import logging
+import threading
+import os
+import re
+import time
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
-from bs4 import BeautifulSoup
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.cElementTree as etree
 
 from monitoring.nagios.probes import Probe
+from monitoring.nagios.profiling import timed, phase
 from monitoring.nagios.exceptions import NagiosUnknown
 
 logger = logging.getLogger('monitoring.nagios.probes.http')
 
+#: Maximum number of connection pools kept, the least recently used ones are
+#: closed.
+MAX_CONNECTION_POOLS = 100
+
+# Connection pools shared by all probes, by base URL from the least to the
+# most recently used
+_adapters = OrderedDict()
+_adapters_lock = threading.Lock()
+
+#: Longest line kept whole by :meth:`HTTPResponse.search` for regular
+#: expressions, longer lines are matched by overlapping windows.
+MAX_SEARCH_LINE = 65536
+
+# Durations of connection phases of the request being sent by the thread
+_phases = threading.local()
+
+# Connection classes recording their connection duration, by pool class
+_timed_connection_classes = {}
+
+
+def _record_phase(name, start):
+    """Record the duration of a connection phase started at ``start``."""
+    timings = getattr(_phases, 'timings', None)
+    if timings is not None:
+        timings[name] += time.time() - start
+
+
+class _TimedConnection(object):
+    """
+    Mixin for ``httplib`` connection classes recording the duration of
+    ``connect()``: DNS resolution, TCP connection and SSL handshake.
+    """
+    def connect(self):
+        start = time.time()
+        super(_TimedConnection, self).connect()
+        _record_phase('connect', start)
+
+
+def _timed_connection_class(connection_class):
+    """Return the subclass of ``connection_class`` timing new connections."""
+    timed_class = _timed_connection_classes.get(connection_class)
+    if timed_class is None:
+        timed_class = type('Timed{0}'.format(connection_class.__name__),
+                           (_TimedConnection, connection_class), {})
+        _timed_connection_classes[connection_class] = timed_class
+    return timed_class
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter recording the duration of request phases in attribute
+    ``timings`` of responses, a dict with keys:
+
+    - ``connect``: opening a new connection, including DNS resolution and
+      SSL handshake. This is ``0`` when a kept alive connection is reused.
+    - ``ttfb``: time to first byte, from the request sent to the headers of
+      the response received.
+
+    Only public APIs of ``requests`` and ``httplib`` are used: connection
+    pools given by :meth:`get_connection` create connections of a subclass
+    timing ``connect()``.
+    """
+    def get_connection(self, url, proxies=None):
+        pool = super(TimedHTTPAdapter, self).get_connection(url, proxies)
+        if not issubclass(pool.ConnectionCls, _TimedConnection):
+            pool.ConnectionCls = _timed_connection_class(pool.ConnectionCls)
+        return pool
+
+    def send(self, request, **kwargs):
+        timings = {'connect': 0.0}
+        _phases.timings = timings
+        start = time.time()
+        try:
+            response = super(TimedHTTPAdapter, self).send(request, **kwargs)
+        finally:
+            _phases.timings = None
+
+        timings['ttfb'] = time.time() - start - timings['connect']
+        response.timings = timings
+        return response
+
+
+def get_adapter(baseurl, pool_size=10, max_retries=0):
+    """
+    Return the transport adapter shared by all probes requesting ``baseurl``,
+    creating it if needed.
+
+    The adapter holds the connection pool: connections are kept alive so
+    following requests to the same server do not open a new TCP connection
+    nor do a new SSL handshake. At most :data:`MAX_CONNECTION_POOLS` pools are
+    kept, the least recently used one is closed when a new one is needed, so
+    a long running scheduler does not keep sockets open to every host it ever
+    checked.
+
+    :param baseurl: the base URL, like ``http://host:80``.
+    :type baseurl: str
+    :param pool_size: maximum number of connections kept in the pool. Only
+                      used when the adapter is created.
+    :type pool_size: int
+    :param max_retries: number of retries on connection failures. Only used
+                        when the adapter is created.
+    :type max_retries: int
+    :return: :class:`TimedHTTPAdapter`
+    """
+    with _adapters_lock:
+        adapter = _adapters.pop(baseurl, None)
+        if adapter is None:
+            logger.debug('New HTTP connection pool for %s (pool size: %d, '
+                         'retries: %d).', baseurl, pool_size, max_retries)
+            adapter = TimedHTTPAdapter(pool_connections=1,
+                                       pool_maxsize=pool_size,
+                                       max_retries=max_retries)
+        _adapters[baseurl] = adapter
+
+        while len(_adapters) > MAX_CONNECTION_POOLS:
+            evicted_url, evicted = _adapters.popitem(last=False)
+            logger.debug('Closing HTTP connection pool for %s.', evicted_url)
+            evicted.close()
+        return adapter
+
+
+def get_session(baseurl, pool_size=10, max_retries=0):
+    """
+    Return a new ``requests.Session`` sending requests through the connection
+    pool shared by all probes requesting ``baseurl``, see :func:`get_adapter`.
+
+    Only connections are shared: each session has its own cookies, headers
+    and authentication, so checks using different credentials on the same
+    server do not see each other's.
+
+    :param baseurl: the base URL, like ``http://host:80``.
+    :type baseurl: str
+    :param pool_size: maximum number of connections kept in the pool.
+    :type pool_size: int
+    :param max_retries: number of retries on connection failures.
+    :type max_retries: int
+    :return: ``requests.Session``
+    """
+    adapter = get_adapter(baseurl, pool_size, max_retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class HTTPResponse(object):
     """
@@ -41,11 +201,30 @@ class HTTPResponse(object):
     parsing response to others formats.
 
     Check out `requests.Response API reference <http://www.python-requests.org/en/latest/api/#requests.Response>`_ for more details.
+
+    .. attribute:: HTTPResponse.timings
+
+        Durations in seconds of the request phases: ``connect`` (new
+        connection, with DNS resolution and SSL handshake), ``ttfb`` (time to
+        first byte), ``transfer`` (body download, not set when streaming) and
+        ``total``. ``None`` if the response was
+        not requested (fresh in cache).
     """
     __attributes = ()
 
     def __init__(self, response):
         self.__response = response
+        self._json = None
+        self.bytes_read = 0
+        self.truncated = False
+
+        # Durations of request phases, set by TimedHTTPAdapter
+        self.timings = getattr(response, 'timings', None)
+
+        # Set when the response comes from or is stored in a HTTPCache
+        self.from_cache = False
+        self._cache = None
+        self._cache_entry = None
 
     def __getattr__(self, item):
         """
@@ -57,23 +236,435 @@ class HTTPResponse(object):
         else:
             return getattr(self.__response, item)
 
+    def _check_status(self, fmt):
+        """Raise NagiosUnknown if the response status is not 200."""
+        if self.status_code != ProbeHTTP.status_codes.ok:
+            raise NagiosUnknown(
+                "HTTP Error {0.status_code}: Unable to fetch "
+                "{1} data from {0.url} !".format(self, fmt))
+
     def xml(self):
         """
         Parse response as XML and make a BeautifulSoup out of it.
 
+        BeautifulSoup is tolerant with malformed documents but slow on large
+        ones, prefer :meth:`etree` or :meth:`iterxml` in this case.
+
         :returns: an instance of ``BeautifulSoup`` class.
         """
-        if self.status_code == ProbeHTTP.status_codes.ok:
-            xml = BeautifulSoup(self.text)
-            if xml.find_all(True):
-                return xml
-            else:
-                raise NagiosUnknown("Cannot parse XML data ! "
-                                    "Please investigate.")
+        from bs4 import BeautifulSoup
+
+        self._check_status("XML")
+
+        xml = BeautifulSoup(self.text)
+        if xml.find(True):
+            return xml
         else:
-            raise NagiosUnknown(
-                "HTTP Error {0.status_code}: Unable to fetch "
-                "XML data from {0.url} !".format(self))
+            raise NagiosUnknown("Cannot parse XML data ! "
+                                "Please investigate.")
+
+    def etree(self):
+        """
+        Parse response as XML using ``lxml`` if installed, else
+        ``cElementTree``.
+
+        :returns: the root ``Element`` of the document.
+        """
+        self._check_status("XML")
+
+        try:
+            return etree.fromstring(self.content)
+        except SyntaxError as e:
+            raise NagiosUnknown("Cannot parse XML data ! "
+                                "Please investigate.\n{}".format(e))
+
+    def iterxml(self, tag=None):
+        """
+        Parse response as XML incrementally and yield elements as soon as
+        they are parsed. Elements are cleared and removed from their parent
+        once processed, at any depth, so memory does not grow with the size
+        of the document::
+
+         for alert in response.iterxml('alert'):
+             print alert.findtext('last_update')
+
+        Use ``stream=True`` when doing the request to parse the body while it
+        is downloaded.
+
+        :param tag: only yield elements with this tag name, default to all.
+        :type tag: str
+        :returns: generator of ``Element``.
+        """
+        self._check_status("XML")
+
+        context = etree.iterparse(_ContentReader(self),
+                                  events=('start', 'end'))
+        # Elements being parsed and how many of them are to be yielded
+        parents = []
+        matching = 0
+        try:
+            for event, element in context:
+                if event == 'start':
+                    parents.append(element)
+                    if tag is not None and element.tag == tag:
+                        matching += 1
+                    continue
+
+                parents.pop()
+                if tag is None or element.tag == tag:
+                    if tag is not None:
+                        matching -= 1
+                    yield element
+
+                # Keep the content of an element still to be yielded
+                if matching:
+                    continue
+                element.clear()
+                if parents:
+                    parents[-1].remove(element)
+        except SyntaxError as e:
+            raise NagiosUnknown("Cannot parse XML data ! "
+                                "Please investigate.\n{}".format(e))
+
+    def xpath(self, expression):
+        """
+        Find elements in the XML response. This is full XPath with ``lxml``,
+        else the XPath subset of ``ElementTree``.
+
+        **Example**::
+
+         >>> response.xpath('.//alert/last_update')[0].text
+         '10:00'
+
+        :param expression: the path of elements to find.
+        :type expression: str
+        :returns: a list of ``Element``.
+        """
+        root = self.etree()
+        if hasattr(root, 'xpath'):
+            return root.xpath(expression)
+        return root.findall(expression)
+
+    def json(self, **kwargs):
+        """
+        Parse response as JSON. The result is kept so parsing is done only
+        once.
+
+        :raises ValueError: if the response is not valid JSON.
+        :returns: the Python objects of the JSON document.
+        """
+        if self._json is None:
+            self._json = self.__response.json(**kwargs)
+            if self._cache is not None:
+                self._cache_entry['json'] = self._json
+                self._cache.store(self._cache_entry)
+        return self._json
+
+    def jsonpath(self, path):
+        """
+        Get a value in the JSON response by its path. The path is a list of
+        keys or list indexes separated by ``/``.
+
+        **Example**::
+
+         >>> response.json()
+         {u'queues': [{u'name': u'mail', u'depth': 42}]}
+         >>> response.jsonpath('queues/0/depth')
+         42
+
+        :param path: the path of the value.
+        :type path: str
+        :raises KeyError: if the path does not exist.
+        :returns: the value.
+        """
+        value = self.json()
+        for key in path.strip('/').split('/'):
+            try:
+                if isinstance(value, list):
+                    value = value[int(key)]
+                else:
+                    value = value[key]
+            except (IndexError, ValueError, TypeError, KeyError):
+                raise KeyError('JSON path not found: {}'.format(path))
+        return value
+
+    def iter_body(self, max_bytes=None, chunk_size=8192):
+        """
+        Iterate over the body of the response by chunks, reading at most
+        ``max_bytes`` bytes.
+
+        Use ``stream=True`` when doing the request so the body is not
+        downloaded at once. If the limit is reached, attribute
+        :attr:`truncated` is set to ``True`` and the connection is closed
+        without reading the rest of the body. The number of bytes read is
+        available in attribute :attr:`bytes_read`.
+
+        :param max_bytes: maximum number of bytes to read, default no limit.
+        :type max_bytes: int
+        :param chunk_size: size of chunks in bytes.
+        :type chunk_size: int
+        :returns: generator of str.
+        """
+        self.bytes_read = 0
+        self.truncated = False
+
+        for chunk in self.iter_content(chunk_size):
+            if max_bytes is not None and \
+                    self.bytes_read + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - self.bytes_read]
+                self.truncated = True
+
+            self.bytes_read += len(chunk)
+            if chunk:
+                yield chunk
+
+            if self.truncated:
+                logger.debug('Body limit of %d bytes reached on %s, closing '
+                             'connection.', max_bytes, self.url)
+                self._discard()
+                break
+
+    def search(self, patterns, max_bytes=None, chunk_size=8192,
+               max_line=MAX_SEARCH_LINE):
+        """
+        Search patterns in the body of the response while it is read, without
+        keeping the body in memory. Reading stops as soon as all patterns are
+        found or after ``max_bytes`` bytes.
+
+        A pattern is either a string searched as is or a compiled regular
+        expression matched on each line of the body. Lines longer than
+        ``max_line`` bytes are not kept whole but matched by overlapping
+        windows, a match longer than ``max_line`` bytes may be missed in
+        them::
+
+         response = plugin.http.get("/app.log", stream=True)
+         found = response.search(["FATAL", re.compile(r"took (\d+)ms")],
+                                 max_bytes=10 * 1024 * 1024)
+
+        :param patterns: list of str or compiled regular expressions.
+        :type patterns: list
+        :param max_bytes: maximum number of bytes to read, default no limit.
+        :type max_bytes: int
+        :param chunk_size: size of chunks in bytes.
+        :type chunk_size: int
+        :param max_line: longest line kept whole for regular expressions.
+        :type max_line: int
+        :returns: dict ``{pattern: match}``, the match being the pattern for
+                  a string, a match object for a regular expression or
+                  ``None`` if not found.
+        """
+        results = dict.fromkeys(patterns)
+        strings = [p for p in patterns if isinstance(p, basestring)]
+        regexps = [p for p in patterns if not isinstance(p, basestring)]
+
+        # Part of previous chunk that may contain the start of a string
+        overlap = max([len(string) for string in strings] or [1]) - 1
+        tail = ''
+        # Last incomplete line for regular expressions
+        line = ''
+
+        def match_line(line):
+            """Match regular expressions not yet found on a line."""
+            for regexp in regexps:
+                if results[regexp] is None:
+                    results[regexp] = regexp.search(line)
+
+        for chunk in self.iter_body(max_bytes, chunk_size):
+            if strings:
+                window = tail + chunk
+                for string in strings:
+                    if results[string] is None and string in window:
+                        results[string] = string
+                tail = window[-overlap:] if overlap else ''
+
+            if regexps:
+                lines = (line + chunk).split('\n')
+                line = lines.pop()
+                for full_line in lines:
+                    match_line(full_line)
+                if len(line) > 2 * max_line:
+                    # No end of line in sight, match what we have and only
+                    # carry the end that may hold the start of a match
+                    match_line(line)
+                    line = line[-max_line:]
+
+            if all(result is not None for result in results.itervalues()):
+                self._discard()
+                break
+        else:
+            if line:
+                match_line(line)
+
+        return results
+
+    def _discard(self):
+        """Close the connection without reading the rest of the body."""
+        raw = self.raw
+        if raw is None:
+            return
+        raw.close()
+        connection = getattr(raw, '_connection', None)
+        if connection is not None:
+            connection.close()
+        raw.release_conn()
+
+
+class _ContentReader(object):
+    """File like object reading the body of a response by chunks."""
+    def __init__(self, response, chunk_size=65536):
+        self._chunks = response.iter_content(chunk_size)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        """Read at most ``size`` bytes."""
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class HTTPCache(object):
+    """
+    Cache of HTTP responses, stored in a directory and keyed by URL.
+
+    Responses are cached if they have an ``ETag`` or ``Last-Modified`` header
+    to do conditional requests, or a ``max-age`` in ``Cache-Control`` to
+    avoid requests while they are fresh. ``Cache-Control: no-store`` is
+    honoured.
+
+    :param directory: the directory where responses are stored.
+    :type directory: str
+    """
+    max_age_pattern = re.compile(r'max-age=(\d+)')
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _filename(self, url):
+        """Return the file name of the cache entry for ``url``."""
+        return os.path.join(self.directory, 'http_{}.pkl'.format(
+            hashlib.sha1(url).hexdigest()))
+
+    def load(self, url):
+        """
+        Load the cache entry of ``url``.
+
+        :returns: the entry as a dict or ``None`` if there is no entry.
+        """
+        try:
+            with open(self._filename(url), 'rb') as pkl:
+                return pickle.load(pkl)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def store(self, entry):
+        """Store a cache entry, the file is replaced atomically."""
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmpname = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as pkl:
+                pickle.dump(entry, pkl, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self._filename(entry['url']))
+        except (IOError, OSError) as e:
+            logger.debug('Cannot store HTTP cache entry of %s: %s',
+                         entry['url'], e)
+
+    def expires(self, headers):
+        """
+        Return the expiration timestamp from the ``Cache-Control`` header,
+        ``None`` if the response must be revalidated and ``False`` if it
+        must not be stored.
+        """
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return False
+        if 'no-cache' in cache_control:
+            return None
+        max_age = self.max_age_pattern.search(cache_control)
+        if max_age:
+            return time.time() + int(max_age.group(1))
+        return None
+
+    def entry(self, response):
+        """
+        Make a cache entry from a ``requests.Response``.
+
+        :returns: the entry as a dict or ``None`` if the response cannot be
+                  cached.
+        """
+        expires = self.expires(response.headers)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if expires is False or not (expires or etag or last_modified):
+            return None
+
+        return {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'content': response.content,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expires': expires,
+            'json': None,
+        }
+
+    def response(self, entry):
+        """Make a :class:`HTTPResponse` from a cache entry."""
+        response = requests.Response()
+        response.url = entry['url']
+        response.status_code = entry['status_code']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = entry['content']
+        response._content_consumed = True
+
+        http_response = HTTPResponse(response)
+        http_response.from_cache = True
+        http_response._json = entry['json']
+        http_response._cache = self
+        http_response._cache_entry = entry
+        return http_response
+
+
+class HTTPRequestError(object):
+    """
+    This class represents a request that failed in
+    :meth:`ProbeHTTP.get_many`.
+
+    .. attribute:: HTTPRequestError.url
+
+        The requested URL.
+
+    .. attribute:: HTTPRequestError.error
+
+        The ``requests`` exception raised by the request.
+
+    .. attribute:: HTTPRequestError.status_code
+
+        The HTTP status code if the server answered, else ``None``.
+    """
+    ok = False
+
+    def __init__(self, url, error):
+        self.url = url
+        self.error = error
+
+        response = getattr(error, 'response', None)
+        self.status_code = response.status_code \
+            if response is not None else None
+
+    def __str__(self):
+        return "HTTP GET error on URL: {0.url}\n{0.error}".format(self)
 
 
 class ProbeHTTP(Probe):
@@ -82,10 +673,34 @@ class ProbeHTTP(Probe):
 
     This is basically just a wrapper arround `requests
     <http://www.python-requests.org/en/latest/>`_ library.
+
+    Requests are sent through a pool of kept alive connections shared by all
+    probes on the same base URL, see :func:`get_session`.
+
+    :param hostaddress: The host to connect to.
+    :type hostaddress: str
+    :param port: The port the server listen on (default to 80).
+    :type port: int
+    :param ssl: Use HTTPS (default to False).
+    :type ssl: bool
+    :param auth: Basic authentication as ``(login, passwd)``.
+    :type auth: tuple
+    :param pool_size: Maximum number of connections kept alive.
+    :type pool_size: int
+    :param max_retries: Number of retries on connection failures.
+    :type max_retries: int
+    :param cache_dir: Cache GET responses in this directory, see
+                      :class:`HTTPCache`. Default is no cache.
+    :type cache_dir: str
+    :param session: Use this ``requests.Session`` instead of the one shared
+                    by base URL.
+    :type session: requests.Session
     """
     status_codes = requests.codes
 
-    def __init__(self, hostaddress, port=80, ssl=False, auth=None):
+    @timed('http_init')
+    def __init__(self, hostaddress, port=80, ssl=False, auth=None,
+                 pool_size=10, max_retries=0, cache_dir=None, session=None):
         super(ProbeHTTP, self).__init__()
 
         self.hostaddress = hostaddress
@@ -93,9 +708,16 @@ class ProbeHTTP(Probe):
         self.auth = () if not auth else auth
         self.protocol = "http" if not ssl else "https"
         self.baseurl = "{0.protocol}://{0.hostaddress}:{0.port}".format(self)
+        self.session = session if session is not None else get_session(
+            self.baseurl, pool_size, max_retries)
+        self.cache = HTTPCache(cache_dir) if cache_dir else None
+
+        # Timings of the last request, see HTTPResponse.timings
+        self.timings = None
 
         logger.debug("Initialized a new HTTP probe on %s.", self.baseurl)
 
+    @timed('http_get')
     def get(self, path, **kwargs):
         """
         Send a HTTP GET request. See requests.get() api reference.
@@ -106,18 +728,156 @@ class ProbeHTTP(Probe):
         :param kwargs: optional arguments that requests takes.
         :returns: return of :func:`requests.get`.
         """
-        path = path.lstrip("/")
-        url = "{0}/{1}".format(self.baseurl, path)
+        url = self.url(path)
 
         try:
-            response = requests.get(url, auth=self.auth, **kwargs)
-            response.raise_for_status()
+            response = self._get(url, **kwargs)
         except RequestException as e:
             raise NagiosUnknown("HTTP GET error on URL: {}\n"
                                 "{}".format(url, e))
 
-        return HTTPResponse(response)
+        return response
+
+    @timed('http_get')
+    def get_many(self, paths, max_concurrency=10, timeout=None, **kwargs):
+        """
+        Send HTTP GET requests on several paths concurrently.
 
+        A failed request does not stop the others, it is reported as an
+        instance of :class:`HTTPRequestError` at its place in the results.
+        Both results classes have an ``ok`` attribute::
+
+         responses = plugin.http.get_many(['/health', '/version'])
+         for response in responses:
+             if not response.ok:
+                 print response
+
+        :param paths: the URL locations.
+        :type paths: list
+        :param max_concurrency: maximum number of requests at the same time.
+                                Keep it lower or equal to the connection
+                                pool size.
+        :type max_concurrency: int
+        :param timeout: timeout of each request in seconds.
+        :type timeout: float
+        :param kwargs: optional arguments that requests takes.
+        :returns: a list of :class:`HTTPResponse` or
+                  :class:`HTTPRequestError`, in the order of ``paths``.
+        """
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        def fetch(path):
+            """Request ``path``, returning the error if any."""
+            url = self.url(path)
+            try:
+                return self._get(url, **kwargs)
+            except RequestException as e:
+                logger.debug('HTTP GET error on URL %s: %s', url, e)
+                return HTTPRequestError(url, e)
+
+        pool = ThreadPool(max(1, min(max_concurrency, len(paths))))
+        try:
+            return pool.map(fetch, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def search(self, path, patterns, max_bytes=None, **kwargs):
+        """
+        Send a HTTP GET request and search patterns in the body while it is
+        downloaded. See :meth:`HTTPResponse.search`.
+
+        :param path: the URL location. This is the part after the
+                     ``hostaddress``.
+        :type path: str, unicode
+        :param patterns: list of str or compiled regular expressions.
+        :type patterns: list
+        :param max_bytes: maximum number of bytes to read, default no limit.
+        :type max_bytes: int
+        :param kwargs: optional arguments that requests takes.
+        :returns: tuple ``(response, results)``.
+        """
+        kwargs['stream'] = True
+        response = self.get(path, **kwargs)
+        return response, response.search(patterns, max_bytes)
+
+    def url(self, path):
+        """
+        Return the full URL of ``path``.
+
+        :param path: the URL location. This is the part after the
+                     ``hostaddress``.
+        :type path: str, unicode
+        :returns: str
+        """
+        return "{0}/{1}".format(self.baseurl, path.lstrip("/"))
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a request through the session, adding body transfer and total
+        durations to the timings recorded by :class:`TimedHTTPAdapter`.
+        """
+        stream = kwargs.pop('stream', False)
+
+        start = time.time()
+        response = self.session.request(method, url, auth=self.auth,
+                                        stream=True, **kwargs)
+        timings = getattr(response, 'timings', {})
+        if not stream:
+            transfer_start = time.time()
+            response.content
+            timings['transfer'] = time.time() - transfer_start
+        timings['total'] = time.time() - start
+
+        self.timings = timings
+        return response
+
+    def _get(self, url, **kwargs):
+        """Send a HTTP GET request, raising RequestException on errors."""
+        if self.cache is None or kwargs.get('stream'):
+            response = self._request('GET', url, **kwargs)
+            response.raise_for_status()
+            return HTTPResponse(response)
+
+        entry = self.cache.load(url)
+        if entry is not None:
+            if entry['expires'] and time.time() < entry['expires']:
+                logger.debug('Fresh response of %s in cache.', url)
+                return self.cache.response(entry)
+
+            headers = dict(kwargs.pop('headers', None) or {})
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            kwargs['headers'] = headers
+
+        response = self._request('GET', url, **kwargs)
+
+        if entry is not None and \
+                response.status_code == self.status_codes.not_modified:
+            logger.debug('Response of %s not modified, using cache.', url)
+            expires = self.cache.expires(response.headers)
+            entry['expires'] = expires if expires else None
+            self.cache.store(entry)
+            http_response = self.cache.response(entry)
+            http_response.timings = self.timings
+            return http_response
+
+        response.raise_for_status()
+        http_response = HTTPResponse(response)
+
+        entry = self.cache.entry(response)
+        if entry is not None:
+            entry['url'] = url
+            self.cache.store(entry)
+            http_response._cache = self.cache
+            http_response._cache_entry = entry
+
+        return http_response
+
+    @timed('http_post')
     def post(self, path, data, **kwargs):
         """
         Send a HTTP POST request. See requests.post() api reference.
@@ -130,13 +890,127 @@ class ProbeHTTP(Probe):
         :param kwargs: optional arguments that requests takes.
         :returns: return of :func:`requests.get`.
         """
-        path = path.lstrip("/")
-        url = "{0}/{1}".format(self.baseurl, path)
+        url = self.url(path)
 
         try:
-            response = requests.post(url, data, auth=self.auth, **kwargs)
+            response = self._request('POST', url, data=data, **kwargs)
         except RequestException as e:
             raise NagiosUnknown("HTTP POST error on URL: {}\n"
                                 "{}".format(url, e))
 
-        return HTTPResponse(response)
\ No newline at end of file
+        return HTTPResponse(response)
+
+
+class AsyncProbeHTTP(Probe):
+    """
+    An HTTP probe doing requests concurrently on many hosts.
+
+    Requests are run by a pool of threads sharing a single session. The
+    number of requests at the same time is limited globally by
+    ``max_concurrency`` and by host by ``max_per_host``: a request waits for
+    a free connection to its host.
+
+    Use :meth:`batch` to request the same path on a list of hosts::
+
+     probe = AsyncProbeHTTP(max_concurrency=100, timeout=5)
+     for host, response in probe.batch(vhosts, '/health'):
+         if not response.ok:
+             print host, response
+
+    :param port: The port servers listen on (default to 80).
+    :type port: int
+    :param ssl: Use HTTPS (default to False).
+    :type ssl: bool
+    :param auth: Basic authentication as ``(login, passwd)``.
+    :type auth: tuple
+    :param max_concurrency: Maximum number of requests at the same time.
+    :type max_concurrency: int
+    :param max_per_host: Maximum number of connections to a host.
+    :type max_per_host: int
+    :param timeout: Timeout of requests in seconds.
+    :type timeout: float
+    :param max_retries: Number of retries on connection failures.
+    :type max_retries: int
+    """
+    def __init__(self, port=80, ssl=False, auth=None, max_concurrency=50,
+                 max_per_host=2, timeout=10, max_retries=0):
+        super(AsyncProbeHTTP, self).__init__()
+
+        self.port = port
+        self.ssl = ssl
+        self.auth = auth
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        adapter = TimedHTTPAdapter(pool_connections=max_concurrency,
+                                   pool_maxsize=max_per_host,
+                                   max_retries=max_retries,
+                                   pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def probe(self, hostaddress):
+        """
+        Return a :class:`ProbeHTTP` on ``hostaddress`` sending its requests
+        through the session of this probe.
+        """
+        return ProbeHTTP(hostaddress, port=self.port, ssl=self.ssl,
+                         auth=self.auth, session=self.session)
+
+    def get(self, hostaddress, path, **kwargs):
+        """
+        Send a HTTP GET request to ``hostaddress``. See
+        :meth:`ProbeHTTP.get`.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.probe(hostaddress).get(path, **kwargs)
+
+    def post(self, hostaddress, path, data, **kwargs):
+        """
+        Send a HTTP POST request to ``hostaddress``. See
+        :meth:`ProbeHTTP.post`.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.probe(hostaddress).post(path, data, **kwargs)
+
+    def batch(self, hosts, path='/', **kwargs):
+        """
+        Send a HTTP GET request on ``path`` to all ``hosts`` and yield
+        results as they complete.
+
+        A failed request is reported as an instance of
+        :class:`HTTPRequestError`.
+
+        :param hosts: list of host addresses.
+        :type hosts: list
+        :param path: the URL location.
+        :type path: str, unicode
+        :param kwargs: optional arguments that requests takes.
+        :returns: generator of tuples ``(host, response)``, response being a
+                  :class:`HTTPResponse` or a :class:`HTTPRequestError`.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        def fetch(hostaddress):
+            """Request ``path`` on a host, returning the error if any."""
+            probe = self.probe(hostaddress)
+            url = probe.url(path)
+            try:
+                return hostaddress, probe._get(url, **kwargs)
+            except RequestException as e:
+                logger.debug('HTTP GET error on URL %s: %s', url, e)
+                return hostaddress, HTTPRequestError(url, e)
+
+        hosts = list(hosts)
+        pool = ThreadPool(max(1, min(self.max_concurrency, len(hosts))))
+        try:
+            results = pool.imap_unordered(fetch, hosts)
+            for _ in hosts:
+                # Time the wait of each response, not the caller work
+                with phase('http_get'):
+                    result = next(results)
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Resolution of MIB symbols like ``IF-MIB::ifHCInOctets`` to OIDs.
+
+Loading MIB modules with the MIB builder of pysnmp takes a long time, so
+symbols are resolved with a cache file generated once from the MIB modules::
+
+ python -m monitoring.nagios.probes.mibs IF-MIB SNMPv2-MIB \
+     --mib-dir /usr/share/pysnmp/mibs
+
+The cache file is a ``marshal`` dump of a dict of symbol names to OID tuples,
+loaded on the first resolution without importing the MIB builder. Its path is
+given by the environment variable ``NAGIOS_MIB_SYMBOLS``, default to
+:data:`SYMBOLS_FILE`.
+"""
+
+import os
+import sys
+import marshal
+import logging
+import argparse
+import tempfile
+
+from monitoring.nagios.exceptions import NagiosUnknown
+
+logger = logging.getLogger('monitoring.nagios.probes.mibs')
+
+#: Environment variable giving the path of the cache file.
+ENV_SYMBOLS_FILE = 'NAGIOS_MIB_SYMBOLS'
+
+#: Default path of the cache file.
+SYMBOLS_FILE = '/var/tmp/plugin/mib_symbols.dat'
+
+# Symbols loaded from the cache file, see symbols()
+_symbols = None
+
+
+def is_symbol(oid):
+    """
+    Tell if ``oid`` is a MIB symbol and not a dotted OID.
+
+    **Example**::
+
+     >>> is_symbol('SNMPv2-MIB::sysDescr.0')
+     True
+     >>> is_symbol('1.3.6.1.2.1.1.1.0')
+     False
+    """
+    return isinstance(oid, basestring) and '::' in oid
+
+
+def symbols_file():
+    """Return the path of the cache file."""
+    return os.environ.get(ENV_SYMBOLS_FILE, SYMBOLS_FILE)
+
+
+def symbols():
+    """
+    Return the OIDs by symbol name of the cache file, loaded on first call.
+
+    :returns: dict
+    :raises: NagiosUnknown if the cache file cannot be read.
+    """
+    global _symbols
+    if _symbols is None:
+        filename = symbols_file()
+        try:
+            with open(filename, 'rb') as cache:
+                _symbols = marshal.load(cache)
+        except (IOError, EOFError, ValueError, TypeError) as e:
+            raise NagiosUnknown('Cannot load MIB symbols from {0}: {1}\n'
+                                'Generate it with: python -m '
+                                'monitoring.nagios.probes.mibs '
+                                'MIB...'.format(filename, e))
+        logger.debug('Loaded %d MIB symbols from %s.', len(_symbols),
+                     filename)
+    return _symbols
+
+
+def resolve(symbol):
+    """
+    Return the OID of a MIB symbol, given as ``MODULE::name``, optionally
+    followed by an index like ``IF-MIB::ifHCInOctets.3``.
+
+    **Example**::
+
+     >>> resolve('SNMPv2-MIB::sysDescr.0')  # doctest: +SKIP
+     (1, 3, 6, 1, 2, 1, 1, 1, 0)
+
+    :param symbol: the symbol name.
+    :type symbol: str
+    :returns: tuple
+    :raises: NagiosUnknown if the symbol is unknown.
+    """
+    module, _, name = symbol.partition('::')
+    name, _, index = name.partition('.')
+    try:
+        oid = symbols()['{0}::{1}'.format(module, name)]
+    except KeyError:
+        raise NagiosUnknown('Unknown MIB symbol {0} in {1} !'.format(
+            symbol, symbols_file()))
+    if index:
+        try:
+            oid += tuple(int(part) for part in index.split('.'))
+        except ValueError:
+            raise NagiosUnknown('Invalid index in MIB symbol {0} '
+                                '!'.format(symbol))
+    return oid
+
+
+def compile_symbols(modules=(), mib_dirs=()):
+    """
+    Load MIB modules with the MIB builder of pysnmp and return the OIDs of
+    their symbols, and of the symbols of the modules they import.
+
+    :param modules: names of the MIB modules, all modules found if empty.
+    :type modules: list
+    :param mib_dirs: directories of MIB modules in pysnmp format, in addition
+                     to the modules of pysnmp.
+    :type mib_dirs: list
+    :returns: dict of ``MODULE::name`` to OID tuple.
+    """
+    from pysnmp.smi import builder, error
+
+    mib_builder = builder.MibBuilder()
+    mib_builder.setMibSources(*(mib_builder.getMibSources() + tuple(
+        builder.DirMibSource(mib_dir) for mib_dir in mib_dirs)))
+
+    if not modules:
+        modules = set()
+        for source in mib_builder.getMibSources():
+            modules.update(name for name in source.listdir()
+                           if not name.startswith('__'))
+    for module in sorted(modules):
+        try:
+            mib_builder.loadModules(module)
+        except error.SmiError as e:
+            logger.warning('Cannot load MIB module %s: %s', module, e)
+
+    mib_node, = mib_builder.importSymbols('SNMPv2-SMI', 'MibNode')
+    compiled = {}
+    for module, module_symbols in mib_builder.mibSymbols.iteritems():
+        for name, node in module_symbols.iteritems():
+            if isinstance(node, mib_node):
+                compiled['{0}::{1}'.format(module, name)] = tuple(
+                    int(part) for part in node.getName())
+    return compiled
+
+
+def save_symbols(compiled, filename):
+    """
+    Write the symbols in the cache file ``filename``, replacing it
+    atomically.
+
+    :param compiled: the symbols given by :func:`compile_symbols`.
+    :type compiled: dict
+    :param filename: the path of the cache file.
+    :type filename: str
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, path = tempfile.mkstemp(dir=folder, prefix='.mib')
+    with os.fdopen(fd, 'wb') as cache:
+        marshal.dump(compiled, cache)
+    os.chmod(path, 0644)
+    os.rename(path, filename)
+
+
+def main(argv=None):
+    """Generate the cache file from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Generate the MIB symbols cache of plugins.')
+    parser.add_argument('modules', nargs='*', metavar='MODULE',
+                        help='MIB modules to compile, like IF-MIB (default '
+                             'all modules found).')
+    parser.add_argument('-d', '--mib-dir', dest='mib_dirs', default=[],
+                        action='append',
+                        help='Directory of MIB modules in pysnmp format '
+                             '(repeatable).')
+    parser.add_argument('-o', '--output', default=symbols_file(),
+                        help='Path of the cache file (default '
+                             '%(default)s).')
+    options = parser.parse_args(argv)
+
+    compiled = compile_symbols(options.modules, options.mib_dirs)
+    save_symbols(compiled, options.output)
+    print '{0} symbols written in {1}.'.format(len(compiled), options.output)
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main())
@@ -25,6 +25,7 @@ import logging as log
 import pymssql
 
 from monitoring.nagios.probes import Probe
+from monitoring.nagios.profiling import timed
 from monitoring.nagios.exceptions import PluginError
 
 logger = log.getLogger('monitoring.nagios.probes.mssql')
@@ -49,6 +50,7 @@ class ProbeMSSQL(Probe):
                           is 15 secs.
     :type login_timeout: int
     """
+    @timed('mssql_init')
     def __init__(self, hostaddress, username, password, database=None,
                  query_timeout=30, login_timeout=15):
         super(ProbeMSSQL, self).__init__()
@@ -86,6 +88,7 @@ class ProbeMSSQL(Probe):
         """
         return self._db_connection.cursor()
 
+    @timed('mssql_execute')
     def execute(self, query):
         """
         Execute a SQL query.
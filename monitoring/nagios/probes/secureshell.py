@@ -29,6 +29,7 @@ from datetime import datetime
 import ssh
 
 from monitoring.nagios.probes import Probe
+from monitoring.nagios.profiling import timed
 from monitoring.nagios.exceptions import NagiosUnknown
 
 
@@ -102,6 +103,7 @@ class ProbeSSH(Probe):
         """Exception triggered when a SSH command timed out."""
         pass
 
+    @timed('ssh_init')
     def __init__(self, hostaddress='', port=22, username=None, password=None,
                  timeout=10.0):
         super(ProbeSSH, self).__init__()
@@ -134,6 +136,7 @@ Host: %s
 Port: %s
 Message: %s''' % (self.hostaddress, self.port, e))
 
+    @timed('ssh_execute')
     def execute(self, command, timeout=None):
         """
         Execute a command on the remote server and return results.
@@ -21,19 +21,65 @@
 
 """SNMP probe module."""
 
+import os
+import copy
+import time
+import pickle
+import tempfile
 import logging as log
 from pprint import pformat
 from UserDict import IterableUserDict
 
 from pysnmp.entity.rfc3413.oneliner import cmdgen
+from pysnmp.carrier.asynsock.dispatch import AsynsockDispatcher
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1902 import ObjectName
+from pyasn1.type.univ import Null
 
 from monitoring.nagios.probes import Probe
+from monitoring.nagios.probes import mibs
+from monitoring.nagios.profiling import timed, phase
 from monitoring.nagios.exceptions import NagiosUnknown
 from monitoring.nagios.utilities import find_key_from_value
 
 
 logger = log.getLogger('monitoring.nagios.probes')
 
+#: Max-repetitions of the first GETBULK requests sent to an agent.
+MAX_REPETITIONS = 25
+
+#: Age in seconds after which the capabilities of an agent are discovered
+#: again.
+CAPABILITIES_MAX_AGE = 86400
+
+#: Timeout in seconds of the first attempt of a request when the response
+#: time of the agent is unknown.
+DEFAULT_TIMEOUT = 1.0
+
+#: The adaptive timeout is this number of times the average response time of
+#: the agent...
+ADAPTIVE_TIMEOUT_FACTOR = 4
+
+#: ... bounded by these values in seconds.
+ADAPTIVE_TIMEOUT_MIN = 0.3
+ADAPTIVE_TIMEOUT_MAX = 5.0
+
+# Resolution in seconds of the timers of requests
+_TIMER_RESOLUTION = 0.05
+
+# OID queried to discover the SNMP version of an agent (sysUpTime.0)
+_DISCOVERY_OID = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+
+# OID walked to discover GETBULK support (system group)
+_DISCOVERY_BULK_OID = (1, 3, 6, 1, 2, 1, 1)
+
+#: Names of the SNMP versions, by ``snmp_version`` of :class:`ProbeSNMP`.
+SNMP_VERSIONS = ('v1', 'v2c', 'v3')
+
+# Capabilities by (host, port, version asked), shared by the probes of the
+# process
+_capabilities = {}
+
 
 class _OidValue(object):
     """Class that represents a value from an OID."""
@@ -61,6 +107,131 @@ class _OidValue(object):
         )
 
 
+class SNMPCapabilities(object):
+    """
+    What a SNMP agent supports, discovered at the first request and updated
+    on errors. See :meth:`ProbeSNMP.discover`.
+
+    :param version: the best version spoken by the agent, ``0`` for v1,
+                    ``1`` for v2c and ``2`` for v3, ``None`` if not
+                    discovered yet.
+    :type version: int, None
+    :param bulk: if the agent answers GETBULK requests, ``None`` if unknown.
+    :type bulk: bool, None
+    :param max_repetitions: the max-repetitions of GETBULK requests giving
+                            responses the agent can send.
+    :type max_repetitions: int
+    :param rtt: the average response time in seconds, ``None`` if unknown.
+    :type rtt: float, None
+    :param discovered: the timestamp of the discovery.
+    :type discovered: float
+    """
+    #: Weight of the last response time in the average response time.
+    rtt_weight = 0.2
+
+    def __init__(self, version=None, bulk=None,
+                 max_repetitions=MAX_REPETITIONS, rtt=None, discovered=None):
+        self.version = version
+        self.bulk = bulk
+        self.max_repetitions = max_repetitions
+        self.rtt = rtt
+        self.discovered = discovered
+
+        # Set when the capabilities must be saved, see ProbeSNMP.
+        self.changed = False
+        self._saved_rtt = rtt
+
+    def update_rtt(self, duration):
+        """
+        Add a response time to the exponentially weighted average :attr:`rtt`.
+
+        :param duration: the response time in seconds.
+        :type duration: float
+        """
+        if self.rtt is None:
+            self.rtt = duration
+        else:
+            self.rtt += self.rtt_weight * (duration - self.rtt)
+
+        # Save only significant changes
+        if self._saved_rtt is None \
+                or abs(self.rtt - self._saved_rtt) > 0.2 * self._saved_rtt:
+            self.changed = True
+
+    def bulk_failed(self):
+        """
+        Record a failed GETBULK request: the max-repetitions is halved, then
+        GETBULK is not used anymore.
+        """
+        if self.max_repetitions > 1:
+            self.max_repetitions //= 2
+        else:
+            self.bulk = False
+        self.changed = True
+        logger.debug('GETBULK failed, max-repetitions %d, bulk %s.',
+                     self.max_repetitions, self.bulk)
+
+    def load(self, filename):
+        """
+        Load the capabilities saved in ``filename``, ignoring missing, invalid
+        or too old files.
+
+        :param filename: the path of the file.
+        :type filename: str
+        :returns: True if the capabilities were loaded.
+        """
+        try:
+            with open(filename, 'rb') as capabilities_file:
+                saved = pickle.load(capabilities_file)
+        except (IOError, EOFError, pickle.UnpicklingError) as e:
+            logger.debug('No SNMP capabilities loaded from %s: %s',
+                         filename, e)
+            return False
+
+        if not isinstance(saved, dict) or \
+                time.time() - saved.get('discovered', 0) > \
+                CAPABILITIES_MAX_AGE:
+            return False
+
+        self.__init__(**saved)
+        return True
+
+    def save(self, filename):
+        """
+        Save the capabilities in ``filename``, replacing it atomically.
+
+        :param filename: the path of the file.
+        :type filename: str
+        """
+        folder = os.path.dirname(filename)
+        try:
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            fd, path = tempfile.mkstemp(dir=folder or '.', prefix='.snmp')
+            with os.fdopen(fd, 'wb') as capabilities_file:
+                pickle.dump(self._fields(),
+                            capabilities_file)
+            os.rename(path, filename)
+        except (IOError, OSError) as e:
+            logger.warning('Cannot save SNMP capabilities in %s: %s',
+                           filename, e)
+            return
+
+        self.changed = False
+        self._saved_rtt = self.rtt
+
+    def _fields(self):
+        """The saved fields."""
+        return {'version': self.version,
+                'bulk': self.bulk,
+                'max_repetitions': self.max_repetitions,
+                'rtt': self.rtt,
+                'discovered': self.discovered}
+
+    def __repr__(self):
+        return '<SNMPCapabilities {0}>'.format(self._fields())
+
+
 class _SNMPQuery(object):
     """
     Class that construct a SNMP query.
@@ -69,7 +240,10 @@ class _SNMPQuery(object):
     """
     def __init__(self, probe, oidstable, snmpcmd='get'):
         self.__probe = probe
-        self.__oids = oidstable
+        self.__oids = dict(
+            (name, _SNMPQuery.convert_tuple_to_oid(mibs.resolve(oid))
+             if mibs.is_symbol(oid) else oid)
+            for name, oid in oidstable.iteritems())
         self.__snmpcmd = snmpcmd
 
     def __get_raw_oid_values(self, oidinfo):
@@ -82,12 +256,7 @@ class _SNMPQuery(object):
 
         logger.debug('-- Probing OID \'%s\': %s ...', name, oid)
 
-        # Define SNMP command to use
-        if self.__snmpcmd == 'get':
-            snmpcmd = cmdgen.CommandGenerator().getCmd
-        elif self.__snmpcmd == 'getnext':
-            snmpcmd = cmdgen.CommandGenerator().nextCmd
-        else:
+        if self.__snmpcmd not in ('get', 'getnext'):
             raise NagiosUnknown(
                 "Invalid SNMP command \'%s\' !" % self.__snmpcmd)
 
@@ -97,22 +266,9 @@ class _SNMPQuery(object):
             oid = _SNMPQuery.convert_oid_to_tuple(oid)
 
         try:
-            if self.__probe.snmp_version < 2:
-                auth_method = cmdgen.CommunityData('nagios-plugin',
-                                                   self.__probe.community,
-                                                   self.__probe.snmp_version)
-            else:
-                auth_method = cmdgen.UsmUserData(
-                    self.__probe.login,
-                    self.__probe.password,
-                    authProtocol=self.__probe.auth_protocol,
-                    privProtocol=self.__probe.priv_protocol,)
-
-            error_indication, _, _, varbinds = snmpcmd(
-                auth_method,
-                self.__probe.udp_transport, oid)
-            if error_indication is not None:
-                raise NagiosUnknown('SNMP query error: %s' % error_indication)
+            varbinds = self.__probe.request(self.__snmpcmd, oid)
+        except NagiosUnknown:
+            raise
         except Exception as e:
             raise NagiosUnknown('Unexpected error during SNMP %s query !\n'
                                 'OID: %s\n'
@@ -120,8 +276,9 @@ class _SNMPQuery(object):
                                                  oid,
                                                  e))
 
-        logger.debug('Returned varBinds:')
-        logger.debug(pformat(varbinds, indent=4))
+        if logger.isEnabledFor(log.DEBUG):
+            logger.debug('Returned varBinds:')
+            logger.debug(pformat(varbinds, indent=4))
 
         return varbinds
 
@@ -203,7 +360,35 @@ class _SNMPTable(IterableUserDict):
 
 
 class ProbeSNMP(Probe):
-    """Class ProbeSNMP."""
+    """
+    Class ProbeSNMP.
+
+    The capabilities of the agent (:class:`SNMPCapabilities`) are discovered
+    at the first request and shared by the probes of the process on the same
+    host and port asking the same SNMP version, so a v1 check never downgrades
+    the v2c checks of the agent. Give ``capabilities_file`` to keep them
+    between runs, one file by host, port and version.
+
+    A request is sent ``retries + 1`` times at most, the timeout being
+    multiplied by ``backoff`` at each attempt. Without ``timeout``, the
+    timeout of the first attempt adapts to the average response time of the
+    agent: :data:`ADAPTIVE_TIMEOUT_FACTOR` times the response time, bounded
+    by :data:`ADAPTIVE_TIMEOUT_MIN` and :data:`ADAPTIVE_TIMEOUT_MAX`, or
+    :data:`DEFAULT_TIMEOUT` if unknown. A dead host with fast responses in its
+    history fails fast while a slow host keeps a longer timeout.
+
+    :param timeout: timeout in seconds of the first attempt of a request,
+                    default adaptive.
+    :type timeout: float
+    :param retries: number of attempts after the first one.
+    :type retries: int
+    :param backoff: factor applied to the timeout after each attempt.
+    :type backoff: float
+    :param capabilities_file: path of the file saving the capabilities of the
+                              agent for ``snmp_version``.
+    :type capabilities_file: str
+    """
+    @timed('snmp_init')
     def __init__(self,
                  hostaddress='',
                  port=161,
@@ -212,7 +397,11 @@ class ProbeSNMP(Probe):
                  login=None,
                  password=None,
                  auth_protocol=cmdgen.usmHMACMD5AuthProtocol,
-                 priv_protocol=cmdgen.usmDESPrivProtocol):
+                 priv_protocol=cmdgen.usmDESPrivProtocol,
+                 timeout=None,
+                 retries=1,
+                 backoff=2.0,
+                 capabilities_file=None):
         super(ProbeSNMP, self).__init__()
 
         self.hostaddress = hostaddress
@@ -223,12 +412,29 @@ class ProbeSNMP(Probe):
         self.password = password
         self.auth_protocol = auth_protocol
         self.priv_protocol = priv_protocol
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.capabilities_file = capabilities_file
+
+        key = (self.hostaddress, self.port, self.snmp_version)
+        self.capabilities = _capabilities.get(key)
+        if self.capabilities is None:
+            self.capabilities = SNMPCapabilities()
+            if capabilities_file:
+                self.capabilities.load(capabilities_file)
+            _capabilities[key] = self.capabilities
+
+        # Command generators are expensive, one is used for all requests
+        self._cmdgen = None
+        self._asyncmdgen = None
+        self._targets = {}
 
         try:
             logger.debug('Establishing SNMP connection to \'%s:%d\'...',
                          self.hostaddress, self.port)
             self.udp_transport = cmdgen.UdpTransportTarget(
-                (self.hostaddress, self.port))
+                (self.hostaddress, self.port), retries=0)
         except Exception as e:
             raise NagiosUnknown('Cannot establish a SNMP connection !\n'
                                 'Host: %s\n'
@@ -244,16 +450,324 @@ class ProbeSNMP(Probe):
         if 'ProbeSNMP' == self.__class__.__name__:
             logger.debug('=== END PROBE INIT ===')
 
+    @property
+    def cmdgen(self):
+        """The command generator sending requests, created once."""
+        if self._cmdgen is None:
+            self._create_generators()
+        return self._cmdgen
+
+    @property
+    def asyncmdgen(self):
+        """
+        The asynchronous command generator used by :attr:`cmdgen`, sending
+        single requests of walks.
+        """
+        if self._asyncmdgen is None:
+            self._create_generators()
+        return self._asyncmdgen
+
+    def _create_generators(self):
+        """Create the command generators."""
+        self._asyncmdgen = cmdgen.AsynCommandGenerator()
+        self._cmdgen = cmdgen.CommandGenerator(asynCmdGen=self._asyncmdgen)
+
+        # Timers are checked at each poll of the sockets, every 0.5s by
+        # default
+        dispatcher = AsynsockDispatcher()
+        dispatcher.setTimerResolution(_TIMER_RESOLUTION)
+        dispatcher.timeout = _TIMER_RESOLUTION
+        self._cmdgen.snmpEngine.registerTransportDispatcher(dispatcher)
+
+    @property
+    def first_timeout(self):
+        """The timeout of the first attempt of the next request."""
+        if self.timeout is not None:
+            return self.timeout
+        if self.capabilities.rtt is None:
+            return DEFAULT_TIMEOUT
+        return min(max(self.capabilities.rtt * ADAPTIVE_TIMEOUT_FACTOR,
+                       ADAPTIVE_TIMEOUT_MIN), ADAPTIVE_TIMEOUT_MAX)
+
+    def _transport(self, timeout):
+        """Return the transport target sending requests with ``timeout``."""
+        timeout = round(timeout, 2)
+        target = self._targets.get(timeout)
+        if target is None:
+            # The engine configures a target once by address and tags
+            target = copy.copy(self.udp_transport)
+            target.timeout = timeout
+            target.tagList = 'timeout{0:d}'.format(int(timeout * 100))
+            self._targets[timeout] = target
+        return target
+
+    @property
+    def version(self):
+        """
+        The SNMP version used for requests: the version asked, or v1 if the
+        agent only speaks v1.
+        """
+        if self.snmp_version == 1 and self.capabilities.version == 0:
+            return 0
+        return self.snmp_version
+
+    def _auth_data(self, version):
+        """Return the authentication data for a SNMP ``version``."""
+        if version < 2:
+            return cmdgen.CommunityData('nagios-plugin', self.community,
+                                        version)
+        return cmdgen.UsmUserData(self.login,
+                                  self.password,
+                                  authProtocol=self.auth_protocol,
+                                  privProtocol=self.priv_protocol)
+
+    def _send(self, command, version, *args):
+        """
+        Send a request with a command of the command generator, retrying on
+        timeouts. Return ``(error_indication, error_status, varbinds,
+        duration)`` of the last attempt.
+        """
+        send = command if callable(command) else getattr(self.cmdgen,
+                                                          command)
+        auth_data = self._auth_data(version)
+        timeout = self.first_timeout
+        for attempt in xrange(self.retries + 1):
+            start = time.time()
+            error_indication, error_status, _, varbinds = send(
+                auth_data, self._transport(timeout), *args)
+            if not isinstance(error_indication, errind.RequestTimedOut):
+                break
+            logger.debug('SNMP request to %s timed out after %.2fs '
+                         '(attempt %d).', self.hostaddress, timeout,
+                         attempt + 1)
+            timeout *= self.backoff
+        return error_indication, error_status, varbinds, time.time() - start
+
+    def discover(self):
+        """
+        Discover the capabilities of the agent: its SNMP version when v2c is
+        asked, falling back to v1, and if it answers GETBULK requests with
+        :data:`MAX_REPETITIONS` max-repetitions, halving it until it does.
+
+        Called by the first request when the capabilities are unknown.
+
+        :returns: the capabilities.
+        :rtype: SNMPCapabilities
+        """
+        capabilities = self.capabilities
+        logger.debug('Discovering capabilities of SNMP agent %s:%d...',
+                     self.hostaddress, self.port)
+
+        if self.snmp_version == 1:
+            error_indication, _, _, duration = self._send(
+                'getCmd', 1, _DISCOVERY_OID)
+            if error_indication is None:
+                capabilities.version = 1
+            else:
+                error_indication, _, _, duration = self._send(
+                    'getCmd', 0, _DISCOVERY_OID)
+                if error_indication is not None:
+                    raise NagiosUnknown('SNMP query error: %s'
+                                        % error_indication)
+                logger.debug('Agent only speaks SNMP v1.')
+                capabilities.version = 0
+            capabilities.update_rtt(duration)
+        else:
+            capabilities.version = self.snmp_version
+
+        if capabilities.version == 0:
+            capabilities.bulk = False
+        while capabilities.bulk is None:
+            error_indication, error_status, _, _ = self._send(
+                'bulkCmd', capabilities.version, 0,
+                capabilities.max_repetitions, _DISCOVERY_BULK_OID)
+            if error_indication is None and not error_status:
+                capabilities.bulk = True
+            elif not self._bulk_failed(error_indication):
+                raise NagiosUnknown('SNMP query error: %s'
+                                    % error_indication)
+
+        capabilities.discovered = time.time()
+        capabilities.changed = True
+        logger.debug('Capabilities of the agent: %r', capabilities)
+        return capabilities
+
+    def request(self, command, oid):
+        """
+        Send a ``get`` or ``getnext`` request on one OID with the fastest way
+        known for the agent: a column is walked with GETBULK requests when
+        the agent supports them, else with GETNEXT requests.
+
+        :param command: ``get`` or ``getnext``.
+        :type command: str
+        :param oid: the OID.
+        :type oid: tuple
+        :returns: the varbinds for ``get``, the table of varbinds for
+                  ``getnext``.
+        :raises: NagiosUnknown
+        """
+        capabilities = self.capabilities
+        if capabilities.version is None:
+            self.discover()
+
+        if command == 'get':
+            error_indication, error_status, varbinds, duration = self._send(
+                'getCmd', self.version, oid)
+            requests = 1
+        else:
+            error_indication, error_status, varbinds, duration, requests = \
+                self._walk(oid)
+
+        if error_indication is None:
+            capabilities.update_rtt(duration / requests)
+        if capabilities.changed and self.capabilities_file:
+            capabilities.save(self.capabilities_file)
+
+        if error_indication is not None:
+            raise NagiosUnknown('SNMP query error: %s' % error_indication)
+
+        return varbinds
+
+    def _bulk_failed(self, error_indication):
+        """
+        Record a failed GETBULK request in the capabilities, unless it timed
+        out because the agent does not answer at all.
+
+        :returns: True if the failure was recorded.
+        """
+        if error_indication is not None:
+            error_indication = self._send('getCmd', self.version,
+                                          _DISCOVERY_OID)[0]
+            if error_indication is not None:
+                return False
+        self.capabilities.bulk_failed()
+        return True
+
+    def _walk(self, oid):
+        """Walk the column ``oid``, with GETBULK requests if possible."""
+        capabilities = self.capabilities
+        while capabilities.bulk and self.version > 0:
+            repetitions = capabilities.max_repetitions
+            error_indication, error_status, varbinds, duration = self._send(
+                'bulkCmd', self.version, 0, repetitions, oid)
+            if error_indication is None and not error_status:
+                # Last response may include rows after the column
+                column = ObjectName(oid)
+                varbinds = [row for row in varbinds
+                            if column.isPrefixOf(row[0][0])]
+                return (error_indication, error_status, varbinds, duration,
+                        len(varbinds) // repetitions + 1)
+            if not self._bulk_failed(error_indication):
+                return error_indication, error_status, [], duration, 1
+
+        error_indication, error_status, varbinds, duration = self._send(
+            'nextCmd', self.version, oid)
+        return (error_indication, error_status, varbinds, duration,
+                len(varbinds) + 1)
+
+    @timed('snmp_get')
     def get(self, oidstable):
-        """Query a SNMP OID using Get command."""
+        """
+        Query a SNMP OID using Get command.
+
+        OIDs are dotted strings or MIB symbols like
+        ``'SNMPv2-MIB::sysDescr.0'``, see :mod:`monitoring.nagios.probes.mibs`.
+        """
         query = _SNMPQuery(self, oidstable)
         return query.execute()
 
+    @timed('snmp_get')
     def getnext(self, oidstable):
-        """Query a SNMP OID using Getnext command."""
+        """Query a SNMP OID using Getnext command, see :meth:`get`."""
         query = _SNMPQuery(self, oidstable, snmpcmd='getnext')
         return query.execute()
 
+    def _next_page(self, auth_data, transport, oid, repetitions=None):
+        """
+        Send one GETNEXT request, or GETBULK request with ``repetitions``,
+        on ``oid``. Same return value as the command generator commands.
+        """
+        response = []
+
+        def callback(handle, error_indication, error_status, error_index,
+                     varbinds, context):
+            # Returning None stops after this response
+            response.extend((error_indication, error_status, error_index,
+                             varbinds))
+
+        generator = self.asyncmdgen
+        if repetitions is None:
+            generator.nextCmd(auth_data, transport, (oid,), (callback, None))
+        else:
+            generator.bulkCmd(auth_data, transport, 0, repetitions, (oid,),
+                              (callback, None))
+        generator.snmpEngine.transportDispatcher.runDispatcher()
+        return response
+
+    def walk(self, oid):
+        """
+        Walk the subtree of ``oid`` and yield its values as responses
+        arrive, sending a GETBULK request, or a GETNEXT request if the agent
+        does not support them, for each page of values.
+
+        Only one page is kept in memory and no more request is sent when the
+        caller stops iterating, so finding a row in a large table is cheap::
+
+         for descr in plugin.snmp.walk('1.3.6.1.2.1.2.2.1.2'):
+             if str(descr) == 'eth0':
+                 index = descr.index
+                 break
+
+        :param oid: the OID of the subtree, like ``'1.3.6.1.2.1.2.2.1.2'``
+                    or ``'IF-MIB::ifDescr'``.
+        :type oid: str, tuple
+        :returns: a generator of values, with attributes ``oid``, ``index``
+                  and ``value``.
+        :raises: NagiosUnknown
+        """
+        if mibs.is_symbol(oid):
+            oid = mibs.resolve(oid)
+        elif isinstance(oid, basestring):
+            oid = _SNMPQuery.convert_oid_to_tuple(oid)
+        capabilities = self.capabilities
+        if capabilities.version is None:
+            self.discover()
+
+        subtree = ObjectName(oid)
+        while True:
+            bulk = capabilities.bulk and self.version > 0
+            repetitions = capabilities.max_repetitions if bulk else None
+            with phase('snmp_walk'):
+                error_indication, error_status, rows, duration = self._send(
+                    self._next_page, self.version, oid, repetitions)
+
+            if bulk and (error_indication is not None or error_status) \
+                    and self._bulk_failed(error_indication):
+                continue
+            if error_indication is None:
+                capabilities.update_rtt(duration)
+            if capabilities.changed and self.capabilities_file:
+                capabilities.save(self.capabilities_file)
+
+            if error_indication is not None:
+                raise NagiosUnknown('SNMP query error: %s' % error_indication)
+            if error_status == 2 and self.version == 0:
+                # noSuchName: end of the MIB in SNMP v1
+                return
+            if error_status:
+                raise NagiosUnknown('SNMP query error: %s'
+                                    % error_status.prettyPrint())
+
+            for row in rows:
+                name, value = row[0]
+                if not subtree.isPrefixOf(name) or isinstance(value, Null):
+                    return
+                yield _OidValue(row[0])
+
+            if not rows:
+                return
+            oid = rows[-1][0][0]
+
     def table(self, columns):
         """
         Query SNMP OIDs and format results like a table.
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+SNMP requests of many hosts through a shared UDP socket.
+
+Each :class:`monitoring.nagios.probes.snmp.ProbeSNMP` opens its own socket and
+waits for its responses. :class:`SNMPPoller` sends the requests of all hosts
+through one non-blocking UDP socket (or a few), a single thread receiving the
+responses, matching them to requests by request ID and expiring requests with
+a timer wheel. Probes created by :meth:`SNMPPoller.probe` have the API of
+:class:`monitoring.nagios.probes.snmp.ProbeSNMP` and can be used from many
+threads at the same time.
+
+Only SNMP v1 and v2c are supported, SNMP v3 needs the engine of pysnmp.
+"""
+
+import time
+import errno
+import select
+import socket
+import random
+import logging
+import threading
+
+from pyasn1.codec.ber import decoder
+from pysnmp.proto import api, errind
+from pysnmp.proto.rfc1902 import ObjectName
+from pyasn1.type.univ import Null
+
+from monitoring.nagios.exceptions import NagiosUnknown
+from monitoring.nagios.probes.snmp import ProbeSNMP
+
+logger = logging.getLogger('monitoring.nagios.probes.snmppoller')
+
+#: Types of requests sent by the poller.
+PDU_TYPES = ('get', 'getnext', 'getbulk')
+
+# BER tags of the request PDUs
+_PDU_TAGS = {'get': 0xa0, 'getnext': 0xa1, 'getbulk': 0xa5}
+
+# BER encoded NULL value of request varbinds
+_NULL = '\x05\x00'
+
+
+def _ber(tag, content):
+    """Encode a BER tag, length and content."""
+    length = len(content)
+    if length < 0x80:
+        return chr(tag) + chr(length) + content
+    encoded_length = ''
+    while length:
+        encoded_length = chr(length & 0xff) + encoded_length
+        length >>= 8
+    return chr(tag) + chr(0x80 | len(encoded_length)) + encoded_length + \
+        content
+
+
+def _ber_integer(value):
+    """Encode a non-negative BER INTEGER."""
+    content = chr(value & 0xff)
+    value >>= 8
+    while value or ord(content[0]) & 0x80:
+        content = chr(value & 0xff) + content
+        value >>= 8
+    return _ber(0x02, content)
+
+
+def _ber_oid(oid):
+    """Encode a BER OBJECT IDENTIFIER."""
+    content = []
+    for arc in [oid[0] * 40 + oid[1]] + list(oid[2:]):
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7f))
+            arc >>= 7
+        content.extend(reversed(chunk))
+    return _ber(0x06, ''.join(map(chr, content)))
+
+
+def encode_request(request_id, community, version, pdu_type, oids,
+                   repetitions=None):
+    """
+    Encode a SNMP v1 or v2c request message.
+
+    Requests are encoded directly, pyasn1 being slow to build messages.
+
+    **Example**::
+
+     >>> message = encode_request(1, 'public', 1, 'get',
+     ...                          [(1, 3, 6, 1, 2, 1, 1, 3, 0)])
+     >>> len(message)
+     40
+
+    :param request_id: the request ID.
+    :type request_id: int
+    :param community: the SNMP community.
+    :type community: str
+    :param version: ``0`` for SNMP v1, ``1`` for v2c.
+    :type version: int
+    :param pdu_type: one of :data:`PDU_TYPES`.
+    :type pdu_type: str
+    :param oids: the OIDs as tuples.
+    :type oids: list
+    :param repetitions: the max-repetitions of a ``getbulk`` request.
+    :type repetitions: int
+    :returns: str
+    """
+    varbinds = ''.join(_ber(0x30, _ber_oid(tuple(oid)) + _NULL)
+                       for oid in oids)
+    if pdu_type == 'getbulk':
+        fields = _ber_integer(0) + _ber_integer(repetitions)
+    else:
+        fields = _ber_integer(0) + _ber_integer(0)
+    pdu = _ber(_PDU_TAGS[pdu_type], _ber_integer(request_id) + fields +
+               _ber(0x30, varbinds))
+    return _ber(0x30, _ber_integer(version) + _ber(0x04, community) + pdu)
+
+
+class _PendingRequest(object):
+    """A request waiting for its response."""
+    __slots__ = ('request_id', 'address', 'message', 'timeout', 'retries',
+                 'backoff', 'deadline', 'callback', 'result', 'done')
+
+    def __init__(self, request_id, address, message, timeout, retries,
+                 backoff, callback):
+        self.request_id = request_id
+        self.address = address
+        self.message = message
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = 0
+        self.callback = callback
+        self.result = None
+        self.done = threading.Event()
+
+    def wait(self):
+        """
+        Wait for the response.
+
+        :returns: tuple ``(error_indication, error_status, varbinds)``,
+                  ``error_indication`` being ``None`` if a response was
+                  received.
+        """
+        self.done.wait()
+        return self.result
+
+
+class SNMPPoller(object):
+    """
+    Send SNMP requests to many hosts through shared UDP sockets.
+
+    Requests are sent by the calling threads, responses are received by the
+    thread of the poller. Timeouts are checked every ``tick`` seconds on a
+    timer wheel of ``wheel_size`` slots, so the cost of a timeout does not
+    depend on the number of pending requests.
+
+    Use probes with the API of
+    :class:`monitoring.nagios.probes.snmp.ProbeSNMP`::
+
+     poller = SNMPPoller()
+     probe = poller.probe('switch01', community='public', snmp_version=1)
+     print probe.get({'descr': '1.3.6.1.2.1.1.1.0'})['descr']
+
+    or send requests to many hosts at once::
+
+     requests = [poller.send((host, 161), 'public', 1, 'get',
+                             [(1, 3, 6, 1, 2, 1, 1, 3, 0)])
+                 for host in hosts]
+     results = [request.wait() for request in requests]
+
+    :param sockets: number of UDP sockets.
+    :type sockets: int
+    :param tick: duration of a slot of the timer wheel in seconds.
+    :type tick: float
+    :param wheel_size: number of slots of the timer wheel.
+    :type wheel_size: int
+    """
+    def __init__(self, sockets=1, tick=0.01, wheel_size=512):
+        self.tick = tick
+        self.sockets = []
+        for _ in xrange(sockets):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(0)
+            sock.bind(('', 0))
+            self.sockets.append(sock)
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wheel = [[] for _ in xrange(wheel_size)]
+        self._current_tick = self._tick_of(time.time())
+        self._next_id = random.randint(1, 0x3fffffff)
+        self._running = True
+
+        self._thread = threading.Thread(target=self._loop,
+                                        name='snmp-poller')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def probe(self, hostaddress, port=161, **kwargs):
+        """
+        Return a probe sending its requests through the poller. Same
+        arguments as :class:`monitoring.nagios.probes.snmp.ProbeSNMP`.
+
+        :rtype: PolledProbeSNMP
+        """
+        return PolledProbeSNMP(self, hostaddress, port, **kwargs)
+
+    def send(self, address, community, version, pdu_type, oids,
+             repetitions=None, timeout=1.0, retries=1, backoff=2.0,
+             callback=None):
+        """
+        Send a request and return at once.
+
+        :param address: the ``(ip, port)`` of the agent.
+        :type address: tuple
+        :param community: the SNMP community.
+        :type community: str
+        :param version: ``0`` for SNMP v1, ``1`` for v2c.
+        :type version: int
+        :param pdu_type: one of :data:`PDU_TYPES`.
+        :type pdu_type: str
+        :param oids: the OIDs as tuples.
+        :type oids: list
+        :param repetitions: the max-repetitions of a ``getbulk`` request.
+        :type repetitions: int
+        :param timeout: timeout in seconds of the first attempt.
+        :type timeout: float
+        :param retries: number of attempts after the first one.
+        :type retries: int
+        :param backoff: factor applied to the timeout after each attempt.
+        :type backoff: float
+        :param callback: called by the thread of the poller with the request
+                         when it is done.
+        :returns: the request, call its ``wait()`` method to get the result.
+        """
+        if pdu_type not in _PDU_TAGS or \
+                (pdu_type == 'getbulk' and version == 0):
+            raise ValueError('Invalid request {0} for SNMP version '
+                             '{1}'.format(pdu_type, version))
+
+        with self._lock:
+            request_id = self._next_id
+            self._next_id = self._next_id % 0x7fffffff + 1
+
+        message = encode_request(request_id, community, version, pdu_type,
+                                 oids, repetitions)
+        request = _PendingRequest(request_id, address, message, timeout,
+                                  retries, backoff, callback)
+        with self._lock:
+            self._pending[request_id] = request
+            self._schedule(request)
+        self._transmit(request)
+        return request
+
+    def close(self):
+        """Stop the poller, pending requests time out."""
+        self._running = False
+        self._thread.join()
+        for sock in self.sockets:
+            sock.close()
+        with self._lock:
+            pending = self._pending.values()
+            self._pending.clear()
+        for request in pending:
+            self._finish(request, (errind.requestTimedOut, 0, []))
+
+    def _tick_of(self, timestamp):
+        """Return the tick number of a timestamp."""
+        return int(timestamp / self.tick)
+
+    def _schedule(self, request):
+        """Put a request in the slot of its deadline, lock held."""
+        request.deadline = time.time() + request.timeout
+        slot = self._tick_of(request.deadline) % len(self._wheel)
+        self._wheel[slot].append(request)
+
+    def _transmit(self, request):
+        """Send the message of a request."""
+        sock = self.sockets[request.request_id % len(self.sockets)]
+        try:
+            sock.sendto(request.message, request.address)
+        except socket.error as e:
+            # The request times out and is sent again
+            logger.debug('Cannot send SNMP request to %s: %s',
+                         request.address, e)
+
+    def _finish(self, request, result):
+        """Set the result of a request."""
+        request.result = result
+        request.done.set()
+        if request.callback is not None:
+            try:
+                request.callback(request)
+            except Exception:
+                logger.exception('Error in callback of SNMP request to %s.',
+                                 request.address)
+
+    def _loop(self):
+        """Receive responses and expire requests."""
+        while self._running:
+            try:
+                readable, _, _ = select.select(self.sockets, [], [],
+                                               self.tick)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for sock in readable:
+                self._receive(sock)
+            self._expire()
+
+    def _receive(self, sock):
+        """Read all the datagrams waiting on a socket."""
+        while True:
+            try:
+                data, address = sock.recvfrom(65535)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                logger.debug('SNMP poller receive error: %s', e)
+                return
+
+            try:
+                version = int(api.decodeMessageVersion(data))
+                pmod = api.protoModules[version]
+                message, _ = decoder.decode(data, asn1Spec=pmod.Message())
+                pdu = pmod.apiMessage.getPDU(message)
+                request_id = int(pmod.apiPDU.getRequestID(pdu))
+            except Exception as e:
+                logger.debug('Invalid SNMP message from %s: %s', address, e)
+                continue
+
+            with self._lock:
+                request = self._pending.get(request_id)
+                if request is None or request.address != address:
+                    request = None
+                else:
+                    del self._pending[request_id]
+            if request is None:
+                logger.debug('Unexpected SNMP response %d from %s.',
+                             request_id, address)
+                continue
+
+            self._finish(request, (None, pmod.apiPDU.getErrorStatus(pdu),
+                                   pmod.apiPDU.getVarBinds(pdu)))
+
+    def _expire(self):
+        """Retry or time out the requests of the elapsed slots."""
+        now = time.time()
+        now_tick = self._tick_of(now)
+        expired = []
+        retried = []
+        with self._lock:
+            ticks = min(now_tick - self._current_tick + 1, len(self._wheel))
+            for tick in xrange(self._current_tick, self._current_tick + ticks):
+                slot = self._wheel[tick % len(self._wheel)]
+                waiting = []
+                for request in slot:
+                    if request.request_id not in self._pending:
+                        continue
+                    if request.deadline > now:
+                        # Due in a next turn of the wheel
+                        waiting.append(request)
+                    elif request.retries > 0:
+                        request.retries -= 1
+                        request.timeout *= request.backoff
+                        retried.append(request)
+                    else:
+                        del self._pending[request.request_id]
+                        expired.append(request)
+                slot[:] = waiting
+            for request in retried:
+                self._schedule(request)
+            self._current_tick = now_tick
+
+        for request in retried:
+            logger.debug('SNMP request %d to %s timed out, retrying.',
+                         request.request_id, request.address)
+            self._transmit(request)
+        for request in expired:
+            self._finish(request, (errind.requestTimedOut, 0, []))
+
+
+class PolledProbeSNMP(ProbeSNMP):
+    """
+    A :class:`monitoring.nagios.probes.snmp.ProbeSNMP` sending its requests
+    through a :class:`SNMPPoller`, created by :meth:`SNMPPoller.probe`.
+
+    Capabilities, timeouts and walks work the same way as with
+    :class:`monitoring.nagios.probes.snmp.ProbeSNMP`.
+    """
+    def __init__(self, poller, *args, **kwargs):
+        self.poller = poller
+        super(PolledProbeSNMP, self).__init__(*args, **kwargs)
+        if self.snmp_version > 1:
+            raise NagiosUnknown('SNMP v3 is not supported by the SNMP '
+                                'poller !')
+
+    def _exchange(self, version, pdu_type, oids, repetitions=None):
+        """Send a request through the poller and wait for the response."""
+        return self.poller.send(self.udp_transport.transportAddr,
+                                self.community, version, pdu_type, oids,
+                                repetitions, self.first_timeout,
+                                self.retries, self.backoff).wait()
+
+    def _table(self, version, oid, repetitions=None):
+        """Walk a subtree, like the commands of the command generator."""
+        subtree = ObjectName(oid)
+        pdu_type = 'getnext' if repetitions is None else 'getbulk'
+        table = []
+        while True:
+            error_indication, error_status, varbinds = self._exchange(
+                version, pdu_type, [oid], repetitions)
+            if error_indication is not None or error_status:
+                if error_status == 2 and version == 0:
+                    # noSuchName: end of the MIB in SNMP v1
+                    return None, 0, table
+                return error_indication, error_status, table
+            for name, value in varbinds:
+                if not subtree.isPrefixOf(name) or isinstance(value, Null):
+                    return None, 0, table
+                table.append([(name, value)])
+            if not varbinds:
+                return None, 0, table
+            oid = varbinds[-1][0]
+
+    def _send(self, command, version, *args):
+        """
+        Send a request like :meth:`ProbeSNMP._send`, through the poller.
+        """
+        start = time.time()
+        if command == 'getCmd':
+            error_indication, error_status, varbinds = self._exchange(
+                version, 'get', args)
+        elif command == 'nextCmd':
+            error_indication, error_status, varbinds = self._table(
+                version, args[0])
+        elif command == 'bulkCmd':
+            error_indication, error_status, varbinds = self._table(
+                version, args[2], args[1])
+        elif command == self._next_page:
+            oid, repetitions = args
+            error_indication, error_status, varbinds = self._exchange(
+                version, 'getnext' if repetitions is None else 'getbulk',
+                [oid], repetitions)
+            varbinds = [[varbind] for varbind in varbinds]
+        else:
+            raise NagiosUnknown('Invalid SNMP command {0} '
+                                '!'.format(command))
+        return error_indication, error_status, varbinds, time.time() - start
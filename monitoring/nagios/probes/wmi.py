@@ -23,11 +23,132 @@
 
 import logging
 import subprocess as sp
+from collections import deque
+from datetime import datetime
+from itertools import izip
 
 from monitoring.nagios.probes import Probe
+from monitoring.nagios.profiling import timed
 
 logger = logging.getLogger('monitoring.nagios.probes')
 
+#: Value printed by ``wmic`` for a NULL property.
+WMI_NULL = '(null)'
+
+
+def wmi_bool(value):
+    """
+    Convert a WMI boolean value to a bool.
+
+    **Example**::
+
+     >>> wmi_bool('True')
+     True
+    """
+    return value == 'True'
+
+
+def wmi_datetime(value):
+    """
+    Convert a CIM DATETIME string (``yyyymmddHHMMSS.mmmmmmsUUU``) to a
+    datetime object. The UTC offset part is ignored.
+
+    **Example**::
+
+     >>> wmi_datetime('20140321101234.500000+060')
+     datetime.datetime(2014, 3, 21, 10, 12, 34, 500000)
+    """
+    return datetime.strptime(value[:21], '%Y%m%d%H%M%S.%f')
+
+
+class WMIRecord(dict):
+    """
+    A row of a WMI query result.
+
+    This is a dict with WMI columns as keys and the associated values. The
+    name of the WMI class the row comes from is available in attribute
+    :attr:`wmi_class`.
+    """
+    def __init__(self, wmi_class, *args):
+        super(WMIRecord, self).__init__(*args)
+        self.wmi_class = wmi_class
+
+
+def parse_wmic_output(lines, schemas=None):
+    """
+    Parse ``wmic`` output as a stream of :class:`WMIRecord`.
+
+    This is a generator, records are yielded as lines are consumed so the
+    caller can stop iterating as soon as it has found what it needs.
+
+    ``schemas`` is a dict keyed by WMI class name which values are dicts
+    ``{column: converter}``. The key ``*`` applies to any class not listed.
+    Converters are called once per value, a ``(null)`` value is converted to
+    ``None``.
+
+    **Example**::
+
+     >>> output = ['CLASS: Win32_Process', 'Name|ProcessId', 'init|1']
+     >>> schemas = {'Win32_Process': {'ProcessId': int}}
+     >>> records = list(parse_wmic_output(output, schemas))
+     >>> records[0]['ProcessId'], records[0].wmi_class
+     (1, 'Win32_Process')
+
+    :param lines: iterable on lines of ``wmic`` output.
+    :param schemas: converters to apply on values by WMI class.
+    :type schemas: dict
+    :return: generator of :class:`WMIRecord`.
+    """
+    if not schemas:
+        schemas = {}
+
+    wmi_class = None
+    header = None
+    converters = ()
+    lines = iter(lines)
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+
+        if line.startswith('CLASS: '):
+            wmi_class = line[7:].strip()
+            header = None
+            continue
+
+        if header is None:
+            if line:
+                header = line.split('|')
+                schema = schemas.get(wmi_class, schemas.get('*', {}))
+                converters = [(i, schema[column])
+                              for i, column in enumerate(header)
+                              if column in schema]
+            continue
+
+        if not line:
+            continue
+
+        # Values may contain new lines (eg. Win32_NTLogEvent), join next lines
+        # until the row is complete
+        row = line.split('|')
+        while len(row) < len(header):
+            try:
+                next_line = next(lines).rstrip('\r\n')
+            except StopIteration:
+                break
+            continuation = next_line.split('|')
+            row[-1] = '{0}\n{1}'.format(row[-1], continuation[0])
+            row.extend(continuation[1:])
+
+        for i, converter in converters:
+            value = row[i]
+            row[i] = None if value == WMI_NULL else converter(value)
+
+        record = WMIRecord(wmi_class, izip(header, row))
+        if len(row) > len(header):
+            record[None] = row[len(header):]
+
+        yield record
+
 
 class ProbeWMI(Probe):
     """
@@ -44,6 +165,7 @@ class ProbeWMI(Probe):
     :param namespace: WMI namespace (default is ``root/cimv2``).
     :type namespace: str
     """
+    @timed('wmi_init')
     def __init__(self,
                  hostaddress,
                  login,
@@ -61,6 +183,17 @@ class ProbeWMI(Probe):
         self.namespace = namespace
         self.command = []
 
+    def _wmic_command(self, query):
+        """Return the ``wmic`` command line for ``query``."""
+        return [
+            'wmic',
+            '-U', self.credentials,
+            self.hosturl,
+            '--namespace', self.namespace,
+            query,
+        ]
+
+    @timed('wmi_execute')
     def execute(self, query):
         """
         Execute a WMI query on the remote server and return results.
@@ -69,15 +202,86 @@ class ProbeWMI(Probe):
         :type query: str, unicode
         :return: CSV with delimiter ``|``.
         """
-        self.command = [
-            'wmic',
-            '-U', self.credentials,
-            self.hosturl,
-            '--namespace', self.namespace,
-            query,
-        ]
+        self.command = self._wmic_command(query)
 
         logger.debug('Executing command: %s', " ".join(self.command))
         wmic_output = sp.check_output(self.command)
 
         return wmic_output
+
+    @timed('wmi_execute')
+    def execute_many(self, queries):
+        """
+        Execute several WMI queries on the remote server at once.
+
+        Queries are not sent over a single connection: ``wmic`` only accepts
+        one query per invocation, so one ``wmic`` process (and one connection
+        to the host) is started per query, all of them running concurrently.
+        The run takes as long as the slowest query instead of the sum of
+        them. If a query fails, the processes still running are killed.
+
+        :param queries: dict of ``{name: query}``.
+        :type queries: dict
+        :return: dict of ``{name: output}``, output being CSV with delimiter
+                 ``|``.
+        :raises subprocess.CalledProcessError: if any of the ``wmic`` process
+                                               exits with a non zero status.
+        """
+        processes = {}
+        try:
+            for name, query in queries.iteritems():
+                command = self._wmic_command(query)
+                logger.debug('Executing command: %s', " ".join(command))
+                processes[name] = (command, sp.Popen(command, stdout=sp.PIPE))
+
+            wmic_outputs = {}
+            for name, (command, process) in processes.iteritems():
+                wmic_outputs[name], _ = process.communicate()
+                if process.returncode:
+                    raise sp.CalledProcessError(process.returncode, command,
+                                                output=wmic_outputs[name])
+        finally:
+            for _, process in processes.itervalues():
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+        return wmic_outputs
+
+    def stream(self, query):
+        """
+        Execute a WMI query on the remote server and yield output lines as
+        they are written by ``wmic``.
+
+        If the caller stops iterating before the end, the ``wmic`` process is
+        killed.
+
+        :param query: The WMI query.
+        :type query: str, unicode
+        :return: generator of lines (CSV with delimiter ``|``).
+        :raises subprocess.CalledProcessError: if ``wmic`` exits with a non
+                                               zero status.
+        """
+        self.command = self._wmic_command(query)
+
+        logger.debug('Streaming command: %s', " ".join(self.command))
+        process = sp.Popen(self.command, stdout=sp.PIPE)
+
+        # Keep last lines for error reporting
+        tail = deque(maxlen=10)
+        finished = False
+        try:
+            for line in process.stdout:
+                tail.append(line)
+                yield line
+            finished = True
+        finally:
+            if not finished and process.poll() is None:
+                logger.debug('Early termination, killing wmic.')
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode:
+            raise sp.CalledProcessError(returncode, self.command,
+                                        output="".join(tail))
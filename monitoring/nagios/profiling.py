@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Profiling of plugin executions.
+
+Durations of the phases of a check (library import, arguments parsing,
+initialization, probe creation and calls) are recorded when profiling is
+enabled with the ``--profile`` plugin argument or the
+``NAGIOS_PLUGIN_PROFILE`` environment variable. The mode tells what to do
+with them:
+
+- ``perfdata``: add them to the plugin performance data,
+- ``json``: write them to a JSON file,
+- ``cprofile``: profile the whole check with :mod:`cProfile` and write the
+  statistics to a file readable by :mod:`pstats`.
+
+Each plugin instance has its own :class:`Profiler`, active in the thread
+running the check, so checks run at the same time by the scheduler do not mix
+their phases. Work done by the check in other threads is not recorded.
+
+Files are written in the ``profile`` folder of the retention directory, one by
+plugin and host, when the check ends. Set ``NAGIOS_PLUGIN_PROFILE_SAMPLE`` to a
+ratio between 0 and 1 to profile only this part of the executions. When
+profiling is off, the cost of instrumented methods is a thread local attribute
+test.
+"""
+
+import os
+import time
+import json
+import atexit
+import random
+import logging
+import threading
+import functools
+import cProfile
+from collections import OrderedDict
+
+logger = logging.getLogger('monitoring.nagios.profiling')
+
+#: Profiling modes.
+MODES = ('perfdata', 'json', 'cprofile')
+
+#: Environment variable enabling profiling with a mode.
+ENV_MODE = 'NAGIOS_PLUGIN_PROFILE'
+
+#: Environment variable giving the ratio of profiled executions.
+ENV_SAMPLE = 'NAGIOS_PLUGIN_PROFILE_SAMPLE'
+
+#: When the library was imported.
+IMPORT_TIME = time.time()
+
+# Profiler of the check running in the thread
+_local = threading.local()
+
+# Whether the profiler of the main thread is dumped at exit
+_exit_registered = False
+
+
+def current():
+    """
+    Return the profiler of the check running in this thread, or None.
+
+    :returns: :class:`Profiler`
+    """
+    return getattr(_local, 'profiler', None)
+
+
+def _dump_at_exit():
+    """Write the profiling file of a check ending with the process."""
+    profiler = current()
+    if profiler is not None:
+        profiler.dump()
+
+
+class Profiler(object):
+    """
+    Record durations of the phases of a check.
+
+    Each plugin has its own instance in attribute ``profiler``, started by the
+    plugin when profiling is enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.mode = None
+        self.filename = None
+        self.start_time = None
+        self.timings = OrderedDict()
+        self._lock = threading.Lock()
+        self._cprofile = None
+
+    def start(self, mode, filename=None, start_time=None):
+        """
+        Start recording phases, forgetting the previous ones. The profiler
+        becomes the one of the thread, used by :func:`timed` and
+        :func:`phase`.
+
+        :param mode: one of :data:`MODES`.
+        :type mode: str
+        :param filename: the file to write for ``json`` and ``cprofile``
+                         modes, without extension.
+        :type filename: str
+        :param start_time: when the check started, default to now.
+        :type start_time: float
+        """
+        self.mode = mode
+        self.filename = filename
+        self.start_time = start_time or time.time()
+        self.timings = OrderedDict()
+        self.enabled = True
+
+        _local.profiler = self
+
+        if mode == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        global _exit_registered
+        if not _exit_registered and mode in ('json', 'cprofile'):
+            atexit.register(_dump_at_exit)
+            _exit_registered = True
+
+        logger.debug('Profiling enabled, mode %s.', mode)
+
+    def stop(self):
+        """Stop recording phases."""
+        self.enabled = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if current() is self:
+            _local.profiler = None
+
+    def record(self, phase, duration):
+        """
+        Add ``duration`` in seconds to ``phase``.
+
+        :param phase: the name of the phase.
+        :type phase: str
+        :param duration: the duration in seconds.
+        :type duration: float
+        """
+        with self._lock:
+            count, total = self.timings.get(phase, (0, 0.0))
+            self.timings[phase] = (count + 1, total + duration)
+
+    def phase(self, name):
+        """
+        Return a context manager recording the duration of its block as
+        phase ``name``::
+
+         with profiler.phase('parse'):
+             parse(response)
+        """
+        return _Phase(self, name)
+
+    def durations(self):
+        """
+        Return the total duration in seconds of each phase, with ``total``
+        the duration since the start of the check.
+
+        :returns: list of tuples ``(phase, seconds)``.
+        """
+        with self._lock:
+            durations = [(phase, total)
+                         for phase, (_, total) in self.timings.iteritems()]
+        durations.append(('total', time.time() - self.start_time))
+        return durations
+
+    def dump(self):
+        """
+        Stop recording phases and write the profiling file of ``json`` and
+        ``cprofile`` modes. Called when the check ends.
+        """
+        if not self.enabled:
+            return
+
+        self.stop()
+        if not self.filename or self.mode not in ('json', 'cprofile'):
+            return
+
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            if self.mode == 'cprofile':
+                self._cprofile.dump_stats(self.filename + '.prof')
+            else:
+                with open(self.filename + '.json', 'w') as profile:
+                    json.dump({
+                        'timestamp': self.start_time,
+                        'timings': OrderedDict(
+                            (phase, {'count': count, 'total': total})
+                            for phase, (count, total)
+                            in self.timings.iteritems()),
+                        'total': time.time() - self.start_time,
+                    }, profile, indent=2)
+        except (IOError, OSError) as e:
+            logger.debug('Unable to write profiling file %s: %s',
+                         self.filename, e)
+
+
+class _Phase(object):
+    """
+    Context manager recording the duration of a phase in ``profiler``, default
+    to the one of the thread.
+    """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        profiler = self.profiler or current()
+        if profiler is not None and profiler.enabled:
+            profiler.record(self.name, time.time() - self.start)
+
+
+def phase(name):
+    """
+    Return a context manager recording the duration of its block as phase
+    ``name`` of the check running in this thread::
+
+     with phase('parse'):
+         parse(response)
+    """
+    return _Phase(None, name)
+
+
+def timed(phase):
+    """
+    Decorator recording the duration of each call of a function or method
+    as ``phase`` of the check running in this thread.
+
+    **Example**::
+
+     class ProbeFoo(Probe):
+         @timed('foo_query')
+         def query(self, request):
+             ...
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = getattr(_local, 'profiler', None)
+            if profiler is None or not profiler.enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(phase, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def profile_mode(mode=None):
+    """
+    Return the profiling mode to use for this execution, or None.
+
+    :param mode: the mode given as plugin argument, else the one of the
+                 ``NAGIOS_PLUGIN_PROFILE`` environment variable is used.
+    :type mode: str
+    :returns: one of :data:`MODES` or None.
+    """
+    mode = mode or os.environ.get(ENV_MODE)
+    if not mode:
+        return None
+    if mode not in MODES:
+        logger.debug('Unknown profiling mode %s, profiling disabled.', mode)
+        return None
+
+    try:
+        sample = float(os.environ.get(ENV_SAMPLE, 1))
+    except ValueError:
+        sample = 1
+    if sample < 1 and random.random() >= sample:
+        return None
+
+    return mode
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Check results and writers handing them back to Nagios as passive results.
+
+- :class:`CommandFileWriter` sends ``PROCESS_SERVICE_CHECK_RESULT`` external
+  commands to the Nagios command file,
+- :class:`CheckResultsWriter` writes files in the Nagios ``checkresults``
+  spool directory, read by the check result reaper,
+- :class:`BatchCheckResultsWriter` writes many results by file in the
+  ``checkresults`` spool directory.
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger('monitoring.nagios.results')
+
+#: Names of the Nagios statuses by return code.
+STATUSES = {0: 'OK', 1: 'WARNING', 2: 'CRITICAL', 3: 'UNKNOWN'}
+
+
+class CheckResult(object):
+    """
+    The result of a check execution.
+
+    :param host: the host name in Nagios.
+    :type host: str
+    :param service: the service description in Nagios, None for a host
+                    check.
+    :type service: str
+    :param status: the return code, 0 to 3.
+    :type status: int
+    :param output: the plugin output, with long output and perfdata.
+    :type output: str
+    :param start_time: when the check started.
+    :type start_time: float
+    :param finish_time: when the check finished.
+    :type finish_time: float
+    """
+    def __init__(self, host, service, status, output, start_time,
+                 finish_time):
+        self.host = host
+        self.service = service
+        self.status = status
+        self.output = output
+        self.start_time = start_time
+        self.finish_time = finish_time
+
+    @property
+    def duration(self):
+        """Duration of the check in seconds."""
+        return self.finish_time - self.start_time
+
+    def __repr__(self):
+        return '<CheckResult {0}/{1} {2}>'.format(
+            self.host, self.service, STATUSES.get(self.status, self.status))
+
+
+def escape_output(output):
+    """
+    Escape a plugin output to keep it on one line, as Nagios expects in
+    external commands and check result files.
+
+    **Example**::
+
+     >>> escape_output('OK - fine\\nline 2')
+     'OK - fine\\\\nline 2'
+    """
+    return output.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+class CommandFileWriter(object):
+    """
+    Send check results as external commands to the Nagios command file.
+
+    :param path: the command file, usually
+                 ``/var/spool/nagios/cmd/nagios.cmd``.
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def command(self, result):
+        """Return the external command line of ``result``."""
+        if result.service is None:
+            return '[{0:d}] PROCESS_HOST_CHECK_RESULT;{1};{2:d};{3}\n'.format(
+                int(result.finish_time), result.host, result.status,
+                escape_output(result.output))
+        return '[{0:d}] PROCESS_SERVICE_CHECK_RESULT;{1};{2};{3:d};{4}\n' \
+            .format(int(result.finish_time), result.host, result.service,
+                    result.status, escape_output(result.output))
+
+    def write(self, result):
+        """
+        Send ``result`` to Nagios.
+
+        :param result: the check result.
+        :type result: CheckResult
+        """
+        command = self.command(result)
+        if isinstance(command, unicode):
+            command = command.encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(command)
+            self._file.flush()
+
+    def close(self):
+        """Close the command file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class CheckResultsWriter(object):
+    """
+    Write check results in the Nagios ``checkresults`` spool directory, one
+    file by result.
+
+    A result file is visible to Nagios once its ``.ok`` marker exists, so it
+    is never read partially written.
+
+    :param directory: the spool directory, ``check_result_path`` in
+                      ``nagios.cfg``.
+    :type directory: str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def format(self, result):
+        """Return the content of a check result file for ``result``."""
+        lines = ['### Nagios {0} Check Result ###'.format(
+                     'Host' if result.service is None else 'Service'),
+                 '# Time: {0}'.format(time.ctime(result.finish_time)),
+                 'host_name={0}'.format(result.host)]
+        if result.service is not None:
+            lines.append('service_description={0}'.format(result.service))
+        lines.extend([
+            'check_type=1',
+            'check_options=0',
+            'scheduled_check=0',
+            'reschedule_check=0',
+            'latency=0.0',
+            'start_time={0:.6f}'.format(result.start_time),
+            'finish_time={0:.6f}'.format(result.finish_time),
+            'early_timeout=0',
+            'exited_ok=1',
+            'return_code={0:d}'.format(result.status),
+            'output={0}'.format(escape_output(result.output)),
+        ])
+        return '\n'.join(lines) + '\n\n'
+
+    def write(self, result):
+        """
+        Write ``result`` in a new check result file.
+
+        :param result: the check result.
+        :type result: CheckResult
+        """
+        self._write_file(self.format(result))
+
+    def _write_file(self, content):
+        """Write a check result file and its ``.ok`` marker."""
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        fd, filename = tempfile.mkstemp(prefix='c', dir=self.directory)
+        with os.fdopen(fd, 'w') as result_file:
+            result_file.write(content)
+        os.chmod(filename, 0644)
+        open(filename + '.ok', 'w').close()
+        logger.debug('Check results written to %s.', filename)
+
+    def close(self):
+        """Nothing to do, results are written immediately."""
+        pass
+
+
+class BatchCheckResultsWriter(CheckResultsWriter):
+    """
+    Write check results in the Nagios ``checkresults`` spool directory by
+    batches, many results by file.
+
+    Results are kept in memory until ``flush_size`` results are waiting, and
+    at most ``flush_interval`` seconds, then written in a single file with
+    its ``.ok`` marker. Call :meth:`close` to write the last results.
+
+    :param directory: the spool directory, ``check_result_path`` in
+                      ``nagios.cfg``.
+    :type directory: str
+    :param flush_size: number of results by file.
+    :type flush_size: int
+    :param flush_interval: maximum number of seconds a result waits.
+    :type flush_interval: float
+    """
+    def __init__(self, directory, flush_size=100, flush_interval=5.0):
+        super(BatchCheckResultsWriter, self).__init__(directory)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._results = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def write(self, result):
+        """
+        Add ``result`` to the batch, writing the batch if full.
+
+        :param result: the check result.
+        :type result: CheckResult
+        """
+        with self._lock:
+            self._results.append(self.format(result))
+            if len(self._results) < self.flush_size:
+                return
+            batch, self._results = self._results, []
+        self._write_file(''.join(batch))
+
+    def flush(self):
+        """Write the waiting results."""
+        with self._lock:
+            batch, self._results = self._results, []
+        if batch:
+            self._write_file(''.join(batch))
+
+    def _flush_periodically(self):
+        """Flush results every ``flush_interval`` until closed."""
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (IOError, OSError) as e:
+                logger.error('Unable to write check results: %s', e)
+
+    def close(self):
+        """Write the waiting results and stop the periodic flush."""
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Run plugins in the current process.
+
+A plugin run by :func:`run_plugin` must implement
+:meth:`monitoring.nagios.plugin.NagiosPlugin.run`. Its output, printed by
+status methods like :meth:`monitoring.nagios.plugin.NagiosPlugin.ok`, is
+captured by thread so plugins can run concurrently in threads.
+
+:class:`ProcessPoolRunner` runs plugins in a pool of worker processes
+instead, killing checks that exceed a deadline.
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from Queue import Queue
+from cStringIO import StringIO
+
+from monitoring.nagios import profiling
+from monitoring.nagios.results import CheckResult
+
+logger = logging.getLogger('monitoring.nagios.runner')
+
+
+class _ThreadLocalStream(object):
+    """A stream writing to a buffer of the current thread when set."""
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buffer):
+        """Write to ``buffer`` in this thread, or to the stream if None."""
+        self._local.buffer = buffer
+
+    def write(self, data):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            self._stream.write(data)
+        else:
+            buffer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+_install_lock = threading.Lock()
+
+
+def _thread_local_stream(name):
+    """Replace ``sys.<name>`` by a thread local stream once."""
+    with _install_lock:
+        stream = getattr(sys, name)
+        if not isinstance(stream, _ThreadLocalStream):
+            stream = _ThreadLocalStream(stream)
+            setattr(sys, name, stream)
+        return stream
+
+
+def run_plugin(plugin_class, args, host=None, service=None, name=None):
+    """
+    Run a plugin and return its result.
+
+    The status is the exit code of the plugin. Errors, including invalid
+    arguments and a plugin ending without status, give an UNKNOWN result
+    with the error as output.
+
+    :param plugin_class: the plugin class, implementing ``run()``.
+    :type plugin_class: type
+    :param args: the command line arguments of the plugin.
+    :type args: list
+    :param host: the host name of the result.
+    :type host: str
+    :param service: the service description of the result, None for a host
+                    check.
+    :type service: str
+    :param name: the plugin name, used for retention files. Default to the
+                 class name.
+    :type name: str
+    :returns: the result of the check.
+    :rtype: monitoring.nagios.results.CheckResult
+    """
+    stdout = _thread_local_stream('stdout')
+    stderr = _thread_local_stream('stderr')
+    output, errors = StringIO(), StringIO()
+    status = 3
+
+    start_time = time.time()
+    stdout.capture(output)
+    stderr.capture(errors)
+    try:
+        plugin_class(name=name or plugin_class.__name__, argv=args).run()
+        output.write('UNKNOWN - Plugin {0} ended without '
+                     'status !'.format(plugin_class.__name__))
+    except SystemExit as e:
+        if e.code in (0, 1, 2, 3) and output.getvalue():
+            status = e.code
+        else:
+            # argparse exits with 2 after printing its error to stderr
+            output.write('UNKNOWN - {0}'.format(errors.getvalue().strip()))
+    except Exception as e:
+        output.write('UNKNOWN - Unexpected error in plugin {0}: {1}\n'
+                     '{2}'.format(plugin_class.__name__, e,
+                                  traceback.format_exc()))
+    finally:
+        stdout.capture(None)
+        stderr.capture(None)
+
+        # Write the profiling file of the check, if profiled
+        profiler = profiling.current()
+        if profiler is not None:
+            profiler.dump()
+    finish_time = time.time()
+
+    return CheckResult(host, service, status, output.getvalue().strip(),
+                       start_time, finish_time)
+
+
+def _worker_main(connection):
+    """Run plugins received from ``connection`` until ``None``."""
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        connection.send(run_plugin(*task))
+
+
+def _spawner_main(connection, address, authkey):
+    """
+    Fork a worker process connecting to ``address`` for each request
+    received from ``connection`` and send back its pid, until ``None``.
+    """
+    # Workers are not waited for, let the system reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if request is None:
+            return
+
+        pid = os.fork()
+        if pid:
+            connection.send(pid)
+            continue
+
+        status = 0
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            connection.close()
+            _worker_main(Client(address, authkey=authkey))
+        except BaseException:
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+
+class _Spawner(object):
+    """
+    A process forking the worker processes.
+
+    Forking a process running threads is unsafe: the child gets the locks
+    held by other threads at that time, like the ones of :mod:`logging`, and
+    blocks forever when taking them. The spawner is forked when the pool is
+    created and has no thread, workers forked from it get no held lock.
+    Workers connect back to a listener of the pool.
+    """
+    def __init__(self):
+        authkey = os.urandom(20)
+        self.listener = Listener(family='AF_UNIX', authkey=authkey)
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_spawner_main,
+            args=(child, self.listener.address, authkey))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self._lock = threading.Lock()
+
+    def spawn(self):
+        """
+        Fork a worker process.
+
+        :returns: tuple ``(pid, connection)``.
+        """
+        with self._lock:
+            self.connection.send(True)
+            pid = self.connection.recv()
+            return pid, self.listener.accept()
+
+    def stop(self):
+        """Stop the process, running workers are not affected."""
+        try:
+            self.connection.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join()
+        self.connection.close()
+        self.listener.close()
+
+
+class _Worker(object):
+    """A worker process and the connection to it."""
+    def __init__(self, spawner):
+        self.pid, self.connection = spawner.spawn()
+        self.checks = 0
+        logger.debug('Started worker process %d.', self.pid)
+
+    def kill(self):
+        """Kill the process immediately."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.connection.close()
+        logger.debug('Killed worker process %d.', self.pid)
+
+    def stop(self, timeout=5):
+        """Ask the process to exit, kill it after ``timeout`` seconds."""
+        try:
+            self.connection.send(None)
+        except (IOError, OSError):
+            pass
+        # The connection is closed by the process when it exits
+        if self.connection.poll(timeout):
+            self.connection.close()
+        else:
+            self.kill()
+
+
+class ProcessPoolRunner(object):
+    """
+    Run plugins in a pool of worker processes.
+
+    Each check has a hard deadline: a worker running a check longer than
+    ``deadline`` seconds, blocked in a stalled probe for example, is killed
+    and replaced, and the check gets an UNKNOWN result. Workers are also
+    replaced after ``max_checks`` checks to bound their memory growth.
+
+    :meth:`run` blocks until a worker is free and the check is done, call it
+    from several threads to run checks concurrently, like the
+    :class:`monitoring.nagios.scheduler.Scheduler` does::
+
+     pool = ProcessPoolRunner(processes=8, deadline=30)
+     scheduler = Scheduler(checks, writer, workers=8, runner=pool.run)
+     try:
+         scheduler.run()
+     finally:
+         pool.close()
+
+    Plugin classes are sent to workers by reference, they must be defined at
+    the top level of a module.
+
+    Workers, including the ones replacing killed or recycled workers, are
+    forked from a process started with the pool: create the pool before
+    starting threads, workers get the state of the program at that time.
+
+    :param processes: number of worker processes.
+    :type processes: int
+    :param deadline: maximum duration of a check in seconds.
+    :type deadline: float
+    :param max_checks: number of checks run by a worker before being
+                       replaced.
+    :type max_checks: int
+    """
+    def __init__(self, processes=4, deadline=60, max_checks=100):
+        self.processes = processes
+        self.deadline = deadline
+        self.max_checks = max_checks
+
+        self._spawner = _Spawner()
+        self._idle = Queue()
+        for _ in xrange(processes):
+            self._idle.put(_Worker(self._spawner))
+
+    def run(self, plugin_class, args, host=None, service=None, name=None):
+        """
+        Run a plugin in a worker process and return its result. Same
+        arguments as :func:`run_plugin`.
+
+        :returns: the result of the check.
+        :rtype: monitoring.nagios.results.CheckResult
+        """
+        worker = self._idle.get()
+        start_time = time.time()
+        try:
+            worker.connection.send((plugin_class, args, host, service, name))
+            if worker.connection.poll(self.deadline):
+                result = worker.connection.recv()
+                worker.checks += 1
+            else:
+                logger.warning('Check %s on %s exceeded %s seconds, killing '
+                               'worker %d.', plugin_class.__name__, host,
+                               self.deadline, worker.pid)
+                worker.kill()
+                worker = None
+                result = CheckResult(
+                    host, service, 3,
+                    'UNKNOWN - Check killed after {0} seconds '
+                    '!'.format(self.deadline), start_time, time.time())
+        except Exception as e:
+            worker.kill()
+            worker = None
+            result = CheckResult(
+                host, service, 3,
+                'UNKNOWN - Check worker failed: {0}'.format(e),
+                start_time, time.time())
+        finally:
+            if worker is None:
+                worker = _Worker(self._spawner)
+            elif worker.checks >= self.max_checks:
+                worker.stop()
+                worker = _Worker(self._spawner)
+            self._idle.put(worker)
+
+        return result
+
+    def close(self):
+        """Stop all workers, waiting for running checks."""
+        for _ in xrange(self.processes):
+            self._idle.get().stop()
+        self._spawner.stop()
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Run checks periodically in a single process.
+
+Instead of Nagios forking one process by check at the start of each interval,
+the scheduler runs plugins in-process on a pool of worker threads, spreads
+their start times and limits the number of checks running at the same time,
+globally and by target host. Results are handed back to Nagios as passive
+results by a writer of :mod:`monitoring.nagios.results`.
+
+Checks are described in a JSON file::
+
+ [
+   {"plugin": "mychecks.disk:CheckDisk",
+    "args": ["-H", "srv01", "-w", "80", "-c", "90"],
+    "interval": 300,
+    "service": "Disk usage"}
+ ]
+
+And run with::
+
+ python -m monitoring.nagios.scheduler checks.json \\
+     --checkresults /var/spool/nagios/checkresults
+"""
+
+import json
+import time
+import heapq
+import random
+import logging
+import argparse
+import threading
+from Queue import Queue
+from collections import defaultdict, deque
+
+from monitoring.nagios.runner import run_plugin, ProcessPoolRunner
+from monitoring.nagios.plugin import NagiosPluginSNMP
+from monitoring.nagios.probes.snmppoller import SNMPPoller
+from monitoring.nagios.results import (CommandFileWriter, CheckResultsWriter,
+                                       BatchCheckResultsWriter)
+
+logger = logging.getLogger('monitoring.nagios.scheduler')
+
+
+class ScheduledCheck(object):
+    """
+    A check run periodically by the :class:`Scheduler`.
+
+    :param plugin_class: the plugin class, implementing ``run()``.
+    :type plugin_class: type
+    :param args: the command line arguments of the plugin.
+    :type args: list
+    :param interval: seconds between two runs.
+    :type interval: float
+    :param host: the target host, default to the value of ``-H`` in
+                 ``args``.
+    :type host: str
+    :param service: the service description in Nagios, None for a host
+                    check.
+    :type service: str
+    """
+    def __init__(self, plugin_class, args, interval, host=None, service=None):
+        self.plugin_class = plugin_class
+        self.args = list(args)
+        self.interval = interval
+        self.host = host or _host_from_args(self.args)
+        self.service = service
+        self.next_run = None
+
+    def run(self, runner=run_plugin):
+        """
+        Run the check and return its result.
+
+        :param runner: the function running plugins, like
+                       :func:`monitoring.nagios.runner.run_plugin`.
+        """
+        return runner(self.plugin_class, self.args, self.host, self.service)
+
+    def __repr__(self):
+        return '<ScheduledCheck {0} on {1}>'.format(
+            self.plugin_class.__name__, self.host)
+
+
+def _host_from_args(args):
+    """Return the value of ``-H`` in ``args``."""
+    try:
+        return args[args.index('-H') + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def import_plugin(path):
+    """
+    Import a plugin class from its path ``package.module:ClassName``.
+
+    **Example**::
+
+     >>> import_plugin('monitoring.nagios.plugin:NagiosPlugin')
+     <class 'monitoring.nagios.plugin.base.NagiosPlugin'>
+    """
+    module_name, _, class_name = path.partition(':')
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+def load_checks(filename):
+    """
+    Load checks from a JSON file, a list of objects with keys ``plugin``
+    (``package.module:ClassName``), ``args``, ``interval`` and optionally
+    ``host`` and ``service``.
+
+    :param filename: the path of the file.
+    :type filename: str
+    :returns: list of :class:`ScheduledCheck`.
+    """
+    with open(filename) as checks_file:
+        entries = json.load(checks_file)
+
+    return [ScheduledCheck(import_plugin(entry['plugin']),
+                           entry.get('args', []),
+                           entry['interval'],
+                           host=entry.get('host'),
+                           service=entry.get('service'))
+            for entry in entries]
+
+
+class Scheduler(object):
+    """
+    Run checks periodically on a pool of worker threads.
+
+    First runs are spread over the interval of each check, next runs happen
+    every interval plus or minus ``jitter`` (a ratio of the interval) so
+    checks do not start at the same instant. A check due while
+    ``per_target`` checks are already running on its host waits for one of
+    them to finish.
+
+    :param checks: the checks to run.
+    :type checks: list of :class:`ScheduledCheck`
+    :param writer: where results are written, an object with ``write()``
+                   and ``close()`` methods like
+                   :class:`monitoring.nagios.results.CheckResultsWriter`.
+    :param workers: maximum number of checks running at the same time.
+    :type workers: int
+    :param per_target: maximum number of checks running at the same time on
+                       a host.
+    :type per_target: int
+    :param jitter: random variation of intervals, ratio of the interval.
+    :type jitter: float
+    :param runner: the function running plugins, default to
+                   :func:`monitoring.nagios.runner.run_plugin` in worker
+                   threads. Use ``run`` of a
+                   :class:`monitoring.nagios.runner.ProcessPoolRunner` to
+                   run them in processes.
+    """
+    def __init__(self, checks, writer, workers=10, per_target=2, jitter=0.1,
+                 runner=run_plugin):
+        self.checks = checks
+        self.writer = writer
+        self.workers = workers
+        self.per_target = per_target
+        self.jitter = jitter
+        self.runner = runner
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._sequence = 0
+        self._queue = Queue()
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(deque)
+        self._stopped = False
+
+    def _schedule(self, check, due):
+        """Add ``check`` to the heap of checks to run at ``due``."""
+        check.next_run = due
+        self._sequence += 1
+        heapq.heappush(self._heap, (due, self._sequence, check))
+
+    def _dispatch(self, check):
+        """Give ``check`` to workers, or make it wait for its host."""
+        if self._running[check.host] >= self.per_target:
+            logger.debug('Too many checks on %s, %r waits.', check.host,
+                         check)
+            self._waiting[check.host].append(check)
+        else:
+            self._running[check.host] += 1
+            self._queue.put(check)
+
+    def _done(self, check):
+        """Release the host of ``check`` and schedule its next run."""
+        with self._condition:
+            self._running[check.host] -= 1
+            if self._waiting[check.host]:
+                self._dispatch(self._waiting[check.host].popleft())
+
+            jitter = random.uniform(-self.jitter, self.jitter)
+            due = check.next_run + check.interval * (1 + jitter)
+            self._schedule(check, max(due, time.time()))
+            self._condition.notify()
+
+    def _work(self):
+        """Run checks from the queue until ``None`` is received."""
+        while True:
+            check = self._queue.get()
+            if check is None:
+                return
+            try:
+                result = check.run(self.runner)
+                self.writer.write(result)
+            except Exception:
+                logger.exception('Unable to run or write result of %r.',
+                                 check)
+            finally:
+                self._done(check)
+
+    def run(self, duration=None):
+        """
+        Run checks until :meth:`stop` is called or for ``duration`` seconds,
+        then wait for running checks and close the writer.
+
+        :param duration: seconds to run, default forever.
+        :type duration: float
+        """
+        now = time.time()
+        end = now + duration if duration is not None else None
+        with self._condition:
+            self._stopped = False
+            for check in self.checks:
+                self._schedule(check, now + random.uniform(0, check.interval))
+
+        workers = [threading.Thread(target=self._work)
+                   for _ in xrange(self.workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            with self._condition:
+                while not self._stopped:
+                    now = time.time()
+                    if end is not None and now >= end:
+                        break
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, check = heapq.heappop(self._heap)
+                        self._dispatch(check)
+                        continue
+
+                    timeout = self._heap[0][0] - now if self._heap else 1
+                    if end is not None:
+                        timeout = min(timeout, end - now)
+                    self._condition.wait(timeout)
+        finally:
+            for _ in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+            self.writer.close()
+            with self._condition:
+                self._heap = []
+                self._waiting.clear()
+
+    def stop(self):
+        """Stop scheduling checks, :meth:`run` returns once they finish."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+def main(argv=None):
+    """Run the scheduler from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Run Nagios checks periodically in a single process.')
+    parser.add_argument('checks', help='JSON file describing the checks.')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--checkresults', metavar='DIRECTORY',
+                        help='Write results in this checkresults spool '
+                             'directory.')
+    output.add_argument('--command-file', metavar='PATH',
+                        help='Send results to this Nagios command file.')
+    parser.add_argument('--flush-size', type=int, default=100,
+                        help='Number of results by checkresults file, 1 to '
+                             'write results one by one (default 100).')
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                        help='Maximum seconds a result waits before being '
+                             'written in checkresults (default 2).')
+    parser.add_argument('--workers', type=int, default=10,
+                        help='Maximum number of checks running at the same '
+                             'time (default 10).')
+    parser.add_argument('--per-target', type=int, default=2,
+                        help='Maximum number of checks running at the same '
+                             'time on a host (default 2).')
+    parser.add_argument('--processes', action='store_true',
+                        help='Run checks in worker processes instead of '
+                             'threads.')
+    parser.add_argument('--deadline', type=float, default=60,
+                        help='With --processes, kill checks running longer '
+                             'than this number of seconds (default 60).')
+    parser.add_argument('--max-checks', type=int, default=100,
+                        help='With --processes, replace a worker process '
+                             'after this number of checks (default 100).')
+    parser.add_argument('--snmp-poller', action='store_true',
+                        help='Send SNMP v1 and v2c requests of all checks '
+                             'through a shared socket, not with '
+                             '--processes.')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Random variation of intervals, ratio of the '
+                             'interval (default 0.1).')
+    options = parser.parse_args(argv)
+    if options.snmp_poller and options.processes:
+        parser.error('--snmp-poller cannot be used with --processes.')
+
+    # Workers are forked from a process started with the pool, before any
+    # thread
+    pool = None
+    runner = run_plugin
+    if options.processes:
+        pool = ProcessPoolRunner(options.workers, options.deadline,
+                                 options.max_checks)
+        runner = pool.run
+
+    if options.checkresults and options.flush_size > 1:
+        writer = BatchCheckResultsWriter(options.checkresults,
+                                         options.flush_size,
+                                         options.flush_interval)
+    elif options.checkresults:
+        writer = CheckResultsWriter(options.checkresults)
+    else:
+        writer = CommandFileWriter(options.command_file)
+
+    checks = load_checks(options.checks)
+    poller = None
+    if options.snmp_poller:
+        poller = SNMPPoller()
+        NagiosPluginSNMP.poller = poller
+
+    scheduler = Scheduler(checks, writer,
+                          workers=options.workers,
+                          per_target=options.per_target,
+                          jitter=options.jitter,
+                          runner=runner)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.close()
+        if poller is not None:
+            poller.close()
+
+
+if __name__ == '__main__':
+    main()
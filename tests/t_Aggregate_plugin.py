@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Testing module for Aggregate class plugin."""
+
+import unittest
+import sys
+import time
+import socket
+
+sys.path.insert(0, "..")
+from monitoring.nagios.plugin import NagiosPluginAggregate
+from monitoring.nagios.probes import ProbeHTTP
+from monitoring.nagios.runner import run_plugin
+
+# Value of each host, None for a failing host
+VALUES = {'web1': 10, 'web2': 20, 'web3': 30, 'web4': None, 'web5': 40}
+
+
+class PluginWebNodes(NagiosPluginAggregate):
+    """Aggregate plugin taking values from VALUES."""
+    def probe(self, host):
+        time.sleep(0.2)
+        if VALUES[host] is None:
+            raise IOError('Connection refused')
+        return VALUES[host]
+
+
+class PluginClosedPort(NagiosPluginAggregate):
+    """Aggregate plugin with a HTTP probe on a closed port for web2."""
+    def probe(self, host):
+        if host == 'web2':
+            ProbeHTTP('127.0.0.1', port=closed_port()).get('/', timeout=5)
+        return VALUES[host]
+
+
+def closed_port():
+    """Return a local TCP port with nothing listening."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run(*args):
+    """Run PluginWebNodes on all hosts with args."""
+    return run_plugin(PluginWebNodes,
+                      ['-H', ','.join(sorted(VALUES))] + list(args))
+
+
+class TestAggregatePlugin(unittest.TestCase):
+    """Test the aggregate plugin."""
+
+    def test_aggregates(self):
+        """Test aggregates, output and concurrency."""
+        start = time.time()
+        result = run()
+        self.assertLess(time.time() - start, 0.6)
+
+        self.assertEqual(0, result.status)
+        lines = result.output.split('\n')
+        self.assertEqual('OK - 4/5 hosts OK', lines[0])
+        self.assertEqual('UNKNOWN web4: Connection refused', lines[1])
+        self.assertIn('OK web1: 10', lines)
+        self.assertTrue(lines[-1].endswith(
+            '| min=10 max=40 avg=25 count_ok=4;;;0;5'))
+
+    def test_count_ok(self):
+        """Test a threshold on the number of hosts in OK status."""
+        result = run('--host-critical', '25', '-c', 'count_ok=3:')
+        self.assertEqual(2, result.status)
+        self.assertTrue(result.output.startswith(
+            'CRITICAL - 2/5 hosts OK, count_ok=2 (< 3)\n'
+            'CRITICAL web3: 30\n'
+            'CRITICAL web5: 40\n'
+            'UNKNOWN web4: Connection refused\n'))
+
+    def test_worst_threshold(self):
+        """Test critical wins and each aggregate is reported once."""
+        result = run('-w', 'max=35', '-w', 'avg=20', '-c', 'max=45',
+                     '-c', 'min=15:')
+        self.assertEqual(2, result.status)
+        self.assertIn('min=10 (< 15), max=40 (< 0 or > 35), '
+                      'avg=25 (< 0 or > 20)', result.output)
+        self.assertIn('max=40;35', result.output)
+
+    def test_library_probe_error(self):
+        """Test a library probe exiting UNKNOWN only fails its host."""
+        result = run_plugin(PluginClosedPort,
+                            ['-H', 'web1,web2,web3', '-c', 'count_ok=2:'])
+        self.assertEqual(0, result.status)
+        lines = result.output.split('\n')
+        self.assertEqual('OK - 2/3 hosts OK', lines[0])
+        self.assertTrue(lines[1].startswith(
+            'UNKNOWN web2: HTTP GET error on URL: http://127.0.0.1:'))
+        self.assertEqual(1, sum('UNKNOWN' in line for line in lines))
+
+    def test_bad_threshold(self):
+        """Test an invalid aggregate function."""
+        result = run('-c', 'median=10')
+        self.assertEqual(3, result.status)
+        self.assertIn('FUNCTION=THRESHOLD', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
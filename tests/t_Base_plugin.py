@@ -24,9 +24,15 @@
 import unittest
 import os
 import sys
+import shutil
+import tempfile
+import json
 
 sys.path.insert(0, "..")
-from monitoring.nagios.plugin import NagiosPlugin
+from monitoring.nagios.plugin import NagiosPlugin, PerfData
+from monitoring.nagios.plugin.output import (MAX_OUTPUT_LENGTH_NRPE,
+                                             truncate_output)
+from monitoring.nagios.profiling import timed, current
 
 
 class PluginCustom(NagiosPlugin):
@@ -137,3 +143,122 @@ class TestBasePlugin(unittest.TestCase):
         """Test base plugin argument value getter."""
         self.assertEqual('monitoring-dc.app.corp',
                          self.plugin.options.hostname)
+
+    def test_output_no_substitute(self):
+        """Test output with braces in data and no substitution."""
+        self.plugin.shortoutput = 'Config is {"a": 1}'
+        self.plugin.perfdata.append(PerfData('used space', 42.5, '%', 80, 90))
+        self.assertEqual("Config is {\"a\": 1} | 'used space'=42.5%;80;90",
+                         self.plugin.output())
+
+    def test_output_long_output_limit(self):
+        """Test footer of long output only shown when lines are hidden."""
+        self.plugin.shortoutput = 'OK'
+        self.plugin.longoutput = ['line {0}'.format(i) for i in range(3)]
+        self.assertEqual('OK\nline 0\nline 1\nline 2', self.plugin.output())
+        output = self.plugin.output(long_output_limit=2)
+        self.assertTrue(output.endswith('first 2 lines, '
+                                        '1 elements remaining...)'))
+
+    def test_output_max_length(self):
+        """Test output bounded in size keeping perfdata."""
+        self.plugin.shortoutput = 'CRITICAL: {count} ports down'
+        self.plugin.longoutput = ['port {0} is down'.format(i)
+                                  for i in xrange(10000)]
+        self.plugin.perfdata.append(PerfData('down', 10000, min=0))
+        output = self.plugin.output({'count': 10000}, long_output_limit=None,
+                                    max_length=MAX_OUTPUT_LENGTH_NRPE)
+        self.assertLessEqual(len(output), MAX_OUTPUT_LENGTH_NRPE)
+        self.assertTrue(output.startswith('CRITICAL: 10000 ports down\n'))
+        self.assertTrue(output.endswith('remaining...) | down=10000;;;0'))
+
+    def test_output_max_length_bytes(self):
+        """Test output bounded in UTF-8 bytes, not in characters."""
+        self.plugin.shortoutput = u'CRITICAL: {count} d\xe9fauts'
+        self.plugin.longoutput = [u'port {0} en d\xe9faut \u26a0'.format(i)
+                                  for i in xrange(1000)]
+        self.plugin.perfdata.append(PerfData('down', 1000, min=0))
+        output = self.plugin.output({'count': 1000}, long_output_limit=None,
+                                    max_length=MAX_OUTPUT_LENGTH_NRPE)
+        self.assertLessEqual(len(output.encode('utf-8')),
+                             MAX_OUTPUT_LENGTH_NRPE)
+        self.assertTrue(output.endswith('remaining...) | down=1000;;;0'))
+
+    def test_truncate_output(self):
+        """Test truncation does not split multibyte characters."""
+        self.assertEqual(u'\u26a0', truncate_output(u'\u26a0\u26a0', 5))
+        self.assertEqual('\xe2\x9a\xa0',
+                         truncate_output('\xe2\x9a\xa0\xe2\x9a\xa0', 5))
+        self.assertEqual('D\xc3\xa9', truncate_output('D\xc3\xa9faut', 3))
+        self.assertEqual('D', truncate_output('D\xc3\xa9faut', 2))
+        self.assertEqual('abc', truncate_output('abcdef', 3))
+
+    def test_parser_reused(self):
+        """Test that the argument parser is built once by class."""
+        self.assertIs(self.plugin.parser, NagiosPlugin().parser)
+        self.assertIsNot(self.plugin.parser, PluginCustom().parser)
+
+    def test_retention_folder_created_on_save(self):
+        """Test retention folder creation when saving data."""
+        directory = tempfile.mkdtemp()
+        try:
+            picklefile = os.path.join(directory, 'sub', 'data.pkl')
+            self.plugin.save_data([1, 2], picklefile=picklefile)
+            self.assertEqual([1, 2], self.plugin.load_data(picklefile))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestBasePluginProfiling(unittest.TestCase):
+    """Test profiling of plugin executions."""
+    def setUp(self):
+        sys.argv = sys.argv[:1]
+        sys.argv.extend(['-H', 'monitoring-dc.app.corp', '--profile'])
+
+    def tearDown(self):
+        profiler = current()
+        if profiler is not None:
+            profiler.stop()
+
+    def test_profile_perfdata(self):
+        """Test durations of phases added to perfdata."""
+        sys.argv.append('perfdata')
+        plugin = PluginCustom()
+        self.assertIs(plugin.profiler, current())
+
+        @timed('query')
+        def query():
+            return 42
+
+        self.assertEqual(42, query())
+        query()
+        self.assertEqual(2, plugin.profiler.timings['query'][0])
+
+        plugin.shortoutput = 'OK'
+        output = plugin.output()
+        for phase in ('arguments', 'initialize', 'query', 'total'):
+            self.assertIn(' profile_{0}='.format(phase), output)
+        self.assertIsNone(current())
+
+    def test_profile_json(self):
+        """Test durations of phases written to a JSON file."""
+        sys.argv.append('json')
+        plugin = PluginCustom()
+        filename = plugin.profiler.filename + '.json'
+        try:
+            plugin.profiler.dump()
+            with open(filename) as profile:
+                timings = json.load(profile)['timings']
+            self.assertEqual(1, timings['initialize']['count'])
+        finally:
+            os.remove(filename)
+
+    def test_profiler_by_plugin(self):
+        """Test plugins do not share their profiler."""
+        sys.argv.append('perfdata')
+        first = PluginCustom()
+        second = PluginCustom()
+        self.assertIsNot(first.profiler, second.profiler)
+        self.assertTrue(first.profiler.enabled)
+        self.assertEqual(1, first.profiler.timings['initialize'][0])
+
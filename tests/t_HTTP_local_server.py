@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Test module for HTTP probe against a local HTTP server."""
+
+import unittest
+import sys
+import re
+import shutil
+import tempfile
+import threading
+import socket
+import gc
+import weakref
+import xml.etree.ElementTree
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, "..")
+from monitoring.nagios.plugin import NagiosPluginHTTP
+from monitoring.nagios.probes import ProbeHTTP, AsyncProbeHTTP
+from monitoring.nagios.probes import http as http_probe
+from monitoring.nagios.profiling import Profiler
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """Serve the content of ``server.pages`` by path."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        """Send the page, a 304 if the ETag matches or a 404."""
+        content_type, body = self.server.pages.get(self.path,
+                                                   ('text/plain', None))
+        etag = self.server.etags.get(self.path)
+        if body is None:
+            status, body = 404, 'Not found'
+        elif etag and self.headers.get('If-None-Match') == etag:
+            status, body = 304, ''
+        else:
+            status = 200
+        self.server.requests.append((self.path, status))
+        self.server.cookies.append(self.headers.get('Cookie'))
+        self.send_response(status)
+        if self.path == '/login':
+            self.send_header('Set-Cookie', 'session=s3cr3t; Path=/')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    """A local HTTP server running in a thread."""
+    daemon_threads = True
+
+    def __init__(self, pages):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), LocalHandler)
+        self.pages = pages
+        self.connections = []
+        self.requests = []
+        self.cookies = []
+        self.etags = {}
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_error(self, request, client_address):
+        """Ignore clients closing kept alive connections."""
+        pass
+
+    def stop(self):
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class TestHTTPProbeLocal(unittest.TestCase):
+    """Test HTTP probe on a local server."""
+    pages = {
+        '/status': ('text/plain', 'OK'),
+        '/login': ('text/plain', 'Welcome'),
+        '/version': ('application/json', '{"version": "1.2.3"}'),
+        '/queues': ('application/json',
+                    '{"queues": [{"name": "mail", "depth": 42}]}'),
+        '/alerts.xml': ('text/xml',
+                        '<alerts><alert><last_update>10:00</last_update>'
+                        '</alert><alert><last_update>11:00</last_update>'
+                        '</alert></alerts>'),
+        '/hosts.xml': ('text/xml',
+                       '<feed><hosts>' + ''.join(
+                           '<host name="h{0}"><alerts><alert><level>{0}'
+                           '</level></alert></alerts></host>'.format(i)
+                           for i in range(3000)) + '</hosts></feed>'),
+        '/app.log': ('text/plain',
+                     'INFO started\nWARN request took 1500ms\n' +
+                     'INFO ok\n' * 100000 + 'FATAL crashed\n'),
+        '/oneline.log': ('text/plain',
+                         'x' * 1000000 + 'took 42ms' + 'y' * 10000),
+    }
+
+    def setUp(self):
+        self.server = LocalServer(self.pages)
+        self.http = ProbeHTTP('127.0.0.1', port=self.server.server_port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_http_get(self):
+        """Test HTTP GET request."""
+        response = self.http.get('/status')
+        self.assertEqual('OK', response.text)
+
+    def test_keep_alive(self):
+        """Test that requests reuse the same connection."""
+        for _ in range(5):
+            self.http.get('/status')
+        http = ProbeHTTP('127.0.0.1', port=self.server.server_port)
+        self.assertEqual('1.2.3', http.get('/version').json()['version'])
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_session_per_probe(self):
+        """Test that probes share connections but not cookies."""
+        self.http.get('/login')
+        http = ProbeHTTP('127.0.0.1', port=self.server.server_port,
+                         auth=('nagios', 'secret'))
+        http.get('/status')
+        self.http.get('/status')
+        self.assertEqual([None, None, 'session=s3cr3t'], self.server.cookies)
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_connection_pools_bounded(self):
+        """Test least recently used connection pools are closed."""
+        self.http.get('/status')
+        adapter = http_probe.get_adapter(self.http.baseurl)
+        self.assertEqual(1, len(adapter.poolmanager.pools))
+
+        max_pools = http_probe.MAX_CONNECTION_POOLS
+        http_probe.MAX_CONNECTION_POOLS = 2
+        try:
+            http_probe.get_adapter('http://127.0.0.1:1')
+            self.assertIs(adapter,
+                          http_probe.get_adapter(self.http.baseurl))
+            http_probe.get_adapter('http://127.0.0.1:2')
+            http_probe.get_adapter('http://127.0.0.1:3')
+        finally:
+            http_probe.MAX_CONNECTION_POOLS = max_pools
+        self.assertNotIn(self.http.baseurl, http_probe._adapters)
+        self.assertEqual(0, len(adapter.poolmanager.pools))
+
+    def test_get_many(self):
+        """Test concurrent HTTP GET requests with an error."""
+        responses = self.http.get_many(['/status', '/missing', '/version'],
+                                       max_concurrency=3)
+        self.assertEqual('OK', responses[0].text)
+        self.assertFalse(responses[1].ok)
+        self.assertEqual(404, responses[1].status_code)
+        self.assertEqual('1.2.3', responses[2].json()['version'])
+
+    def test_xml_etree(self):
+        """Test XML parsing with ElementTree."""
+        response = self.http.get('/alerts.xml')
+        self.assertEqual('alerts', response.etree().tag)
+        self.assertEqual('11:00',
+                         response.xpath('alert/last_update')[1].text)
+
+    def test_xml_iterparse(self):
+        """Test incremental XML parsing."""
+        response = self.http.get('/alerts.xml', stream=True)
+        updates = [alert.findtext('last_update')
+                   for alert in response.iterxml('alert')]
+        self.assertEqual(['10:00', '11:00'], updates)
+
+    def test_xml_iterparse_nested(self):
+        """Test nested elements are freed once yielded."""
+        # Elements of cElementTree do not support weak references
+        http_probe.etree, etree = xml.etree.ElementTree, http_probe.etree
+        try:
+            response = self.http.get('/hosts.xml', stream=True)
+            alerts = []
+            alive = []
+            for alert in response.iterxml('alert'):
+                alerts.append(weakref.ref(alert))
+                if len(alerts) % 100 == 0:
+                    del alert
+                    gc.collect()
+                    alive.append(len([ref for ref in alerts
+                                      if ref() is not None]))
+        finally:
+            http_probe.etree = etree
+        self.assertEqual(3000, len(alerts))
+        # Only elements of the chunk being parsed are kept
+        self.assertLess(max(alive), 500)
+
+    def test_jsonpath(self):
+        """Test getting a value in JSON by its path."""
+        response = self.http.get('/queues')
+        self.assertEqual(42, response.jsonpath('queues/0/depth'))
+        self.assertRaises(KeyError, response.jsonpath, 'queues/1/depth')
+
+    def test_search_limit(self):
+        """Test searching patterns in a body with a size limit."""
+        took = re.compile(r'took (\d+)ms')
+        response, found = self.http.search('/app.log', ['FATAL', took],
+                                           max_bytes=4096)
+        self.assertIsNone(found['FATAL'])
+        self.assertEqual('1500', found[took].group(1))
+        self.assertTrue(response.truncated)
+        self.assertEqual(4096, response.bytes_read)
+        self.assertEqual('OK', self.http.get('/status').text)
+
+    def test_search_stop_when_found(self):
+        """Test that reading stops once all patterns are found."""
+        response, found = self.http.search('/app.log', ['WARN'])
+        self.assertEqual('WARN', found['WARN'])
+        self.assertLess(response.bytes_read, 100000)
+
+    def test_search_long_line(self):
+        """Test that a body without end of line is not kept in memory."""
+        class Regexp(object):
+            """Record the length of the text searched."""
+            def __init__(self, pattern):
+                self.regexp = re.compile(pattern)
+                self.lengths = []
+
+            def search(self, text):
+                self.lengths.append(len(text))
+                return self.regexp.search(text)
+
+        took = Regexp(r'took (\d+)ms')
+        response = self.http.get('/oneline.log', stream=True)
+        found = response.search([took], max_line=4096)
+        self.assertEqual('42', found[took].group(1))
+        self.assertLess(max(took.lengths), 2 * 4096 + 8192 + 1)
+
+    def test_cache_conditional_request(self):
+        """Test that a 304 returns the cached parsed body."""
+        self.server.etags['/version'] = '"v1"'
+        cache_dir = tempfile.mkdtemp()
+        try:
+            http = ProbeHTTP('127.0.0.1', port=self.server.server_port,
+                             cache_dir=cache_dir)
+            self.assertEqual('1.2.3', http.get('/version').json()['version'])
+            response = http.get('/version')
+            self.assertTrue(response.from_cache)
+            self.assertEqual('1.2.3', response.jsonpath('version'))
+            self.assertEqual([('/version', 200), ('/version', 304)],
+                             self.server.requests)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_timings(self):
+        """Test durations of request phases."""
+        first = self.http.get('/status')
+        second = self.http.get('/status')
+        self.assertGreater(first.timings['connect'], 0)
+        self.assertEqual(0, second.timings['connect'])
+        self.assertGreaterEqual(second.timings['total'],
+                                second.timings['ttfb'])
+        self.assertIn('transfer', second.timings)
+        self.assertIs(second.timings, self.http.timings)
+
+    def test_plugin_timings(self):
+        """Test --timings adds the phases of the last request to perfdata."""
+        sys.argv = sys.argv[:1] + ['-H', '127.0.0.1',
+                                   '-p', str(self.server.server_port),
+                                   '--timings']
+        plugin = NagiosPluginHTTP()
+        plugin.http.get('/status')
+        plugin.shortoutput = 'Page is up'
+        output = plugin.output()
+        perfdata = output.split('|', 1)[1].split()
+        self.assertEqual(['time_connect', 'time_ttfb', 'time_transfer',
+                          'time_total'],
+                         [data.split('=')[0] for data in perfdata])
+        for data in perfdata:
+            self.assertRegexpMatches(data, r'^time_\w+=\d+(\.\d+)?s;;;0$')
+        # Timings are only reported once
+        self.assertIsNone(plugin.http.timings)
+
+    def test_async_batch(self):
+        """Test requests on many hosts yielding errors as results."""
+        probe = AsyncProbeHTTP(port=self.server.server_port, timeout=5)
+        results = dict(probe.batch(['127.0.0.1', '127.0.0.2'], '/status'))
+        self.assertEqual('OK', results['127.0.0.1'].text)
+        self.assertFalse(results['127.0.0.2'].ok)
+        self.assertIsNone(results['127.0.0.2'].status_code)
+
+    def test_concurrent_requests_profiled(self):
+        """Test get_many and batch are profiled in the calling thread."""
+        probe = AsyncProbeHTTP(port=self.server.server_port, timeout=5)
+        profiler = Profiler()
+        profiler.start('perfdata')
+        try:
+            self.http.get_many(['/status', '/version'])
+            list(probe.batch(['127.0.0.1', '127.0.0.1'], '/status'))
+        finally:
+            profiler.stop()
+        self.assertEqual(3, profiler.timings['http_get'][0])
+
+    def test_async_max_per_host(self):
+        """Test the limit of connections to a host."""
+        probe = AsyncProbeHTTP(port=self.server.server_port, max_per_host=1)
+        results = list(probe.batch(['127.0.0.1'] * 6, '/status'))
+        self.assertEqual(6, len(results))
+        self.assertTrue(all(response.ok for _, response in results))
+        self.assertEqual(1, len(self.server.connections))
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Test module for SNMP probe against a local SNMP agent."""
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+sys.path.insert(0, "..")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+from monitoring.nagios.plugin import NagiosPluginSNMP
+from monitoring.nagios.probes import snmp, mibs
+from monitoring.nagios.probes.snmppoller import SNMPPoller, PolledProbeSNMP, \
+    encode_request
+from monitoring.nagios.probes import ProbeSNMP
+from monitoring.nagios.profiling import Profiler
+from standins import SNMPResponder
+
+SYSTEM = {
+    (1, 3, 6, 1, 2, 1, 1, 1, 0): 'Linux test',
+    (1, 3, 6, 1, 2, 1, 1, 3, 0): 12345,
+    (1, 3, 6, 1, 2, 1, 1, 5, 0): 'agent01',
+}
+IF_DESCR = '1.3.6.1.2.1.2.2.1.2'
+INTERFACES = dict(((1, 3, 6, 1, 2, 1, 2, 2, 1, 2, index), 'eth%d' % index)
+                  for index in xrange(1, 31))
+INTERFACES.update({(1, 3, 6, 1, 2, 1, 2, 2, 1, 3, 1): 6})
+INTERFACES.update(SYSTEM)
+
+
+class TestSNMPCapabilities(unittest.TestCase):
+    """Test discovery and persistence of agent capabilities."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'snmp', 'agent_v2c.pkl')
+        snmp._capabilities.clear()
+
+    def tearDown(self):
+        self.agent.stop()
+        shutil.rmtree(self.folder)
+
+    def probe(self, snmp_version=1):
+        """Return a probe on the local agent with short timeouts."""
+        return ProbeSNMP('127.0.0.1', self.agent.port, community='public',
+                         snmp_version=snmp_version, timeout=0.2, retries=0,
+                         capabilities_file=os.path.join(
+                             self.folder, 'snmp', 'agent_{0}.pkl'.format(
+                                 snmp.SNMP_VERSIONS[snmp_version])))
+
+    def test_bulk_walk(self):
+        """Test a walk with GETBULK and saved capabilities."""
+        self.agent = SNMPResponder(INTERFACES)
+        results = self.probe().getnext({'ifDescr': IF_DESCR})
+        self.assertEqual(['eth%d' % index for index in xrange(1, 31)],
+                         [str(value) for value in results['ifDescr']])
+
+        capabilities = snmp.SNMPCapabilities()
+        self.assertTrue(capabilities.load(self.filename))
+        self.assertEqual(1, capabilities.version)
+        self.assertTrue(capabilities.bulk)
+        self.assertEqual(snmp.MAX_REPETITIONS, capabilities.max_repetitions)
+        self.assertGreater(capabilities.rtt, 0)
+
+        # Next runs reuse capabilities without discovery requests
+        snmp._capabilities.clear()
+        requests = self.agent.requests
+        self.probe().getnext({'ifDescr': IF_DESCR})
+        self.assertEqual(2, self.agent.requests - requests)
+
+    def test_max_repetitions(self):
+        """Test max-repetitions is lowered on tooBig errors."""
+        self.agent = SNMPResponder(INTERFACES, max_repetitions=10)
+        results = self.probe().getnext({'ifDescr': IF_DESCR})
+        self.assertEqual(30, len(results['ifDescr']))
+        self.assertEqual(6, snmp._capabilities[
+            ('127.0.0.1', self.agent.port, 1)].max_repetitions)
+
+    def test_v1_only(self):
+        """Test fallback to SNMP v1 and GETNEXT walks."""
+        self.agent = SNMPResponder(INTERFACES, versions=(0,))
+        probe = self.probe()
+        self.assertEqual('agent01', str(probe.get(
+            {'name': '1.3.6.1.2.1.1.5.0'})['name']))
+        self.assertEqual(0, probe.version)
+        self.assertFalse(probe.capabilities.bulk)
+        self.assertEqual(30, len(probe.getnext(
+            {'ifDescr': IF_DESCR})['ifDescr']))
+
+    def test_v1_asked(self):
+        """Test no discovery requests are sent for SNMP v1."""
+        self.agent = SNMPResponder(SYSTEM)
+        probe = self.probe(snmp_version=0)
+        probe.get({'name': '1.3.6.1.2.1.1.5.0'})
+        self.assertEqual(1, self.agent.requests)
+
+    def test_v1_asked_then_v2c(self):
+        """Test a v1 check does not downgrade v2c checks of the agent."""
+        self.agent = SNMPResponder(INTERFACES)
+        self.probe(snmp_version=0).getnext({'ifDescr': IF_DESCR})
+        probe = self.probe()
+        self.assertEqual(30, len(probe.getnext(
+            {'ifDescr': IF_DESCR})['ifDescr']))
+        self.assertEqual(1, probe.version)
+        self.assertTrue(probe.capabilities.bulk)
+
+    def test_expired(self):
+        """Test old capabilities are discovered again."""
+        self.agent = SNMPResponder(SYSTEM)
+        snmp.SNMPCapabilities(0, False, 1, 0.1, discovered=0).save(
+            self.filename)
+        self.assertFalse(snmp.SNMPCapabilities().load(self.filename))
+        probe = self.probe()
+        probe.get({'name': '1.3.6.1.2.1.1.5.0'})
+        self.assertEqual(1, probe.capabilities.version)
+        self.assertTrue(probe.capabilities.bulk)
+
+
+class TestSNMPWalk(unittest.TestCase):
+    """Test walks yielding values page by page."""
+
+    def setUp(self):
+        snmp._capabilities.clear()
+
+    def tearDown(self):
+        self.agent.stop()
+
+    def probe(self, snmp_version=1):
+        """Return a probe on the local agent."""
+        return ProbeSNMP('127.0.0.1', self.agent.port, community='public',
+                         snmp_version=snmp_version, timeout=0.2, retries=0)
+
+    def test_walk(self):
+        """Test a full walk stops at the end of the subtree."""
+        self.agent = SNMPResponder(INTERFACES, max_repetitions=8)
+        values = list(self.probe().walk(IF_DESCR))
+        self.assertEqual(['eth%d' % index for index in xrange(1, 31)],
+                         [str(value) for value in values])
+        self.assertEqual(30, values[-1].index)
+        self.assertEqual(IF_DESCR + '.30', values[-1].oid)
+
+    def test_walk_profiled(self):
+        """Test each page of a walk is profiled."""
+        self.agent = SNMPResponder(INTERFACES, max_repetitions=8)
+        probe = self.probe()
+        probe.discover()
+        requests = self.agent.requests
+        profiler = Profiler()
+        profiler.start('perfdata')
+        try:
+            list(probe.walk(IF_DESCR))
+            walk_requests = self.agent.requests - requests
+            probe.getnext({'ifDescr': IF_DESCR})
+        finally:
+            profiler.stop()
+        self.assertEqual(walk_requests, profiler.timings['snmp_walk'][0])
+        self.assertEqual(1, profiler.timings['snmp_get'][0])
+
+    def test_walk_stop(self):
+        """Test no more requests are sent when the caller stops."""
+        self.agent = SNMPResponder(INTERFACES)
+        probe = self.probe()
+        probe.discover()
+        requests = self.agent.requests
+        for value in probe.walk(IF_DESCR):
+            if str(value) == 'eth3':
+                break
+        self.assertEqual(3, value.index)
+        self.assertEqual(1, self.agent.requests - requests)
+
+    def test_walk_v1(self):
+        """Test a walk with GETNEXT requests, to the end of the MIB."""
+        self.agent = SNMPResponder(INTERFACES, versions=(0,))
+        values = list(self.probe(snmp_version=0).walk('1.3.6.1.2.1.2.2.1.3'))
+        self.assertEqual([6], [int(value.value) for value in values])
+        self.assertEqual(2, self.agent.requests)
+
+    def test_walk_v2c_end_of_mib(self):
+        """Test a walk of the last subtree of the MIB in SNMP v2c."""
+        self.agent = SNMPResponder(INTERFACES)
+        values = list(self.probe().walk('1.3.6.1.2.1.2.2.1.3'))
+        self.assertEqual([6], [int(value.value) for value in values])
+
+
+class TestSNMPTimeouts(unittest.TestCase):
+    """Test timeouts, retries and the port of SNMP requests."""
+
+    def setUp(self):
+        snmp._capabilities.clear()
+        self.agent = SNMPResponder(SYSTEM)
+
+    def tearDown(self):
+        self.agent.stop()
+
+    def test_backoff(self):
+        """Test retries with a growing timeout on a dead agent."""
+        self.agent.versions = ()
+        probe = ProbeSNMP('127.0.0.1', self.agent.port, community='public',
+                          timeout=0.1, retries=2, backoff=2)
+        start = time.time()
+        self.assertRaises(SystemExit, probe.get,
+                          {'name': '1.3.6.1.2.1.1.5.0'})
+        self.assertAlmostEqual(0.7, time.time() - start, delta=0.3)
+        self.assertEqual(3, self.agent.requests)
+
+    def test_adaptive_timeout(self):
+        """Test the first timeout follows the response time of the agent."""
+        probe = ProbeSNMP('127.0.0.1', self.agent.port, community='public')
+        self.assertEqual(snmp.DEFAULT_TIMEOUT, probe.first_timeout)
+        probe.get({'name': '1.3.6.1.2.1.1.5.0'})
+        self.assertEqual(snmp.ADAPTIVE_TIMEOUT_MIN, probe.first_timeout)
+        probe.capabilities.rtt = 0.5
+        self.assertEqual(2, probe.first_timeout)
+        probe.capabilities.rtt = 3
+        self.assertEqual(snmp.ADAPTIVE_TIMEOUT_MAX, probe.first_timeout)
+
+    def test_plugin_arguments(self):
+        """Test port and timeouts are given to the probe by the plugin."""
+        plugin = NagiosPluginSNMP(argv=[
+            '-H', '127.0.0.1', '-C', 'public', '-p', str(self.agent.port),
+            '--snmp-timeout', '0.5', '--snmp-retries', '3'])
+        self.assertEqual(self.agent.port, plugin.snmp.port)
+        self.assertEqual(0.5, plugin.snmp.timeout)
+        self.assertEqual(3, plugin.snmp.retries)
+        self.assertTrue(plugin.snmp.capabilities_file.endswith(
+            '127.0.0.1_{0}_v1.pkl'.format(self.agent.port)))
+        self.assertEqual('agent01', str(plugin.snmp.get(
+            {'name': '1.3.6.1.2.1.1.5.0'})['name']))
+
+
+class TestMIBSymbols(unittest.TestCase):
+    """Test requests with MIB symbols resolved by the cache file."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.folder, 'mibs', 'symbols.dat')
+        mibs.save_symbols(mibs.compile_symbols(['SNMPv2-MIB']), cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def setUp(self):
+        os.environ[mibs.ENV_SYMBOLS_FILE] = self.filename
+        mibs._symbols = None
+        snmp._capabilities.clear()
+        self.agent = SNMPResponder(SYSTEM)
+        self.probe = ProbeSNMP('127.0.0.1', self.agent.port,
+                               community='public', snmp_version=1,
+                               timeout=0.2, retries=0)
+
+    def tearDown(self):
+        del os.environ[mibs.ENV_SYMBOLS_FILE]
+        mibs._symbols = None
+        self.agent.stop()
+
+    def test_resolve(self):
+        """Test symbols with and without index."""
+        self.assertEqual((1, 3, 6, 1, 2, 1, 1, 5, 0),
+                         mibs.resolve('SNMPv2-MIB::sysName.0'))
+        self.assertEqual((1, 3, 6, 1, 2, 1, 1),
+                         mibs.resolve('SNMPv2-MIB::system'))
+        self.assertRaises(SystemExit, mibs.resolve, 'IF-MIB::ifDescr')
+
+    def test_get(self):
+        """Test a GET with symbols."""
+        results = self.probe.get({'name': 'SNMPv2-MIB::sysName.0',
+                                  'descr': '1.3.6.1.2.1.1.1.0'})
+        self.assertEqual('agent01', str(results['name']))
+        self.assertEqual('Linux test', str(results['descr']))
+
+    def test_walk(self):
+        """Test a walk with a symbol."""
+        values = list(self.probe.walk('SNMPv2-MIB::system'))
+        self.assertEqual(['Linux test', '12345', 'agent01'],
+                         [str(value) for value in values])
+
+    def test_missing_cache(self):
+        """Test an UNKNOWN status without cache file."""
+        os.environ[mibs.ENV_SYMBOLS_FILE] = os.path.join(self.folder, 'none')
+        self.assertRaises(SystemExit, self.probe.get,
+                          {'name': 'SNMPv2-MIB::sysName.0'})
+
+
+class TestSNMPPoller(unittest.TestCase):
+    """Test requests sent through the shared socket of a poller."""
+
+    def setUp(self):
+        snmp._capabilities.clear()
+        self.poller = SNMPPoller(tick=0.01)
+        self.agents = [SNMPResponder(INTERFACES) for _ in xrange(5)]
+
+    def tearDown(self):
+        self.poller.close()
+        for agent in self.agents:
+            agent.stop()
+        NagiosPluginSNMP.poller = None
+
+    def probe(self, agent, snmp_version=1):
+        """Return a probe of the poller on an agent."""
+        return self.poller.probe('127.0.0.1', agent.port, community='public',
+                                 snmp_version=snmp_version, timeout=0.2,
+                                 retries=1)
+
+    def test_probe(self):
+        """Test get, getnext and walk with the API of ProbeSNMP."""
+        probe = self.probe(self.agents[0])
+        self.assertEqual('agent01', str(probe.get(
+            {'name': '1.3.6.1.2.1.1.5.0'})['name']))
+        self.assertTrue(probe.capabilities.bulk)
+        self.assertEqual(30, len(probe.getnext(
+            {'ifDescr': IF_DESCR})['ifDescr']))
+        for value in probe.walk(IF_DESCR):
+            if value.index == 2:
+                break
+        self.assertEqual('eth2', str(value))
+
+    def test_encode_request(self):
+        """Test requests are encoded as pyasn1 does."""
+        for version, pdu_type in ((0, 'get'), (1, 'getnext'), (1, 'getbulk')):
+            pmod = api.protoModules[version]
+            if pdu_type == 'get':
+                pdu = pmod.GetRequestPDU()
+            elif pdu_type == 'getnext':
+                pdu = pmod.GetNextRequestPDU()
+            else:
+                pdu = pmod.GetBulkRequestPDU()
+                pmod.apiBulkPDU.setDefaults(pdu)
+                pmod.apiBulkPDU.setMaxRepetitions(pdu, 200)
+            if pdu_type != 'getbulk':
+                pmod.apiPDU.setDefaults(pdu)
+            pmod.apiPDU.setRequestID(pdu, 0x7fffffff)
+            oids = [(1, 3, 6, 1, 4, 1, 2 ** 32 - 1, 128), (1, 3, 6, 1, 2, 1)]
+            pmod.apiPDU.setVarBinds(pdu,
+                                    [(oid, pmod.Null('')) for oid in oids])
+            message = pmod.Message()
+            pmod.apiMessage.setDefaults(message)
+            pmod.apiMessage.setCommunity(message, 'c' * 200)
+            pmod.apiMessage.setPDU(message, pdu)
+            self.assertEqual(encoder.encode(message),
+                             encode_request(0x7fffffff, 'c' * 200, version,
+                                            pdu_type, oids, 200))
+
+    def test_v1(self):
+        """Test a SNMP v1 walk to the end of the MIB."""
+        probe = self.probe(self.agents[0], snmp_version=0)
+        values = probe.getnext({'type': '1.3.6.1.2.1.2.2.1.3'})['type']
+        self.assertEqual([6], [int(value.value) for value in values])
+
+    def test_many_hosts(self):
+        """Test requests to all agents in flight at the same time."""
+        requests = [self.poller.send(('127.0.0.1', agent.port), 'public', 1,
+                                     'get', [(1, 3, 6, 1, 2, 1, 1, 3, 0)])
+                    for agent in self.agents]
+        for request in requests:
+            error_indication, error_status, varbinds = request.wait()
+            self.assertIsNone(error_indication)
+            self.assertEqual(12345, int(varbinds[0][1]))
+        self.assertEqual({}, self.poller._pending)
+
+    def test_timeout(self):
+        """Test retries and timeout of a dead agent."""
+        agent = self.agents[0]
+        agent.versions = ()
+        start = time.time()
+        request = self.poller.send(('127.0.0.1', agent.port), 'public', 1,
+                                   'get', [(1, 3, 6, 1, 2, 1, 1, 3, 0)],
+                                   timeout=0.1, retries=2, backoff=2)
+        self.assertIsNotNone(request.wait()[0])
+        self.assertAlmostEqual(0.7, time.time() - start, delta=0.3)
+        self.assertEqual(3, agent.requests)
+
+    def test_plugin(self):
+        """Test plugins use the poller when set."""
+        NagiosPluginSNMP.poller = self.poller
+        plugin = NagiosPluginSNMP(argv=[
+            '-H', '127.0.0.1', '-C', 'public', '-2',
+            '-p', str(self.agents[1].port)])
+        self.assertIsInstance(plugin.snmp, PolledProbeSNMP)
+        self.assertEqual('agent01', str(plugin.snmp.get(
+            {'name': '1.3.6.1.2.1.1.5.0'})['name']))
+
+
+if __name__ == '__main__':
+    unittest.main()
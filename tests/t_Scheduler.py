@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Testing module for running plugins in-process and the scheduler."""
+
+import unittest
+import os
+import sys
+import time
+import json
+import shutil
+import logging
+import tempfile
+import threading
+from collections import defaultdict
+
+sys.path.insert(0, "..")
+from monitoring.nagios.plugin import NagiosPlugin
+from monitoring.nagios.profiling import timed
+from monitoring.nagios.runner import run_plugin, ProcessPoolRunner
+from monitoring.nagios.results import CheckResult, CheckResultsWriter
+from monitoring.nagios.results import CommandFileWriter
+from monitoring.nagios.results import BatchCheckResultsWriter
+from monitoring.nagios.scheduler import Scheduler, ScheduledCheck
+
+
+class PluginEcho(NagiosPlugin):
+    """Plugin ending with the status given by -s."""
+    running = defaultdict(int)
+    max_running = defaultdict(int)
+    lock = threading.Lock()
+
+    def define_plugin_arguments(self):
+        super(PluginEcho, self).define_plugin_arguments()
+        self.parser.add_argument('-s', dest='status', type=int, default=0)
+        self.parser.add_argument('--sleep', type=float, default=0)
+
+    def run(self):
+        host = self.options.hostname
+        with self.lock:
+            self.running[host] += 1
+            self.max_running[host] = max(self.max_running[host],
+                                         self.running[host])
+        time.sleep(self.options.sleep)
+        with self.lock:
+            self.running[host] -= 1
+
+        self.shortoutput = 'Host {0} {{x}}'.format(host)
+        self.longoutput = ['line 1']
+        status = [self.ok, self.warning, self.critical, self.unknown]
+        status[self.options.status](self.output())
+
+
+class PluginPid(NagiosPlugin):
+    """Plugin giving its process id, sleeping --sleep seconds before."""
+    def define_plugin_arguments(self):
+        super(PluginPid, self).define_plugin_arguments()
+        self.parser.add_argument('--sleep', type=float, default=0)
+
+    def run(self):
+        time.sleep(self.options.sleep)
+        self.ok(str(os.getpid()))
+
+
+class PluginLogger(NagiosPlugin):
+    """Plugin creating a new logger, which takes the lock of logging."""
+    def run(self):
+        logging.getLogger('tests.scheduler.{0}'.format(os.getpid()))
+        self.ok(str(os.getpid()))
+
+
+class PluginQueries(NagiosPlugin):
+    """Plugin doing --queries profiled queries of 50 ms."""
+    def define_plugin_arguments(self):
+        super(PluginQueries, self).define_plugin_arguments()
+        self.parser.add_argument('--queries', type=int, default=1)
+
+    @timed('query')
+    def query(self):
+        time.sleep(0.05)
+
+    def run(self):
+        for _ in xrange(self.options.queries):
+            self.query()
+        self.ok('{0} queries'.format(self.options.queries))
+
+
+class ListWriter(object):
+    """Keep results in a list."""
+    def __init__(self):
+        self.results = []
+        self.closed = False
+
+    def write(self, result):
+        self.results.append(result)
+
+    def close(self):
+        self.closed = True
+
+
+class TestRunner(unittest.TestCase):
+    """Test running plugins in-process."""
+
+    def test_run_plugin(self):
+        """Test status and captured output of a plugin."""
+        result = run_plugin(PluginEcho, ['-H', 'srv01', '-s', '1'],
+                            'srv01', 'Echo')
+        self.assertEqual(1, result.status)
+        self.assertEqual('WARNING - Host srv01 {x}\nline 1', result.output)
+
+    def test_run_plugin_bad_arguments(self):
+        """Test UNKNOWN result on invalid arguments."""
+        result = run_plugin(PluginEcho, ['-s', '1'])
+        self.assertEqual(3, result.status)
+        self.assertIn('-H', result.output)
+
+    def test_run_plugin_without_status(self):
+        """Test UNKNOWN result of a plugin without run()."""
+        result = run_plugin(NagiosPlugin, ['-H', 'srv01'])
+        self.assertEqual(3, result.status)
+        self.assertIn('does not implement run()', result.output)
+
+    def test_run_plugin_profiled(self):
+        """Test checks run at the same time are profiled separately."""
+        queries = {'srv01': 1, 'srv02': 3}
+        threads = [threading.Thread(target=run_plugin, args=(
+            PluginQueries, ['-H', host, '--queries', str(count),
+                            '--profile', 'json']), kwargs={'name': 'Queries'})
+            for host, count in queries.iteritems()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        directory = os.path.join('/var/tmp/plugin', os.environ.get(
+            'NAGIOSENV', ''), 'profile')
+        for host, count in queries.iteritems():
+            filename = os.path.join(directory,
+                                    'Queries_{0}.json'.format(host))
+            try:
+                with open(filename) as profile:
+                    timings = json.load(profile)['timings']
+            finally:
+                os.remove(filename)
+            self.assertEqual(count, timings['query']['count'])
+
+
+class TestProcessPoolRunner(unittest.TestCase):
+    """Test running plugins in worker processes."""
+
+    def setUp(self):
+        self.pool = ProcessPoolRunner(processes=2, deadline=1, max_checks=3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_run(self):
+        """Test a plugin is run in another process."""
+        result = self.pool.run(PluginPid, ['-H', 'srv01'], 'srv01', 'Pid')
+        self.assertEqual(0, result.status)
+        self.assertEqual('srv01', result.host)
+        self.assertNotEqual(os.getpid(), int(result.output.split()[-1]))
+
+    def test_deadline(self):
+        """Test a check exceeding the deadline is killed, others go on."""
+        results = {}
+
+        def run(name, sleep):
+            results[name] = self.pool.run(
+                PluginPid, ['-H', name, '--sleep', str(sleep)], name)
+
+        threads = [threading.Thread(target=run, args=('hung', 30)),
+                   threading.Thread(target=run, args=('fast', 0))]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(3, results['hung'].status)
+        self.assertIn('killed after 1 seconds', results['hung'].output)
+        self.assertEqual(0, results['fast'].status)
+
+        # Killed worker is replaced
+        for _ in xrange(4):
+            result = self.pool.run(PluginPid, ['-H', 'srv01'])
+            self.assertEqual(0, result.status)
+
+    def test_recycle(self):
+        """Test workers are replaced after max_checks checks."""
+        pool = ProcessPoolRunner(processes=1, max_checks=3)
+        try:
+            pids = [pool.run(PluginPid, ['-H', 'srv01']).output.split()[-1]
+                    for _ in xrange(6)]
+        finally:
+            pool.close()
+        self.assertEqual(1, len(set(pids[:3])))
+        self.assertEqual(1, len(set(pids[3:])))
+        self.assertNotEqual(pids[0], pids[3])
+
+    def test_replace_while_lock_held(self):
+        """Test workers replaced while a thread holds a lock can take it."""
+        pool = ProcessPoolRunner(processes=1, deadline=5, max_checks=1)
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_logging_lock():
+            logging._acquireLock()
+            try:
+                locked.set()
+                release.wait()
+            finally:
+                logging._releaseLock()
+
+        thread = threading.Thread(target=hold_logging_lock)
+        thread.start()
+        try:
+            locked.wait()
+            # Recycled worker is replaced while the lock is held
+            first = pool.run(PluginLogger, ['-H', 'srv01'])
+            release.set()
+            thread.join()
+            second = pool.run(PluginLogger, ['-H', 'srv01'])
+        finally:
+            release.set()
+            pool.close()
+        self.assertEqual(0, first.status)
+        self.assertEqual(0, second.status)
+        self.assertNotEqual(first.output, second.output)
+
+
+class TestResultsWriters(unittest.TestCase):
+    """Test writers of passive results."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.result = CheckResult('srv01', 'Disk', 2, 'CRITICAL - full\n/var',
+                                  1400000000.0, 1400000001.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_checkresults_file(self):
+        """Test a check result file and its marker."""
+        CheckResultsWriter(self.directory).write(self.result)
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(2, len(files))
+        self.assertEqual(files[0] + '.ok', files[1])
+        self.assertTrue(files[0].startswith('c'))
+        with open(os.path.join(self.directory, files[0])) as result_file:
+            content = result_file.read()
+        self.assertIn('service_description=Disk\n', content)
+        self.assertIn('return_code=2\n', content)
+        self.assertIn('output=CRITICAL - full\\n/var\n', content)
+
+    def test_batch_checkresults(self):
+        """Test results written by batches."""
+        writer = BatchCheckResultsWriter(self.directory, flush_size=3,
+                                         flush_interval=60)
+        for _ in range(4):
+            writer.write(self.result)
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        writer.close()
+        files = sorted(name for name in os.listdir(self.directory)
+                       if not name.endswith('.ok'))
+        self.assertEqual(2, len(files))
+        counts = []
+        for name in files:
+            self.assertTrue(os.path.exists(
+                os.path.join(self.directory, name + '.ok')))
+            with open(os.path.join(self.directory, name)) as result_file:
+                counts.append(result_file.read().count('host_name=srv01'))
+        self.assertEqual([1, 3], sorted(counts))
+
+    def test_batch_flush_interval(self):
+        """Test results written after the flush interval."""
+        writer = BatchCheckResultsWriter(self.directory, flush_size=100,
+                                         flush_interval=0.05)
+        writer.write(self.result)
+        time.sleep(0.2)
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        writer.close()
+
+    def test_command_file(self):
+        """Test external command of a service result."""
+        path = os.path.join(self.directory, 'nagios.cmd')
+        writer = CommandFileWriter(path)
+        writer.write(self.result)
+        writer.close()
+        with open(path) as command_file:
+            self.assertEqual('[1400000001] PROCESS_SERVICE_CHECK_RESULT;'
+                             'srv01;Disk;2;CRITICAL - full\\n/var\n',
+                             command_file.read())
+
+
+class TestScheduler(unittest.TestCase):
+    """Test scheduling of checks."""
+
+    def test_schedule(self):
+        """Test periodic runs with a limit by host."""
+        checks = [ScheduledCheck(PluginEcho,
+                                 ['-H', host, '--sleep', '0.05'], 0.1,
+                                 service='Echo {0}'.format(i))
+                  for i, host in enumerate(['srv01', 'srv01', 'srv01',
+                                            'srv02'])]
+        writer = ListWriter()
+        Scheduler(checks, writer, workers=4, per_target=1).run(0.5)
+
+        self.assertTrue(writer.closed)
+        services = set(result.service for result in writer.results)
+        self.assertEqual(4, len(services))
+        self.assertTrue(all(result.status == 0
+                            for result in writer.results))
+        self.assertEqual(1, PluginEcho.max_running['srv01'])
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Vincent BESANCON <besancon.vincent@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Testing module for Nagios thresholds."""
+
+import argparse
+import unittest
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, "..")
+from monitoring.nagios.plugin import argument
+from monitoring.nagios.plugin.argument import (NagiosThreshold,
+                                               check_thresholds, threshold,
+                                               load_thresholds)
+
+
+class TestThreshold(unittest.TestCase):
+    """Test threshold parsing and tests."""
+
+    def test_ranges(self):
+        """Test the range formats of the guidelines."""
+        cases = {
+            '10': ([-1, 11], [0, 5, 10]),
+            '10:': ([9.9, -5], [10, 1e9]),
+            '~:10': ([10.5], [-1e9, 10]),
+            '10:20': ([9, 21], [10, 15, 20]),
+            '@10:20': ([10, 15, 20], [9, 21]),
+            '-5.5:-1': ([-6, 0], [-5.5, -3, -1]),
+        }
+        for threshold, (alerts, oks) in cases.iteritems():
+            t = NagiosThreshold(threshold)
+            for value in alerts:
+                self.assertTrue(t.test(value), (threshold, value))
+            for value in oks:
+                self.assertFalse(t.test(value), (threshold, value))
+
+    def test_invalid(self):
+        """Test invalid thresholds."""
+        for threshold in ('', '@', 'abc', '20:10', '1:2:3'):
+            self.assertRaises(argparse.ArgumentTypeError,
+                              NagiosThreshold, threshold)
+
+    def test_check_thresholds(self):
+        """Test statuses of many values."""
+        values = [-1, 50, 85, 95, 100]
+        warning, critical = NagiosThreshold('80'), NagiosThreshold('0:90')
+        self.assertEqual([2, 0, 1, 2, 2],
+                         list(check_thresholds(values, warning, critical)))
+        self.assertEqual([1, 0, 1, 1, 1],
+                         list(check_thresholds(values, warning)))
+
+    def test_check_thresholds_pure_python(self):
+        """Test statuses of many values without NumPy."""
+        saved = argument.numpy, argument._numpy_imported
+        argument.numpy, argument._numpy_imported = None, True
+        try:
+            statuses = check_thresholds([50, 85, 95], NagiosThreshold('80'),
+                                        NagiosThreshold('90'))
+            self.assertEqual([0, 1, 2], statuses)
+        finally:
+            argument.numpy, argument._numpy_imported = saved
+
+
+class TestThresholdFactory(unittest.TestCase):
+    """Test cached thresholds and thresholds files."""
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def write(self, content):
+        with open(self.filename, 'w') as config:
+            config.write(content)
+
+    def test_interning(self):
+        """Test that identical specs give the same threshold."""
+        self.assertIs(threshold('@1.5:3'), threshold('@1.5:3'))
+        self.assertRaises(AttributeError, setattr, threshold('5'), 'x', 1)
+
+    def test_load_thresholds(self):
+        """Test loading thresholds from a file."""
+        self.write('# Filesystem Warning Critical\n'
+                   '/     80 90\n'
+                   '\n'
+                   '/var  @0:5\n')
+        thresholds = load_thresholds(self.filename)
+        self.assertEqual(['/', '/var'], sorted(thresholds))
+        self.assertIs(threshold('90'), thresholds['/'][1])
+        self.assertTrue(thresholds['/var'][0].test(2))
+        self.assertIsNone(thresholds['/var'][1])
+
+    def test_load_thresholds_error(self):
+        """Test line number in errors of thresholds file."""
+        self.write('/ 80 90\n/var abc\n')
+        with self.assertRaises(argparse.ArgumentTypeError) as context:
+            load_thresholds(self.filename)
+        self.assertIn('Line 2', str(context.exception))
@@ -22,10 +22,20 @@
 """Test module for WMI based plugins."""
 
 import unittest
+import os
 import sys
+import time
+import shutil
+import subprocess as sp
 
 sys.path.insert(0, "..")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
 from monitoring.nagios.plugin import NagiosPluginWMI
+from monitoring.nagios.plugin import wmi
+from monitoring.nagios.probes.wmi import parse_wmic_output, wmi_datetime
+from monitoring.nagios.probes.wmi import ProbeWMI
+from standins import FakeWMIC
 
 
 class TestWMIPlugin(unittest.TestCase):
@@ -45,3 +55,220 @@ class TestWMIPlugin(unittest.TestCase):
         """Test retrieving host name using WMI."""
         result = self.plugin.execute('SELECT * FROM Win32_OperatingSystem')
         self.assertEqual(result[0]['CSName'], 'WWGRPCTS6401')
+
+
+class TestWMIExecuteMany(unittest.TestCase):
+    """Test running several WMI queries with a fake wmic."""
+    queries = {
+        'cpu': 'SELECT LoadPercentage FROM Win32_Processor',
+        'memory': 'SELECT FreePhysicalMemory FROM Win32_OperatingSystem',
+        'disks': 'SELECT Name, FreeSpace FROM Win32_LogicalDisk',
+    }
+    outputs = {
+        queries['cpu']: 'CLASS: Win32_Processor\nLoadPercentage\n12\n',
+        queries['memory']: 'CLASS: Win32_OperatingSystem\n'
+                           'FreePhysicalMemory\n2048\n',
+        queries['disks']: 'CLASS: Win32_LogicalDisk\nFreeSpace|Name\n'
+                          '100|C:\n200|D:\n',
+    }
+
+    def setUp(self):
+        # The first query answers last
+        self.wmic = FakeWMIC(self.outputs,
+                             delays={self.queries['cpu']: 0.3})
+        self.probe = ProbeWMI('127.0.0.1', 'nagios', 'secret', 'CORP')
+
+    def tearDown(self):
+        self.wmic.stop()
+
+    def test_probe_results_by_name(self):
+        """Test each output is returned under the name of its query."""
+        start = time.time()
+        outputs = self.probe.execute_many(self.queries)
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual(set(self.queries), set(outputs))
+        for name, query in self.queries.iteritems():
+            self.assertEqual(self.outputs[query], outputs[name])
+
+    def test_probe_error(self):
+        """Test a failed query raises and kills other processes."""
+        queries = dict(self.queries, bad='SELECT * FROM Win32_Missing')
+        with self.assertRaises(sp.CalledProcessError) as context:
+            self.probe.execute_many(queries)
+        self.assertEqual(queries['bad'], context.exception.cmd[-1])
+        self.assertIn('ERROR', context.exception.output)
+
+    def test_plugin_results(self):
+        """Test parsed records are returned by name of query."""
+        sys.argv = sys.argv[:1] + ['-H', '127.0.0.1', '-l', 'nagios',
+                                   '-p', 'secret', '-d', 'CORP']
+        plugin = NagiosPluginWMI()
+        results = plugin.execute_many(
+            self.queries, schemas={'*': {'LoadPercentage': int,
+                                         'FreePhysicalMemory': int,
+                                         'FreeSpace': int}})
+        self.assertEqual(12, results['cpu'][0]['LoadPercentage'])
+        self.assertEqual(2048, results['memory'][0]['FreePhysicalMemory'])
+        self.assertEqual([('C:', 100), ('D:', 200)],
+                         [(disk['Name'], disk['FreeSpace'])
+                          for disk in results['disks']])
+
+    def test_plugin_profiled(self):
+        """Test streamed queries are profiled."""
+        sys.argv = sys.argv[:1] + ['-H', '127.0.0.1', '-l', 'nagios',
+                                   '-p', 'secret', '-d', 'CORP',
+                                   '--profile', 'perfdata']
+        plugin = NagiosPluginWMI()
+        try:
+            plugin.execute(self.queries['memory'])
+            for _ in plugin.iter_execute(self.queries['disks']):
+                break
+        finally:
+            plugin.profiler.stop()
+        self.assertEqual(2, plugin.profiler.timings['wmi_execute'][0])
+
+    def test_plugin_error(self):
+        """Test the plugin exits UNKNOWN when a query fails."""
+        sys.argv = sys.argv[:1] + ['-H', '127.0.0.1', '-l', 'nagios',
+                                   '-p', 'secret', '-d', 'CORP']
+        plugin = NagiosPluginWMI()
+        queries = dict(self.queries, bad='SELECT * FROM Win32_Missing')
+        with self.assertRaises(SystemExit) as context:
+            plugin.execute_many(queries)
+        self.assertEqual(3, context.exception.code)
+
+
+class TestWMIPerfCountersRetention(unittest.TestCase):
+    """Test samples of performance counters kept between runs."""
+    wmi_class = 'Win32_PerfRawData_PerfOS_Processor'
+    cpu = {'PercentProcessorTime': wmi.PERF_100NSEC_TIMER_INV}
+    interrupts = {'InterruptsPersec': wmi.PERF_COUNTER_COUNTER}
+    cpu_query = 'SELECT Name,PercentProcessorTime,Timestamp_Sys100NS FROM ' \
+        'Win32_PerfRawData_PerfOS_Processor'
+    interrupts_query = 'SELECT Name,Frequency_PerfTime,InterruptsPersec,' \
+        'Timestamp_PerfTime FROM Win32_PerfRawData_PerfOS_Processor'
+
+    def setUp(self):
+        self.nagiosenv = os.environ.get('NAGIOSENV')
+        os.environ['NAGIOSENV'] = 'test_wmi_{0}'.format(os.getpid())
+
+    def tearDown(self):
+        shutil.rmtree('/var/tmp/plugin/{0}'.format(os.environ['NAGIOSENV']),
+                      ignore_errors=True)
+        if self.nagiosenv is None:
+            del os.environ['NAGIOSENV']
+        else:
+            os.environ['NAGIOSENV'] = self.nagiosenv
+
+    def run_check(self, cpu, timestamp, interrupts, perftime):
+        """Run a check getting both counter sets of the class."""
+        header = 'CLASS: {0}\n'.format(self.wmi_class)
+        wmic = FakeWMIC({
+            self.cpu_query: header + 'Name|PercentProcessorTime|'
+            'Timestamp_Sys100NS\n_Total|{0}|{1}\n'.format(cpu, timestamp),
+            self.interrupts_query: header + 'Frequency_PerfTime|'
+            'InterruptsPersec|Name|Timestamp_PerfTime\n'
+            '1000|{0}|_Total|{1}\n'.format(interrupts, perftime),
+        })
+        try:
+            plugin = NagiosPluginWMI(argv=['-H', '127.0.0.1', '-l', 'nagios',
+                                           '-p', 'secret', '-d', 'CORP'])
+            return (plugin.perf_counters(self.wmi_class, self.cpu),
+                    plugin.perf_counters(self.wmi_class, self.interrupts))
+        finally:
+            wmic.stop()
+
+    def test_two_counter_sets(self):
+        """Test counter sets of the same class keep their own samples."""
+        cpu, interrupts = self.run_check(100, 1000, 1000, 10000)
+        self.assertIsNone(cpu['_Total']['PercentProcessorTime'])
+        self.assertIsNone(interrupts['_Total']['InterruptsPersec'])
+
+        cpu, interrupts = self.run_check(200, 1400, 3000, 20000)
+        self.assertEqual(75, cpu['_Total']['PercentProcessorTime'])
+        self.assertEqual(200, interrupts['_Total']['InterruptsPersec'])
+
+
+class TestWMIParser(unittest.TestCase):
+    """Test parsing of wmic output."""
+    output = [
+        'CLASS: Win32_NTLogEvent\r\n',
+        'EventCode|Message|TimeGenerated\r\n',
+        '7036|Service entered\r\n',
+        'the running state.|20140321101234.000000+060\r\n',
+        '7040|(null)|20140321101300.000000+060\r\n',
+        'CLASS: Win32_Service\r\n',
+        'Name|State\r\n',
+        'Spooler|Running|extra\r\n',
+    ]
+    schemas = {
+        'Win32_NTLogEvent': {
+            'EventCode': int,
+            'Message': str,
+            'TimeGenerated': wmi_datetime,
+        },
+    }
+
+    def test_parse_records(self):
+        """Test typed records and class headers."""
+        records = list(parse_wmic_output(self.output, self.schemas))
+        self.assertEqual(3, len(records))
+        self.assertEqual(7036, records[0]['EventCode'])
+        self.assertEqual('Service entered\nthe running state.',
+                         records[0]['Message'])
+        self.assertEqual(2014, records[0]['TimeGenerated'].year)
+        self.assertIsNone(records[1]['Message'])
+        self.assertEqual('Win32_Service', records[2].wmi_class)
+        self.assertEqual('Running', records[2]['State'])
+        self.assertEqual(['extra'], records[2][None])
+
+    def test_parse_early_termination(self):
+        """Test that lines are consumed lazily."""
+        lines = iter(self.output)
+        records = parse_wmic_output(lines)
+        self.assertEqual('7036', next(records)['EventCode'])
+        self.assertEqual(self.output[4], next(lines))
+
+
+class TestWMIPerfCounters(unittest.TestCase):
+    """Test computing raw performance counters."""
+    previous = {
+        'InterruptsPersec': 1000,
+        'Timestamp_PerfTime': 10000,
+        'Frequency_PerfTime': 1000,
+        'PercentProcessorTime': 100,
+        'Timestamp_Sys100NS': 1000,
+    }
+    current = {
+        'InterruptsPersec': 3000,
+        'Timestamp_PerfTime': 20000,
+        'Frequency_PerfTime': 1000,
+        'PercentProcessorTime': 200,
+        'Timestamp_Sys100NS': 1400,
+    }
+
+    def test_counter_rate(self):
+        """Test PERF_COUNTER_COUNTER rate per second."""
+        value = wmi.counter_value(wmi.PERF_COUNTER_COUNTER,
+                                  'InterruptsPersec',
+                                  self.previous, self.current)
+        self.assertEqual(200, value)
+
+    def test_counter_timer_inv(self):
+        """Test PERF_100NSEC_TIMER_INV percent."""
+        value = wmi.counter_value(wmi.PERF_100NSEC_TIMER_INV,
+                                  'PercentProcessorTime',
+                                  self.previous, self.current)
+        self.assertEqual(75, value)
+
+    def test_counter_without_previous(self):
+        """Test that rates need a previous sample."""
+        self.assertIsNone(wmi.counter_value(wmi.PERF_COUNTER_COUNTER,
+                                            'InterruptsPersec',
+                                            None, self.current))
+
+    def test_counter_reset(self):
+        """Test that a counter reset does not give a negative rate."""
+        self.assertIsNone(wmi.counter_value(wmi.PERF_COUNTER_COUNTER,
+                                            'InterruptsPersec',
+                                            self.current, self.previous))